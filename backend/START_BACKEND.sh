@@ -17,7 +17,7 @@ pip install -r requirements.txt
 
 # Initialize database
 echo "[3/4] Initializing database..."
-python -c "from app.database import engine, Base; from app import models; Base.metadata.create_all(bind=engine); print('Database ready!')"
+python -m app.init_db
 
 # Start the FastAPI server
 echo "[4/4] Starting FastAPI server..."
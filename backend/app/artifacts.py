@@ -0,0 +1,77 @@
+# app/artifacts.py
+import os
+from functools import lru_cache
+from . import zonal
+
+# Optional imports - handle gracefully if not available
+try:
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+    print("Warning: PyArrow not installed. Intermediate crown tables will be unavailable.")
+
+try:
+    import geopandas as gpd
+    HAS_GEOPANDAS = True
+except ImportError:
+    HAS_GEOPANDAS = False
+    print("Warning: GeoPandas not installed. Vector processing will be limited.")
+
+# --- Per-Project Artifact Layout ---
+# Stages hand crowns to each other as a GeoParquet table; the GeoPackage is only
+# written once at the end of the chain as a user-facing export.
+CROWNS_TABLE = "tree_crowns.parquet"
+CROWNS_EXPORT = "tree_crowns.gpkg"
+CROWN_METRIC_COLUMNS = ["label_id", "crown_area_sqm"] + zonal.HEIGHT_COLUMNS
+
+
+def write_crown_table(crowns: "gpd.GeoDataFrame", project_dir: str) -> str:
+    """Writes the crown table handed from segment_trees to calculate_carbon."""
+    crowns_path = os.path.join(project_dir, CROWNS_TABLE)
+    crowns.to_parquet(crowns_path, index=False, compression="zstd")
+    return crowns_path
+
+
+def read_crown_metrics(crowns_path: str, columns: list = CROWN_METRIC_COLUMNS):
+    """
+    Reads only the per-tree metric columns from a crown table through a memory map,
+    skipping geometry decoding entirely. Returns None when the table predates the
+    requested columns (e.g. the stored heights, or tile_id of tiled segmentation).
+    """
+    if not set(columns).issubset(pq.read_schema(crowns_path).names):
+        return None
+    return pq.read_table(crowns_path, columns=list(columns), memory_map=True).to_pandas()
+
+
+@lru_cache(maxsize=32)
+def _cached_tree_metrics(crowns_path: str, inode: int, mtime_ns: int):
+    table = pq.read_table(crowns_path, columns=["height_max_m", "crown_area_sqm"], memory_map=True)
+    return {
+        "height_m": table.column("height_max_m").to_numpy(),
+        "crown_area_sqm": table.column("crown_area_sqm").to_numpy(),
+    }
+
+
+def load_tree_metrics(crowns_path: str):
+    """
+    Height and crown-area columns of a crown table as NumPy arrays, kept in a small
+    per-process cache keyed by inode and mtime. Returns None when no usable table exists.
+    """
+    if not os.path.exists(crowns_path):
+        return None
+    if not set(CROWN_METRIC_COLUMNS).issubset(pq.read_schema(crowns_path).names):
+        return None
+    stat = os.stat(crowns_path)
+    return _cached_tree_metrics(crowns_path, stat.st_ino, stat.st_mtime_ns)
+
+
+def read_crowns(crowns_path: str) -> "gpd.GeoDataFrame":
+    return gpd.read_parquet(crowns_path)
+
+
+def export_crowns_gpkg(crowns_path: str, project_dir: str) -> str:
+    """Produces the final tree_crowns.gpkg export from the intermediate crown table."""
+    export_path = os.path.join(project_dir, CROWNS_EXPORT)
+    read_crowns(crowns_path).to_file(export_path, driver="GPKG")
+    return export_path
@@ -0,0 +1,57 @@
+# app/batches.py
+from collections import Counter
+
+# --- Batch Settings ---
+MAX_BATCH_PROJECTS = 500
+
+# Every project status falls into one of these phases; a batch reports counts per phase
+PHASES = ("pending", "queued", "processing", "completed", "failed")
+
+
+def project_phase(status: str) -> str:
+    """Maps a project status string (e.g. "PROCESSING: SEGMENTING TREES") onto a phase."""
+    status = status or ""
+    if status.startswith("COMPLETED"):
+        return "completed"
+    if status.startswith("FAILED"):
+        return "failed"
+    if status.startswith("PROCESSING"):
+        return "processing"
+    if status == "ACCEPTED":
+        return "queued"
+    return "pending"
+
+
+def phase_counts(status_counts) -> dict:
+    """Folds (status, count) rows into a count per phase."""
+    counts = Counter({phase: 0 for phase in PHASES})
+    for status, count in status_counts:
+        counts[project_phase(status)] += count
+    return dict(counts)
+
+
+def batch_status(counts: dict) -> str:
+    """Overall state of a batch from its phase counts."""
+    total = sum(counts.values())
+    finished = counts["completed"] + counts["failed"]
+    if total and finished == total:
+        if counts["failed"] == 0:
+            return "COMPLETED"
+        return "FAILED" if counts["completed"] == 0 else "COMPLETED_WITH_ERRORS"
+    if counts["queued"] or counts["processing"] or finished:
+        return "PROCESSING"
+    return "PENDING_UPLOAD"
+
+
+def summarize(projects) -> dict:
+    """Aggregated status of a batch from its projects' (status, total_co2_tonnes) pairs."""
+    projects = list(projects)
+    counts = phase_counts((status, 1) for status, _ in projects)
+    total = sum(counts.values())
+    return {
+        "status": batch_status(counts),
+        "project_count": total,
+        "phase_counts": counts,
+        "percent_finished": round(100.0 * (counts["completed"] + counts["failed"]) / total, 1) if total else 0.0,
+        "total_co2_tonnes": sum(co2 for status, co2 in projects if project_phase(status) == "completed" and co2),
+    }
@@ -0,0 +1,168 @@
+# app/cache.py
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+# --- Stage Cache Settings ---
+# Every pipeline stage stores its outputs under a key derived from its parameters and
+# the key (or content digest) of its input, so re-running a project only recomputes
+# the stages whose inputs or parameters actually changed.
+STAGE_CACHE_ENABLED = os.getenv("STAGE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+STAGE_CACHE_DIRECTORY = os.getenv(
+    "STAGE_CACHE_DIRECTORY", os.path.join(os.getenv("DATA_DIRECTORY", "."), "stage_cache")
+)
+STAGE_CACHE_MAX_BYTES = int(os.getenv("STAGE_CACHE_MAX_BYTES", 50 * 1024 ** 3))
+HASH_CHUNK_BYTES = 8 * 1024 * 1024
+MANIFEST_NAME = "manifest.json"
+
+
+def _entries_dir() -> str:
+    return os.path.join(STAGE_CACHE_DIRECTORY, "entries")
+
+
+def _entry_dir(key: str) -> str:
+    return os.path.join(_entries_dir(), key[:2], key)
+
+
+def _link_or_copy(src: str, dst: str):
+    """Hard-links src to dst (atomically replacing dst), falling back to a copy across devices."""
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+    # rename() is a no-op between two links to the same inode, so the temporary
+    # name must never be left behind as an alias of the cached file.
+    tmp_path = f"{dst}.{os.getpid()}.tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(src, tmp_path)
+    except OSError:
+        shutil.copy2(src, tmp_path)
+    os.replace(tmp_path, dst)
+
+
+def file_digest(path: str) -> str:
+    """
+    SHA-256 of a file's content. Digests are memoized by (path, size, mtime) so a
+    multi-GB DSM is only hashed again after it changes.
+    """
+    stat = os.stat(path)
+    memo_key = hashlib.sha256(
+        f"{os.path.realpath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+    ).hexdigest()
+    memo_path = os.path.join(STAGE_CACHE_DIRECTORY, "digests", memo_key)
+    if os.path.exists(memo_path):
+        with open(memo_path) as memo:
+            return memo.read().strip()
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    hexdigest = digest.hexdigest()
+
+    os.makedirs(os.path.dirname(memo_path), exist_ok=True)
+    with open(memo_path, "w") as memo:
+        memo.write(hexdigest)
+    return hexdigest
+
+
+def stage_key(stage: str, upstream: str, params: dict) -> str:
+    """Content address of a stage run: its name, its input's key/digest and its parameters."""
+    payload = json.dumps({"stage": stage, "upstream": upstream, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def detach(*paths: str):
+    """
+    Unlinks output paths that may be hard links into the cache, so a stage that is
+    about to rewrite them in place cannot corrupt a cached entry.
+    """
+    for path in paths:
+        if os.path.lexists(path):
+            os.remove(path)
+
+
+def fetch(key: str, project_dir: str):
+    """
+    Restores a cached stage into project_dir. Returns {"files": {name: path}, "values": {...}}
+    or None on a miss.
+    """
+    if not STAGE_CACHE_ENABLED:
+        return None
+
+    entry_dir = _entry_dir(key)
+    manifest_path = os.path.join(entry_dir, MANIFEST_NAME)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        files = {}
+        for name in manifest["files"]:
+            files[name] = os.path.join(project_dir, name)
+            _link_or_copy(os.path.join(entry_dir, name), files[name])
+    except (OSError, ValueError, KeyError):
+        return None
+
+    # Touching the manifest records the hit for LRU eviction
+    os.utime(manifest_path)
+    return {"files": files, "values": manifest.get("values", {})}
+
+
+def store(key: str, files: dict, values: dict = None):
+    """Adds a stage's output files ({name: path}) and JSON-able values to the cache, then evicts."""
+    if not STAGE_CACHE_ENABLED:
+        return
+
+    entry_dir = _entry_dir(key)
+    if os.path.exists(entry_dir):
+        os.utime(os.path.join(entry_dir, MANIFEST_NAME))
+        return
+
+    try:
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=f".{key}.", dir=os.path.dirname(entry_dir))
+        for name, path in files.items():
+            _link_or_copy(path, os.path.join(staging_dir, name))
+        with open(os.path.join(staging_dir, MANIFEST_NAME), "w") as f:
+            json.dump({"files": sorted(files), "values": values or {}, "created": time.time()}, f)
+        try:
+            os.rename(staging_dir, entry_dir)
+        except OSError:
+            # Another worker stored the same key first
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    except OSError as e:
+        print(f"Warning: could not store stage cache entry {key[:12]}: {e}")
+        return
+
+    evict()
+
+
+def _entry_size(entry_dir: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+
+
+def evict(max_bytes: int = None):
+    """Deletes least-recently-used entries until the cache fits in max_bytes."""
+    max_bytes = STAGE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    total = 0
+    if not os.path.isdir(_entries_dir()):
+        return
+    for shard in os.scandir(_entries_dir()):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            manifest_path = os.path.join(entry.path, MANIFEST_NAME)
+            if entry.name.startswith(".") or not os.path.exists(manifest_path):
+                continue
+            size = _entry_size(entry.path)
+            entries.append((os.stat(manifest_path).st_mtime, size, entry.path))
+            total += size
+
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
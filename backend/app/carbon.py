@@ -0,0 +1,84 @@
+# app/carbon.py
+import numpy as np
+from . import metrics
+
+# --- Placeholder Scientific & Filter Coefficients ---
+MAX_REALISTIC_TREE_HEIGHT_M = 50.0
+MAX_REALISTIC_CROWN_AREA_SQM = 500.0
+MIN_REALISTIC_TREE_HEIGHT_M = 0.5
+MIN_REALISTIC_CROWN_AREA_SQM = 0.5
+DBH_FROM_HEIGHT_SLOPE = 0.3
+DBH_FROM_HEIGHT_INTERCEPT = 0.1
+WOOD_DENSITY_RHO = 0.65
+ALLOM_COEFF_A = 0.1
+ALLOM_COEFF_B = 2.46
+BGB_TO_AGB_RATIO = 0.5
+CARBON_FRACTION = 0.47
+CO2_CONVERSION_FACTOR = 3.67
+
+PARAMETER_NAMES = (
+    "MAX_REALISTIC_TREE_HEIGHT_M",
+    "MAX_REALISTIC_CROWN_AREA_SQM",
+    "MIN_REALISTIC_TREE_HEIGHT_M",
+    "MIN_REALISTIC_CROWN_AREA_SQM",
+    "DBH_FROM_HEIGHT_SLOPE",
+    "DBH_FROM_HEIGHT_INTERCEPT",
+    "WOOD_DENSITY_RHO",
+    "ALLOM_COEFF_A",
+    "ALLOM_COEFF_B",
+    "BGB_TO_AGB_RATIO",
+    "CARBON_FRACTION",
+    "CO2_CONVERSION_FACTOR",
+)
+
+
+def carbon_parameters(overrides: dict = None) -> dict:
+    """Current filter and allometry coefficients, optionally with some of them overridden."""
+    params = {name: globals()[name] for name in PARAMETER_NAMES}
+    if overrides:
+        unknown = set(overrides) - set(PARAMETER_NAMES)
+        if unknown:
+            raise KeyError(f"Unknown carbon parameters: {', '.join(sorted(unknown))}")
+        params.update({name: float(value) for name, value in overrides.items()})
+    return params
+
+
+def valid_tree_mask(height_m: np.ndarray, crown_area_sqm: np.ndarray, params: dict) -> np.ndarray:
+    """Trees whose height and crown area fall inside the realistic ranges."""
+    return (
+        (crown_area_sqm >= params["MIN_REALISTIC_CROWN_AREA_SQM"]) &
+        (crown_area_sqm <= params["MAX_REALISTIC_CROWN_AREA_SQM"]) &
+        (height_m >= params["MIN_REALISTIC_TREE_HEIGHT_M"]) &
+        (height_m <= params["MAX_REALISTIC_TREE_HEIGHT_M"])
+    )
+
+
+def allometry(height_m: np.ndarray, params: dict) -> dict:
+    """Per-tree DBH, biomass, carbon and CO2 columns derived from height."""
+    with metrics.step("allometry", trees=len(height_m)):
+        return _allometry(height_m, params)
+
+
+def _allometry(height_m: np.ndarray, params: dict) -> dict:
+    estimated_dbh_cm = (params["DBH_FROM_HEIGHT_SLOPE"] * height_m) + params["DBH_FROM_HEIGHT_INTERCEPT"]
+    agb_kg = params["ALLOM_COEFF_A"] * (params["WOOD_DENSITY_RHO"] * (estimated_dbh_cm ** params["ALLOM_COEFF_B"]))
+    total_biomass_kg = agb_kg * (1 + params["BGB_TO_AGB_RATIO"])
+    carbon_kg = total_biomass_kg * params["CARBON_FRACTION"]
+    co2_sequestered_kg = carbon_kg * params["CO2_CONVERSION_FACTOR"]
+    return {
+        "estimated_dbh_cm": estimated_dbh_cm,
+        "agb_kg": agb_kg,
+        "total_biomass_kg": total_biomass_kg,
+        "carbon_kg": carbon_kg,
+        "co2_sequestered_kg": co2_sequestered_kg,
+    }
+
+
+def total_co2_tonnes(height_m: np.ndarray, crown_area_sqm: np.ndarray, params: dict):
+    """
+    Filters and applies the allometry to whole metric columns without building a
+    DataFrame. Returns (total_co2_tonnes, tree_count).
+    """
+    height_m = height_m[valid_tree_mask(height_m, crown_area_sqm, params)]
+    co2_sequestered_kg = allometry(height_m, params)["co2_sequestered_kg"]
+    return float(co2_sequestered_kg.sum() / 1000), int(height_m.size)
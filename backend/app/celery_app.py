@@ -0,0 +1,29 @@
+# app/celery_app.py
+from celery import Celery
+from . import scheduling
+
+# --- Celery Configuration ---
+# Kept apart from app.tasks so the API can enqueue work by task name without importing
+# the task modules and, through them, the geospatial stack.
+celery_app = Celery(
+    "tasks",
+    broker="redis://redis:6379/0",
+    backend="redis://redis:6379/0",
+)
+celery_app.conf.update(
+    task_track_started=True,
+    task_queues={queue: {} for queue in scheduling.QUEUES},
+    task_default_queue=scheduling.QUEUE_LIGHT,
+    task_routes=scheduling.TASK_ROUTES,
+    # Redis serves priority 0 first; every priority gets its own sub-queue
+    broker_transport_options={"priority_steps": list(range(scheduling.MAX_PRIORITY + 1)), "sep": ":", "queue_order_strategy": "priority"},
+    task_default_priority=scheduling.DEFAULT_PRIORITY,
+    # Workers take one task at a time and acknowledge it when done, so a long job
+    # never holds queued work hostage and priorities apply to every pick
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+)
+
+# Task names the API sends by name (see app.tasks)
+START_PIPELINE_TASK = "app.tasks.start_processing_pipeline"
+START_BATCH_TASK = "app.tasks.start_batch_pipeline"
@@ -1,5 +1,6 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
@@ -8,9 +9,92 @@ load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# --- Connection Pool Settings (ignored for SQLite, which pools per file) ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_RECYCLE_S = int(os.getenv("DB_POOL_RECYCLE_S", 1800))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+# Async drivers used when the API derives its async URL from DATABASE_URL
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def engine_options(url: str) -> dict:
+    if is_sqlite(url):
+        return {"connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_recycle": DB_POOL_RECYCLE_S,
+        "pool_pre_ping": True,
+    }
+
+
+def async_database_url(url: str) -> str:
+    """Maps a sync DATABASE_URL onto its async driver, e.g. sqlite:// -> sqlite+aiosqlite://."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if parsed.get_driver_name() != parsed.get_dialect().driver or backend not in ASYNC_DRIVERS:
+        return url
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets status reads proceed while a pipeline stage is committing, and
+    # busy_timeout makes writers wait for the lock instead of failing immediately.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-16000")
+    cursor.close()
+
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
+if is_sqlite(SQLALCHEMY_DATABASE_URL):
+    event.listen(engine, "connect", _set_sqlite_pragmas)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+# --- Async Engine (used by the FastAPI app; Celery workers keep the sync engine) ---
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or async_database_url(SQLALCHEMY_DATABASE_URL)
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+    if is_sqlite(ASYNC_DATABASE_URL):
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    HAS_ASYNC_DB = True
+except ImportError:
+    async_engine = None
+    AsyncSessionLocal = None
+    HAS_ASYNC_DB = False
+    print("Warning: Async database driver not installed. Install aiosqlite (SQLite) or asyncpg (Postgres).")
+
+Base = declarative_base()
+
+
+def upgrade_schema(bind, metadata):
+    """
+    Adds nullable columns and indexes defined on the models but missing from existing
+    tables; create_all only creates tables that do not exist yet.
+    """
+    inspector = inspect(bind)
+    with bind.begin() as connection:
+        for table in metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                    print(f"Added column {table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
@@ -0,0 +1,187 @@
+# app/dtm.py
+import os
+import numpy as np
+from . import raster, metrics
+
+# Optional imports - handle gracefully if not available
+try:
+    import rasterio
+    from rasterio.windows import Window
+    HAS_RASTERIO = True
+except ImportError:
+    HAS_RASTERIO = False
+    print("Warning: Rasterio not installed. DTM derivation will be unavailable.")
+
+try:
+    from scipy import ndimage as ndi
+    HAS_SCIPY = True
+except ImportError:
+    HAS_SCIPY = False
+    print("Warning: SciPy not installed. Only the 'warp' DTM algorithm will be available.")
+
+try:
+    from osgeo import gdal
+    HAS_GDAL = True
+except ImportError:
+    HAS_GDAL = False
+
+# --- Ground Surface (DTM) Settings ---
+# "warp"       the original nearest-neighbour downsample + cubic upsample, done on GDAL
+#              in-memory datasets window by window instead of two full-size files (default)
+# "block_min"  lowest DSM value per coarse cell, bilinearly interpolated (fastest)
+# "opening"    block_min followed by a grey opening over DTM_OPENING_CELLS cells, which
+#              drops cells that only saw canopy (robust under dense cover)
+DTM_ALGORITHM = os.getenv("DTM_ALGORITHM", "warp")
+DTM_ALGORITHMS = ("block_min", "opening", "warp")
+DTM_RESOLUTION_M = float(os.getenv("DTM_RESOLUTION_M", 5))
+DTM_OPENING_CELLS = int(os.getenv("DTM_OPENING_CELLS", 3))
+
+
+def parameters(algorithm: str = None) -> dict:
+    """Parameters that change the ground surface; part of generate_chm's stage cache key."""
+    algorithm = algorithm or DTM_ALGORITHM
+    params = {"dtm_algorithm": algorithm, "dtm_resolution_m": DTM_RESOLUTION_M}
+    if algorithm == "opening":
+        params["dtm_opening_cells"] = DTM_OPENING_CELLS
+    return params
+
+
+def cell_pixels(transform, resolution_m: float = DTM_RESOLUTION_M) -> int:
+    """Edge length in DSM pixels of one coarse ground cell."""
+    return max(1, int(round(resolution_m / abs(transform.a))))
+
+
+def influence_pixels(transform, algorithm: str = None) -> int:
+    """
+    How far (DSM pixels) a DSM change can move the ground surface: the opening window
+    plus one cell of interpolation on either side. Used to bound incremental CHM updates.
+    """
+    algorithm = algorithm or DTM_ALGORITHM
+    cells = DTM_OPENING_CELLS + 2 if algorithm == "opening" else 2
+    return cells * cell_pixels(transform)
+
+
+def block_minimum(dsm, cell: int, block_size: int = raster.BLOCK_SIZE) -> np.ndarray:
+    """
+    Streams the DSM in strips of whole cells and reduces each cell to its lowest valid
+    value. Returns the coarse grid (float32); cells without valid pixels are NaN.
+    """
+    rows = -(-dsm.height // cell)
+    cols = -(-dsm.width // cell)
+    coarse = np.empty((rows, cols), dtype=np.float32)
+    strip_rows = cell * max(1, block_size // cell)
+    padded_width = cols * cell
+
+    for row_off in range(0, dsm.height, strip_rows):
+        height = min(strip_rows, dsm.height - row_off)
+        strip = dsm.read(1, window=Window(0, row_off, dsm.width, height), out_dtype="float32")
+        if dsm.nodata is not None:
+            strip[strip == dsm.nodata] = np.inf
+
+        strip_cells = -(-height // cell)
+        if strip.shape != (strip_cells * cell, padded_width):
+            padded = np.full((strip_cells * cell, padded_width), np.inf, dtype=np.float32)
+            padded[:height, :dsm.width] = strip
+            strip = padded
+        first = row_off // cell
+        coarse[first:first + strip_cells] = strip.reshape(strip_cells, cell, cols, cell).min(axis=(1, 3))
+
+    coarse[np.isinf(coarse)] = np.nan
+    return coarse
+
+
+def fill_gaps(coarse: np.ndarray) -> np.ndarray:
+    """Replaces NaN cells with their nearest valid neighbour so interpolation stays defined."""
+    missing = np.isnan(coarse)
+    if missing.all():
+        raise ValueError("DSM has no valid pixels to derive a ground surface from.")
+    if missing.any():
+        nearest = ndi.distance_transform_edt(missing, return_distances=False, return_indices=True)
+        coarse = coarse[tuple(nearest)]
+    return coarse
+
+
+def bilinear_window(coarse: np.ndarray, cell: int, window) -> np.ndarray:
+    """
+    Bilinearly interpolates the coarse grid (values at cell centres) onto the
+    full-resolution pixels of a window, clamping at the raster edges.
+    """
+    def axis(offset, length, size):
+        position = (np.arange(offset, offset + length, dtype=np.float64) + 0.5) / cell - 0.5
+        position = np.clip(position, 0, size - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, size - 1)
+        return lower, upper, (position - lower).astype(np.float32)
+
+    y0, y1, fy = axis(window.row_off, window.height, coarse.shape[0])
+    x0, x1, fx = axis(window.col_off, window.width, coarse.shape[1])
+
+    # Interpolate along x on just the coarse rows this window touches, then along y
+    first, last = y0.min(), y1.max() + 1
+    band = coarse[first:last]
+    along_x = band[:, x0] * (1 - fx) + band[:, x1] * fx
+    return along_x[y0 - first] * (1 - fy)[:, None] + along_x[y1 - first] * fy[:, None]
+
+
+class CoarseGround:
+    """Ground surface held as a small coarse grid and interpolated per window on demand."""
+
+    def __init__(self, coarse: np.ndarray, cell: int):
+        self.coarse = coarse
+        self.cell = cell
+
+    def read(self, window) -> np.ndarray:
+        return bilinear_window(self.coarse, self.cell, window)
+
+
+class WarpGround:
+    """
+    The original near-downsample / cubic-upsample DTM, kept on GDAL in-memory datasets:
+    the coarse raster lives in a MEM dataset and each window is upsampled on request.
+    """
+
+    def __init__(self, dsm_path: str, resolution_m: float):
+        if not HAS_GDAL:
+            raise RuntimeError(
+                "The 'warp' DTM algorithm needs the GDAL Python bindings; install GDAL or set "
+                "DTM_ALGORITHM to 'block_min' or 'opening'."
+            )
+        self.low_res = gdal.Warp("", dsm_path, format="MEM", xRes=resolution_m, yRes=resolution_m, resampleAlg="near")
+        with rasterio.open(dsm_path) as src:
+            self.transform = src.transform
+
+    def read(self, window) -> np.ndarray:
+        left, top = self.transform * (window.col_off, window.row_off)
+        right, bottom = self.transform * (window.col_off + window.width, window.row_off + window.height)
+        block = gdal.Warp(
+            "", self.low_res, format="MEM", outputBounds=(left, min(top, bottom), right, max(top, bottom)),
+            width=window.width, height=window.height, resampleAlg="cubic",
+        )
+        values = block.GetRasterBand(1).ReadAsArray().astype(np.float32)
+        nodata = block.GetRasterBand(1).GetNoDataValue()
+        if nodata is not None:
+            values[values == nodata] = np.nan
+        return values
+
+
+def ground_model(dsm_path: str, algorithm: str = None):
+    """
+    Builds the ground surface for a DSM with the selected algorithm. The result has a
+    read(window) method returning float32 terrain heights (NaN where unknown) aligned
+    with the DSM grid; no intermediate rasters are written.
+    """
+    algorithm = algorithm or DTM_ALGORITHM
+    if algorithm not in DTM_ALGORITHMS:
+        raise ValueError(f"Unknown DTM algorithm {algorithm!r}; expected one of {', '.join(DTM_ALGORITHMS)}")
+
+    with rasterio.open(dsm_path) as dsm:
+        dims = metrics.raster_dims(dsm.width, dsm.height)
+        with metrics.step("ground_model", **dims, algorithm=algorithm):
+            if algorithm == "warp":
+                return WarpGround(dsm_path, DTM_RESOLUTION_M)
+
+            cell = cell_pixels(dsm.transform)
+            coarse = fill_gaps(block_minimum(dsm, cell))
+            if algorithm == "opening":
+                coarse = ndi.grey_opening(coarse, size=(DTM_OPENING_CELLS, DTM_OPENING_CELLS), mode="nearest")
+            return CoarseGround(coarse, cell)
@@ -0,0 +1,156 @@
+# app/events.py
+import os
+import json
+import time
+
+# Optional imports - handle gracefully if not available
+try:
+    import redis
+    import redis.asyncio as aioredis
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+    print("Warning: redis not installed. Progress events will not be published.")
+
+# --- Progress Event Settings ---
+# Stages publish progress over Redis pub/sub; the latest event per project is also kept
+# under a key so a client that connects mid-run gets the current state immediately.
+# Same Redis instance the Celery broker uses
+REDIS_URL = os.getenv("EVENTS_REDIS_URL", "redis://redis:6379/0")
+LAST_EVENT_TTL_S = 24 * 3600
+PROGRESS_MIN_INTERVAL_S = 0.5
+KEEPALIVE_INTERVAL_S = 15.0
+TERMINAL_STAGES = ("completed", "failed")
+
+# Share of the overall pipeline each stage covers, as (start %, end %)
+PIPELINE_STAGES = {
+    "queued": (0, 0),
+    "photogrammetry": (0, 25),
+    "chm": (25, 50),
+    "segmentation": (50, 85),
+    "carbon": (85, 100),
+    "completed": (100, 100),
+    "failed": (100, 100),
+}
+
+_client = None
+_client_pid = None
+
+
+def channel_name(project_id: int) -> str:
+    return f"project:{project_id}:events"
+
+
+def last_event_key(project_id: int) -> str:
+    return f"project:{project_id}:last_event"
+
+
+def get_client():
+    """Per-process synchronous Redis client (recreated after fork)."""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        _client = redis.Redis.from_url(REDIS_URL)
+        _client_pid = os.getpid()
+    return _client
+
+
+def publish(project_id: int, stage: str, status: str, stage_percent: float = 0.0, **extra):
+    """Publishes one progress event. Best effort: a Redis outage never fails a stage."""
+    start, end = PIPELINE_STAGES.get(stage, (0, 100))
+    event = {
+        "project_id": project_id,
+        "stage": stage,
+        "status": status,
+        "stage_percent": round(stage_percent, 1),
+        "percent": round(start + (end - start) * stage_percent / 100.0, 1),
+        "timestamp": time.time(),
+        **extra,
+    }
+    if not HAS_REDIS:
+        return event
+    try:
+        payload = json.dumps(event)
+        pipe = get_client().pipeline()
+        pipe.set(last_event_key(project_id), payload, ex=LAST_EVENT_TTL_S)
+        pipe.publish(channel_name(project_id), payload)
+        pipe.execute()
+    except Exception as e:
+        print(f"Warning: could not publish progress event for project {project_id}: {e}")
+    return event
+
+
+class StageProgress:
+    """
+    Progress reporter for one pipeline stage. Call it as progress(done, total) from
+    inner loops; events are throttled to one per PROGRESS_MIN_INTERVAL_S and carry the
+    stage's elapsed time.
+    """
+
+    def __init__(self, project_id: int, stage: str, status: str):
+        self.project_id = project_id
+        self.stage = stage
+        self.status = status
+        self.started = time.monotonic()
+        self._last_publish = 0.0
+        publish(project_id, stage, status, 0.0, stage_elapsed_s=0.0)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def __call__(self, done: int, total: int):
+        now = time.monotonic()
+        if done < total and now - self._last_publish < PROGRESS_MIN_INTERVAL_S:
+            return
+        self._last_publish = now
+        percent = 100.0 * done / total if total else 100.0
+        publish(self.project_id, self.stage, self.status, percent, stage_elapsed_s=round(self.elapsed(), 3))
+
+    def span(self, start: float, end: float):
+        """A progress(done, total) callable that reports onto [start, end] percent of this stage."""
+        def report(done, total):
+            fraction = done / total if total else 1.0
+            self(start + (end - start) * fraction, 100.0)
+        return report
+
+    def finish(self, **extra):
+        publish(self.project_id, self.stage, self.status, 100.0, stage_elapsed_s=round(self.elapsed(), 3), **extra)
+
+
+async def subscribe(project_id: int):
+    """
+    Async generator of progress events for a project: first the latest known event,
+    then live ones until the pipeline completes or fails. Yields None as a keepalive
+    tick when nothing happened for KEEPALIVE_INTERVAL_S.
+    """
+    client = aioredis.Redis.from_url(REDIS_URL)
+    pubsub = client.pubsub()
+    # Subscribe before reading the last event so nothing published in between is lost
+    await pubsub.subscribe(channel_name(project_id))
+    try:
+        last = await client.get(last_event_key(project_id))
+        if last:
+            event = json.loads(last)
+            yield event
+            if event["stage"] in TERMINAL_STAGES:
+                return
+
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=KEEPALIVE_INTERVAL_S)
+            if message is None:
+                yield None
+                continue
+            event = json.loads(message["data"])
+            yield event
+            if event["stage"] in TERMINAL_STAGES:
+                return
+    finally:
+        await pubsub.unsubscribe(channel_name(project_id))
+        await pubsub.aclose()
+        await client.aclose()
+
+
+def format_sse(event) -> str:
+    """Encodes an event (or a keepalive tick for None) as a Server-Sent Events frame."""
+    if event is None:
+        return ": keepalive\n\n"
+    return f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
@@ -0,0 +1,280 @@
+# app/incremental.py
+import os
+import json
+import math
+import numpy as np
+from . import raster, metrics, preprocess, segmentation
+
+# Optional imports - handle gracefully if not available
+try:
+    import rasterio
+    import rasterio.shutil
+    from rasterio.enums import Resampling
+    from rasterio.vrt import WarpedVRT
+    from rasterio.warp import transform as transform_points, transform_bounds
+    from rasterio.windows import Window
+    HAS_RASTERIO = True
+except ImportError:
+    HAS_RASTERIO = False
+    print("Warning: Rasterio not installed. Incremental reprocessing will be unavailable.")
+
+try:
+    import geopandas as gpd
+    import pandas as pd
+    import pyarrow.parquet as pq
+    HAS_GEOPANDAS = True
+except ImportError:
+    HAS_GEOPANDAS = False
+    print("Warning: GeoPandas not installed. Incremental reprocessing will be unavailable.")
+
+# --- Incremental Reprocessing Settings ---
+# When images are added to a processed project, only the region they cover is rebuilt.
+# Photogrammetry reconstructs the new images together with their neighbours and merges
+# that patch into the existing DSM. The CHM is recomputed in the windows the patch (and
+# the ground surface around it) touches. Segmentation re-runs the tiles that read those
+# windows, and the inventory rows of those tiles are replaced. Anything a patch cannot
+# express (removed images, images outside the DSM, changed settings) runs in full.
+INCREMENTAL_ENABLED = os.getenv("INCREMENTAL_ENABLED", "true").lower() in ("1", "true", "yes")
+# Past this share of changed images, or of the DSM area, a full run is the better deal
+INCREMENTAL_MAX_FRACTION = float(os.getenv("INCREMENTAL_MAX_FRACTION", 0.3))
+# Unchanged images centred within this distance of a changed footprint are reconstructed
+# with the new ones, so the patch ties into its surroundings
+INCREMENTAL_CONTEXT_M = float(os.getenv("INCREMENTAL_CONTEXT_M", 30))
+# Per-project record of what the last run was built from, and of the DSM region whose
+# downstream stages have not completed yet
+STATE_FILE = "incremental.json"
+# The patch is levelled against the existing DSM on at most this many sampled pixels
+LEVELING_SAMPLE_PIXELS = 1_000_000
+LEVELING_MIN_PIXELS = 100
+METRES_PER_DEGREE = 111320.0
+PATCH_NODATA = raster.CHM_NODATA
+
+
+# --- Project State ---
+
+def load_state(project_dir: str) -> dict:
+    path = os.path.join(project_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def update_state(project_dir: str, **values) -> dict:
+    """Read-modify-write of the project state; the stages of one project never run concurrently."""
+    state = load_state(project_dir)
+    state.update(values)
+    path = os.path.join(project_dir, STATE_FILE)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(f"{path}.tmp", path)
+    return state
+
+
+def matches(state: dict, stage: str, params: dict) -> bool:
+    """Whether a stage's previous outputs were built with these parameters (JSON-normalised)."""
+    return INCREMENTAL_ENABLED and state.get(stage) == json.loads(json.dumps(params))
+
+
+def union_windows(a, b):
+    """Bounding [col_off, row_off, width, height] of two windows; either may be None."""
+    if a is None or b is None:
+        return a or b
+    col_off, row_off = min(a[0], b[0]), min(a[1], b[1])
+    return [col_off, row_off, max(a[0] + a[2], b[0] + b[2]) - col_off, max(a[1] + a[3], b[1] + b[3]) - row_off]
+
+
+def grow_window(window: list, pixels: int, width: int, height: int) -> list:
+    col_off, row_off = max(0, window[0] - pixels), max(0, window[1] - pixels)
+    col_stop = min(width, window[0] + window[2] + pixels)
+    row_stop = min(height, window[1] + window[3] + pixels)
+    return [col_off, row_off, col_stop - col_off, row_stop - row_off]
+
+
+# --- Photogrammetry ---
+
+def footprint_bounds(records: list, margin_m: float = 0.0) -> tuple:
+    """(west, south, east, north) in degrees covering the ground footprints of the records."""
+    west = south = math.inf
+    east = north = -math.inf
+    for record in records:
+        # Heading is unknown, so each footprint is taken as a square of its long side
+        short_m = preprocess.footprint_m(record)
+        aspect = max(record["width"], record["height"]) / min(record["width"], record["height"]) if record["width"] else 1.5
+        half_m = short_m * aspect / 2.0 + margin_m
+        half_lat = half_m / METRES_PER_DEGREE
+        half_lon = half_m / (METRES_PER_DEGREE * math.cos(math.radians(record["lat"])))
+        west, east = min(west, record["lon"] - half_lon), max(east, record["lon"] + half_lon)
+        south, north = min(south, record["lat"] - half_lat), max(north, record["lat"] + half_lat)
+    return west, south, east, north
+
+
+def _within(record: dict, bounds: tuple) -> bool:
+    return bounds[0] <= record["lon"] <= bounds[2] and bounds[1] <= record["lat"] <= bounds[3]
+
+
+def region_window(dsm, bounds: tuple):
+    """DSM pixel window [col_off, row_off, width, height] of lon/lat bounds, clipped to the raster."""
+    left, bottom, right, top = transform_bounds("EPSG:4326", dsm.crs, *bounds)
+    cols, rows = zip(*(~dsm.transform * corner for corner in ((left, bottom), (left, top), (right, bottom), (right, top))))
+    col_off, row_off = max(0, math.floor(min(cols))), max(0, math.floor(min(rows)))
+    col_stop, row_stop = min(dsm.width, math.ceil(max(cols))), min(dsm.height, math.ceil(max(rows)))
+    if col_stop <= col_off or row_stop <= row_off:
+        return None
+    return [col_off, row_off, col_stop - col_off, row_stop - row_off]
+
+
+def centres_inside(dsm, records: list) -> bool:
+    xs, ys = transform_points("EPSG:4326", dsm.crs, [r["lon"] for r in records], [r["lat"] for r in records])
+    for x, y in zip(xs, ys):
+        col, row = ~dsm.transform * (x, y)
+        if not (0 <= col < dsm.width and 0 <= row < dsm.height):
+            return False
+    return True
+
+
+def image_state(records: list) -> dict:
+    return {os.path.basename(record["path"]): record["signature"] for record in records}
+
+
+def plan_reconstruction(state: dict, records: list, dsm_path: str, backend_params: dict, full: bool = False) -> dict:
+    """
+    Decides how photogrammetry runs for the project's current images (preprocess
+    records): "full", "unchanged" (nothing to reconstruct) or "patch", which also
+    carries the images to reconstruct and the DSM window they replace.
+    """
+    previous = state.get("images")
+    if full:
+        return {"mode": "full", "reason": "full run requested"}
+    if not previous or not os.path.exists(dsm_path) or not matches(state, "photogrammetry", backend_params):
+        return {"mode": "full", "reason": "no earlier reconstruction with these settings"}
+
+    current = image_state(records)
+    changed = [record for record in records if previous.get(os.path.basename(record["path"])) != record["signature"]]
+    if set(previous) - set(current):
+        return {"mode": "full", "reason": "images were removed"}
+    if not changed:
+        return {"mode": "unchanged", "reason": "no new or modified images"}
+    # Frames culled as redundant add nothing the kept frames do not already cover
+    changed = [record for record in changed if record["prepared_path"]]
+    if not changed:
+        return {"mode": "unchanged", "reason": "every new or modified image was culled as redundant"}
+    if len(changed) > INCREMENTAL_MAX_FRACTION * len(records):
+        return {"mode": "full", "reason": f"{len(changed)} of {len(records)} images changed"}
+    if any(record["lat"] is None for record in changed):
+        return {"mode": "full", "reason": "changed images carry no GPS position"}
+
+    with rasterio.open(dsm_path) as dsm:
+        if not centres_inside(dsm, changed):
+            return {"mode": "full", "reason": "changed images extend the surveyed area"}
+        window = region_window(dsm, footprint_bounds(changed))
+        if window is None or window[2] * window[3] > INCREMENTAL_MAX_FRACTION * dsm.width * dsm.height:
+            return {"mode": "full", "reason": "changed images cover too much of the DSM"}
+
+    context = footprint_bounds(changed, INCREMENTAL_CONTEXT_M)
+    changed_paths = {record["path"] for record in changed}
+    images = [
+        record["prepared_path"] for record in records
+        if record["prepared_path"] and (record["path"] in changed_paths or (record["lat"] is not None and _within(record, context)))
+    ]
+    return {"mode": "patch", "reason": f"{len(changed)} new or modified images", "images": images,
+            "changed": len(changed), "window": window}
+
+
+def level_offset(dsm, aligned, region, ring_px: int) -> float:
+    """
+    Median height difference of the patch over the existing DSM on a ring around the
+    replaced region, where both cover unchanged ground; independent reconstructions
+    can sit a little apart vertically.
+    """
+    context = Window(*grow_window([region.col_off, region.row_off, region.width, region.height],
+                                  ring_px, dsm.width, dsm.height))
+    step = max(1, math.ceil(math.sqrt(context.width * context.height / LEVELING_SAMPLE_PIXELS)))
+    shape = (math.ceil(context.height / step), math.ceil(context.width / step))
+    old = dsm.read(1, window=context, out_shape=shape, out_dtype="float32", resampling=Resampling.nearest)
+    new = aligned.read(1, window=context, out_shape=shape, out_dtype="float32", resampling=Resampling.nearest)
+
+    rows = context.row_off + (np.arange(shape[0]) + 0.5) * context.height / shape[0]
+    cols = context.col_off + (np.arange(shape[1]) + 0.5) * context.width / shape[1]
+    inside = (((rows >= region.row_off) & (rows < region.row_off + region.height))[:, None] &
+              ((cols >= region.col_off) & (cols < region.col_off + region.width))[None, :])
+    valid = ~inside & (new != PATCH_NODATA) & np.isfinite(new) & np.isfinite(old)
+    if dsm.nodata is not None:
+        valid &= old != dsm.nodata
+    if valid.sum() < LEVELING_MIN_PIXELS:
+        return 0.0
+    return float(np.median(new[valid] - old[valid]))
+
+
+def merge_patch(dsm_path: str, patch_path: str, window: list) -> dict:
+    """
+    Writes the patch DSM into the existing DSM inside window (resampled onto the DSM
+    grid and levelled), keeping every other pixel. The DSM stays a COG.
+    """
+    region = Window(*window)
+    with rasterio.open(dsm_path) as dsm, rasterio.open(patch_path) as patch:
+        ring_px = max(1, int(INCREMENTAL_CONTEXT_M / abs(dsm.transform.a)))
+        with WarpedVRT(patch, crs=dsm.crs, transform=dsm.transform, width=dsm.width, height=dsm.height,
+                       nodata=PATCH_NODATA, resampling=Resampling.bilinear) as aligned:
+            offset = level_offset(dsm, aligned, region, ring_px)
+
+            profile = raster.tiled_profile(dsm.profile, dtype=dsm.dtypes[0], nodata=dsm.nodata)
+            copy_options = {key: profile[key] for key in ("tiled", "blockxsize", "blockysize", "compress", "predictor", "BIGTIFF")}
+            replaced = 0
+            with raster.cog_output(dsm_path) as scratch:
+                rasterio.shutil.copy(dsm_path, scratch, driver="GTiff", **copy_options)
+                with rasterio.open(scratch, "r+") as dst:
+                    for block in raster.windows_within(region, dsm.width, dsm.height):
+                        values = dst.read(1, window=block)
+                        new = aligned.read(1, window=block, out_dtype="float32")
+                        take = (new != PATCH_NODATA) & np.isfinite(new)
+                        # Only the region itself is replaced; blocks overhang it at the edges
+                        take[:max(0, region.row_off - block.row_off)] = False
+                        take[region.row_off + region.height - block.row_off:] = False
+                        take[:, :max(0, region.col_off - block.col_off)] = False
+                        take[:, region.col_off + region.width - block.col_off:] = False
+                        values[take] = (new[take] - offset).astype(values.dtype)
+                        dst.write(values, 1, window=block)
+                        replaced += int(take.sum())
+
+    return {"replaced_pixels": replaced, "level_offset_m": round(offset, 3)}
+
+
+# --- Segmentation ---
+
+def affected_tiles(chm_path: str, window: list) -> list:
+    """Ids of the segmentation tiles whose haloed window reads any pixel of window."""
+    col_off, row_off, width, height = window
+    return [
+        tile_id for tile_id, (tile, _) in enumerate(segmentation.chm_tiles(chm_path))
+        if tile.col_off < col_off + width and col_off < tile.col_off + tile.width
+        and tile.row_off < row_off + height and row_off < tile.row_off + tile.height
+    ]
+
+
+def can_update_crowns(crowns_table_path: str, chm_path: str) -> bool:
+    """Crowns can be patched when the table came from tiled segmentation of this CHM grid."""
+    if not os.path.exists(crowns_table_path) or "tile_id" not in pq.read_schema(crowns_table_path).names:
+        return False
+    with rasterio.open(chm_path) as src:
+        return segmentation.use_tiled_mode(src.width, src.height)
+
+
+def update_crowns(chm_path: str, crowns_table_path: str, window: list, progress=None) -> tuple:
+    """
+    Re-segments the tiles that read the changed CHM window and swaps their crowns into
+    the existing crown table. Returns (merged crowns, re-segmented tile ids).
+    """
+    tile_ids = affected_tiles(chm_path, window)
+    labels = pq.read_table(crowns_table_path, columns=["label_id"]).column("label_id").to_numpy()
+    first_label = int(labels.max()) + 1 if len(labels) else 0
+
+    kept = gpd.read_parquet(crowns_table_path, filters=[("tile_id", "not in", tile_ids)]) if tile_ids else \
+        gpd.read_parquet(crowns_table_path)
+    crowns = segmentation.segment_tiled(chm_path, progress=progress, tile_ids=tile_ids, first_label=first_label)
+    crowns = crowns.set_crs(kept.crs, allow_override=True)
+    crowns['crown_area_sqm'] = crowns.geometry.area
+
+    with metrics.step("merge_crowns", crowns=len(crowns)):
+        merged = gpd.GeoDataFrame(pd.concat([kept, crowns[kept.columns]], ignore_index=True), geometry='geometry', crs=kept.crs)
+    return merged, tile_ids
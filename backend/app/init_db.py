@@ -1,6 +1,7 @@
-from app.database import engine, Base
-from app.models import Project # Ensure your models are imported
+from app.database import engine, Base, upgrade_schema
+from app.models import Project, Batch # Ensure your models are imported
 
 print("Creating database tables...")
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine, Base.metadata)
 print("Database tables created.")
\ No newline at end of file
@@ -0,0 +1,298 @@
+# app/inventory.py
+import os
+import numpy as np
+from . import artifacts, cache, carbon, zonal
+
+# Optional imports - handle gracefully if not available
+try:
+    import pandas as pd
+    HAS_PANDAS = True
+except ImportError:
+    HAS_PANDAS = False
+    print("Warning: Pandas not installed.")
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+    print("Warning: PyArrow not installed. The carbon inventory cannot be written or queried.")
+
+# --- Carbon Inventory Output ---
+# The inventory is a typed Parquet table sorted by CO2 (largest trees first). CO2 grows
+# with height, so the min/max statistics of every row group bound both columns and
+# height or CO2 filters skip whole row groups. The CSV is a user-facing export only.
+CARBON_INVENTORY = "carbon_inventory.parquet"
+CARBON_INVENTORY_CSV = "carbon_inventory.csv"
+INVENTORY_CSV_EXPORT = os.getenv("INVENTORY_CSV_EXPORT", "true").lower() in ("1", "true", "yes")
+INVENTORY_ROW_GROUP_ROWS = int(os.getenv("INVENTORY_ROW_GROUP_ROWS", 32768))
+# Bumped when the inventory files change shape (1 was CSV only); part of calculate_carbon's stage cache key
+INVENTORY_FORMAT = 2
+INVENTORY_COLUMNS = [
+    ("tree_id", "int64"),
+    ("height_m", "float32"),
+    ("crown_area_sqm", "float64"),
+    ("height_mean_m", "float32"),
+    (f"height_p{zonal.HEIGHT_PERCENTILE}_m", "float32"),
+    ("estimated_dbh_cm", "float64"),
+    ("agb_kg", "float64"),
+    ("total_biomass_kg", "float64"),
+    ("carbon_kg", "float64"),
+    ("co2_sequestered_kg", "float64"),
+]
+
+
+def tree_dimensions(crowns_df: "pd.DataFrame") -> "pd.DataFrame":
+    """Per-tree dimension columns of the inventory, for crowns with a measured height."""
+    return pd.DataFrame({
+        'tree_id': crowns_df['label_id'],
+        'height_m': crowns_df['height_max_m'],
+        'crown_area_sqm': crowns_df['crown_area_sqm'],
+        'height_mean_m': crowns_df['height_mean_m'],
+        f'height_p{zonal.HEIGHT_PERCENTILE}_m': crowns_df[f'height_p{zonal.HEIGHT_PERCENTILE}_m'],
+    }).dropna(subset=['height_m'])
+
+
+def tree_rows(df: "pd.DataFrame", params: dict) -> "pd.DataFrame":
+    """Inventory rows of the trees that pass the realism filters, with their allometry."""
+    df_filtered = df[carbon.valid_tree_mask(df['height_m'], df['crown_area_sqm'], params)].copy()
+    for column, values in carbon.allometry(df_filtered['height_m'], params).items():
+        df_filtered[column] = values
+    return df_filtered
+
+
+def inventory_schema() -> "pa.Schema":
+    return pa.schema([(name, getattr(pa, dtype)()) for name, dtype in INVENTORY_COLUMNS])
+
+
+def output_files(project_dir: str) -> dict:
+    """The files write_inventory produces, by name; what calculate_carbon caches."""
+    names = [CARBON_INVENTORY] + ([CARBON_INVENTORY_CSV] if INVENTORY_CSV_EXPORT else [])
+    return {name: os.path.join(project_dir, name) for name in names}
+
+
+def write_inventory(df: "pd.DataFrame", project_dir: str):
+    """
+    Writes the Parquet inventory (and the CSV export), largest CO2 first, replacing the
+    old files atomically so API queries never see a partial file. Returns
+    (carbon_results_path, total_co2_tonnes).
+    """
+    df = df.sort_values(['co2_sequestered_kg', 'tree_id'], ascending=[False, True], kind='stable')
+    table = pa.Table.from_pandas(df[[name for name, _ in INVENTORY_COLUMNS]], schema=inventory_schema(),
+                                 preserve_index=False)
+
+    paths = output_files(project_dir)
+    carbon_results_path = paths[CARBON_INVENTORY]
+    cache.detach(*paths.values())
+    pq.write_table(table, f"{carbon_results_path}.tmp", row_group_size=INVENTORY_ROW_GROUP_ROWS,
+                   compression="zstd", write_statistics=True)
+    os.replace(f"{carbon_results_path}.tmp", carbon_results_path)
+    if CARBON_INVENTORY_CSV in paths:
+        pa_csv.write_csv(table, f"{paths[CARBON_INVENTORY_CSV]}.tmp")
+        os.replace(f"{paths[CARBON_INVENTORY_CSV]}.tmp", paths[CARBON_INVENTORY_CSV])
+    return carbon_results_path, float(pc.sum(table['co2_sequestered_kg']).as_py() or 0.0) / 1000
+
+
+def compute_inventory(chm_path: str, crowns_table_path: str, project_dir: str):
+    """Runs filtering and allometry on the crown table; returns (carbon_results_path, total_co2_tonnes)."""
+    try:
+        crowns_df = artifacts.read_crown_metrics(crowns_table_path)
+    except Exception as e:
+        raise ValueError(f"Could not load files for calculation: {e}")
+
+    # segment_trees stores heights taken from its own label raster; older crown tables
+    # without them go through the bulk rasterize-once zonal path instead.
+    if crowns_df is None:
+        crowns_gdf = artifacts.read_crowns(crowns_table_path)
+        crowns_gdf['crown_area_sqm'] = crowns_gdf.geometry.area
+        heights = zonal.crown_zonal_stats(chm_path, crowns_gdf)
+        crowns_df = pd.DataFrame(crowns_gdf.drop(columns='geometry')).merge(heights, on='label_id', how='left')
+
+    df = tree_dimensions(crowns_df)
+    if df.empty:
+        raise ValueError("No trees found after initial metric extraction.")
+    
+    print("\n--- Tree Dimension Statistics (Before Filtering) ---")
+    print(df[['height_m', 'crown_area_sqm']].describe())
+    print("----------------------------------------------------\n")
+    
+    df_filtered = tree_rows(df, carbon.carbon_parameters())
+    if df_filtered.empty:
+        raise ValueError("No valid trees found after filtering. Adjust filter parameters if this is unexpected.")
+
+    return write_inventory(df_filtered, project_dir)
+
+
+def update_inventory(crowns_table_path: str, project_dir: str, tile_ids) -> tuple:
+    """
+    Merges re-segmented tiles into the existing inventory: rows of trees from the other
+    tiles are kept as they are, and the crowns of tile_ids are filtered and run through
+    the allometry again. Returns (carbon_results_path, total_co2_tonnes, trees_updated),
+    or None when the crown table has no stored metrics or tile ids to merge by.
+    """
+    crowns_df = artifacts.read_crown_metrics(crowns_table_path, artifacts.CROWN_METRIC_COLUMNS + ["tile_id"])
+    if crowns_df is None:
+        return None
+    changed = crowns_df['tile_id'].isin(list(tile_ids))
+
+    existing = pd.read_parquet(os.path.join(project_dir, CARBON_INVENTORY))
+    kept = existing[existing['tree_id'].isin(crowns_df.loc[~changed, 'label_id'])]
+    updated = tree_rows(tree_dimensions(crowns_df[changed]), carbon.carbon_parameters())
+
+    df = pd.concat([kept, updated], ignore_index=True)
+    if df.empty:
+        raise ValueError("No valid trees found after filtering. Adjust filter parameters if this is unexpected.")
+    carbon_results_path, total_co2_tonnes = write_inventory(df, project_dir)
+    return carbon_results_path, total_co2_tonnes, len(updated)
+
+
+# --- Inventory Queries ---
+# Dashboards read aggregated views instead of downloading the inventory: each view
+# decodes only the columns it needs, from the row groups whose statistics overlap the
+# requested height and CO2 ranges.
+DEFAULT_HEIGHT_BANDS_M = (0, 5, 10, 15, 20, 30, 50)
+
+
+def inventory_path(project_dir: str) -> str:
+    return os.path.join(project_dir, CARBON_INVENTORY)
+
+
+def _check_columns(columns) -> list:
+    known = [name for name, _ in INVENTORY_COLUMNS]
+    unknown = [column for column in columns if column not in known]
+    if unknown:
+        raise ValueError(f"Unknown inventory columns: {', '.join(unknown)}; expected some of {', '.join(known)}")
+    return list(columns)
+
+
+def _statistics(parquet_file, row_group: int, column: str):
+    """(min, max) of a column in one row group, or None when the writer stored no statistics."""
+    chunk = parquet_file.metadata.row_group(row_group).column(parquet_file.schema_arrow.get_field_index(column))
+    stats = chunk.statistics
+    if stats is None or not stats.has_min_max:
+        return None
+    return stats.min, stats.max
+
+
+def _row_groups(parquet_file, ranges: dict) -> list:
+    """Row groups that may hold rows inside ranges ({column: (low, high)}, either bound None)."""
+    selected = []
+    for row_group in range(parquet_file.num_row_groups):
+        for column, (low, high) in ranges.items():
+            bounds = _statistics(parquet_file, row_group, column)
+            if bounds is not None and ((low is not None and bounds[1] < low) or (high is not None and bounds[0] > high)):
+                break
+        else:
+            selected.append(row_group)
+    return selected
+
+
+def _in_ranges(table: "pa.Table", ranges: dict) -> "pa.Table":
+    mask = None
+    for column, (low, high) in ranges.items():
+        for bound, compare in ((low, pc.greater_equal), (high, pc.less_equal)):
+            if bound is not None:
+                condition = compare(table[column], bound)
+                mask = condition if mask is None else pc.and_(mask, condition)
+    return table if mask is None else table.filter(mask)
+
+
+def _active(ranges: dict) -> dict:
+    return {column: bounds for column, bounds in (ranges or {}).items() if bounds != (None, None)}
+
+
+def _read(parquet_file, columns: list, ranges: dict, row_groups: list) -> "pa.Table":
+    read_columns = list(dict.fromkeys(_check_columns(columns) + list(ranges)))
+    table = parquet_file.read_row_groups(row_groups, columns=read_columns)
+    return _in_ranges(table, ranges).select(columns)
+
+
+def read_rows(path: str, columns: list, ranges: dict = None) -> "pa.Table":
+    """The given columns of the inventory rows inside ranges, reading only overlapping row groups."""
+    ranges = _active(ranges)
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    return _read(parquet_file, columns, ranges, _row_groups(parquet_file, ranges))
+
+
+def summary(path: str, ranges: dict = None) -> dict:
+    """Tree count, total CO2 and mean dimensions of the inventory rows inside ranges."""
+    table = read_rows(path, ["height_m", "crown_area_sqm", "co2_sequestered_kg"], ranges)
+    return {
+        "trees": table.num_rows,
+        "total_co2_tonnes": float(pc.sum(table["co2_sequestered_kg"]).as_py() or 0.0) / 1000,
+        "mean_height_m": pc.mean(table["height_m"]).as_py(),
+        "max_height_m": pc.max(table["height_m"]).as_py(),
+        "mean_crown_area_sqm": pc.mean(table["crown_area_sqm"]).as_py(),
+    }
+
+
+def top_trees(path: str, n: int, by: str = "co2_sequestered_kg", columns: list = None, ranges: dict = None) -> list:
+    """
+    The n trees with the largest `by`, as row dicts. Row groups are visited by their
+    maximum and the scan stops once no remaining group can beat the current n-th tree,
+    which for CO2 or height on the sorted inventory is after the first group.
+    """
+    columns = _check_columns(list(dict.fromkeys(["tree_id", by] + list(columns or []))))
+    ranges = _active(ranges)
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    candidates = []
+    for row_group in _row_groups(parquet_file, ranges):
+        bounds = _statistics(parquet_file, row_group, by)
+        candidates.append((float("inf") if bounds is None else bounds[1], row_group))
+    candidates.sort(reverse=True)
+
+    best = None
+    for group_max, row_group in candidates:
+        if best is not None and best.num_rows >= n and group_max < best[by][best.num_rows - 1].as_py():
+            break
+        rows = _read(parquet_file, columns, ranges, [row_group])
+        best = rows if best is None else pa.concat_tables([best, rows])
+        best = best.take(pc.select_k_unstable(best, n, [(by, "descending")]))
+        best = best.sort_by([(by, "descending"), ("tree_id", "ascending")])
+    return [] if best is None else best.to_pylist()
+
+
+def histogram(path: str, column: str, bins: int, ranges: dict = None, value_range: tuple = None) -> dict:
+    """
+    Counts of a column's values in equal-width bins. value_range defaults to the
+    minimum and maximum of the values inside ranges; edges and counts are empty when
+    no rows match.
+    """
+    values = read_rows(path, [column], ranges)[column].to_numpy()
+    if not values.size:
+        return {"column": column, "edges": [], "counts": []}
+    if value_range is None:
+        value_range = (float(values.min()), float(values.max()))
+    counts, edges = np.histogram(values, bins=bins, range=value_range)
+    return {"column": column, "edges": edges.tolist(), "counts": counts.tolist()}
+
+
+def height_bands(path: str, edges=DEFAULT_HEIGHT_BANDS_M, ranges: dict = None) -> list:
+    """
+    Trees, CO2 and mean crown area per height band [edges[i], edges[i + 1]); the last
+    band also holds trees exactly at edges[-1]. Trees outside the outer edges are left out.
+    """
+    edges = np.asarray(sorted(edges), dtype=np.float64)
+    table = read_rows(path, ["height_m", "crown_area_sqm", "co2_sequestered_kg"], ranges)
+    heights = table["height_m"].to_numpy()
+    band = np.searchsorted(edges, heights, side="right") - 1
+    band[heights == edges[-1]] = len(edges) - 2
+    inside = (band >= 0) & (band < len(edges) - 1)
+    band = band[inside]
+    size = len(edges) - 1
+    trees = np.bincount(band, minlength=size)
+    co2_kg = np.bincount(band, weights=table["co2_sequestered_kg"].to_numpy()[inside], minlength=size)
+    crown_area = np.bincount(band, weights=table["crown_area_sqm"].to_numpy()[inside], minlength=size)
+    return [
+        {
+            "min_height_m": float(edges[i]),
+            "max_height_m": float(edges[i + 1]),
+            "trees": int(trees[i]),
+            "co2_tonnes": float(co2_kg[i]) / 1000,
+            "mean_crown_area_sqm": float(crown_area[i] / trees[i]) if trees[i] else None,
+        }
+        for i in range(size)
+    ]
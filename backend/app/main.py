@@ -1,10 +1,15 @@
 # app/main.py
-from fastapi import FastAPI, Depends, HTTPException, File, UploadFile
-from sqlalchemy.orm import Session
-from typing import List
-import shutil
+from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Request, Header, Query
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import datetime
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
+from starlette.concurrency import run_in_threadpool
 import os
-from . import models, schemas, database, tasks
+import sys
+from . import models, schemas, database, events, metrics, uploads, scheduling, batches
+from .celery_app import celery_app, START_PIPELINE_TASK, START_BATCH_TASK
 
 # This line is no longer needed here as db_init handles it
 # models.Base.metadata.create_all(bind=database.engine)
@@ -12,64 +17,530 @@ from . import models, schemas, database, tasks
 app = FastAPI()
 
 # Dependency to get a DB session
-def get_db():
-    db = database.SessionLocal()
-    try:
+async def get_db():
+    async with database.AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 @app.post("/projects/", response_model=schemas.Project)
-def create_project(project: schemas.ProjectCreate, db: Session = Depends(get_db)):
+async def create_project(project: schemas.ProjectCreate, db: AsyncSession = Depends(get_db)):
     """
     Creates a new project record in the database and prepares folders for image uploads.
     """
     # Create a project record first to get an ID
     clean_name = project.name.strip()
-    db_project = models.Project(name=clean_name, status="PENDING_UPLOAD")
+    db_project = models.Project(name=clean_name, status="PENDING_UPLOAD", priority=project.priority)
     db.add(db_project)
-    db.commit()
-    db.refresh(db_project)
+    await db.commit()
+    await db.refresh(db_project)
 
     # Now create directories using the confirmed project ID
-    project_data_path = os.path.join(os.getenv("DATA_DIRECTORY"), str(db_project.id))
+    create_project_dirs(db_project.id)
+
+    return db_project
+
+def create_project_dirs(project_id: int):
+    project_data_path = os.path.join(os.getenv("DATA_DIRECTORY"), str(project_id))
     os.makedirs(project_data_path, exist_ok=True)
     os.makedirs(os.path.join(project_data_path, "raw_images"), exist_ok=True)
 
+async def get_project_or_404(db: AsyncSession, project_id: int) -> models.Project:
+    db_project = await db.get(models.Project, project_id)
+    if db_project is None:
+        raise HTTPException(status_code=404, detail="Project not found")
     return db_project
 
+def project_images_dir(project_id: int) -> str:
+    return os.path.join(os.getenv("DATA_DIRECTORY"), str(project_id), "raw_images")
+
+async def start_pipeline(db: AsyncSession, db_project: models.Project, full: bool = False):
+    # Update status and start the background processing task
+    db_project.status = "ACCEPTED"
+    await db.commit()
+
+    # This is where the magic happens: we kick off the Celery task
+    # (publishing to the broker is blocking I/O, so keep it off the event loop)
+    # Replace the previous run's terminal event first, so stream subscribers wait for this run
+    await run_in_threadpool(events.publish, db_project.id, "queued", "ACCEPTED")
+    priority = scheduling.normalize_priority(db_project.priority)
+    await run_in_threadpool(
+        celery_app.send_task, START_PIPELINE_TASK, (db_project.id,), {"priority": priority, "full": full}, priority=priority
+    )
+
 @app.post("/projects/{project_id}/upload-images/")
-def upload_project_images(project_id: int, files: List[UploadFile] = File(...), db: Session = Depends(get_db)):
+async def upload_project_images(project_id: int, files: List[UploadFile] = File(...), db: AsyncSession = Depends(get_db)):
     """
     Receives image files for a project, saves them, and starts the processing pipeline.
+    Files are streamed to disk in large chunks and hashed while writing; images whose
+    content the project already holds are skipped. On a processed project only the
+    area the new images cover is rebuilt (see app/incremental.py).
     """
-    db_project = db.query(models.Project).filter(models.Project.id == project_id).first()
-    if not db_project:
-        raise HTTPException(status_code=404, detail="Project not found")
-
-    project_images_path = os.path.join(os.getenv("DATA_DIRECTORY"), str(db_project.id), "raw_images")
+    db_project = await get_project_or_404(db, project_id)
+    project_images_path = project_images_dir(db_project.id)
 
-    # Save all uploaded files to the project's folder
+    stored, skipped = 0, 0
     for file in files:
-        file_location = os.path.join(project_images_path, file.filename)
-        with open(file_location, "wb+") as file_object:
-            shutil.copyfileobj(file.file, file_object)
+        try:
+            _, _, duplicate = await uploads.save_upload(file, project_images_path)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if duplicate:
+            skipped += 1
+        else:
+            stored += 1
 
-    # Update status and start the background processing task
-    db_project.status = "ACCEPTED"
-    db.commit()
+    await start_pipeline(db, db_project)
 
-    # This is where the magic happens: we kick off the Celery task
-    tasks.start_processing_pipeline.delay(project_id)
+    return {
+        "message": f"Successfully uploaded {len(files)} files ({stored} new, {skipped} duplicates skipped). Processing started for project ID {project_id}.",
+        "stored": stored,
+        "skipped": skipped,
+    }
+
+@app.get("/projects/{project_id}/uploads/{filename}", response_model=schemas.UploadStatus)
+async def get_upload_status(project_id: int, filename: str, db: AsyncSession = Depends(get_db)):
+    """
+    Reports how many bytes of a resumable upload the server already holds, so a client
+    can continue from that offset after a dropped connection.
+    """
+    await get_project_or_404(db, project_id)
+    images_dir = project_images_dir(project_id)
+    try:
+        filename = uploads.safe_filename(filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    return {"message": f"Successfully uploaded {len(files)} files. Processing started for project ID {project_id}."}
+    offset = uploads.partial_offset(images_dir, filename)
+    complete = offset == 0 and filename in uploads.load_manifest(images_dir).values()
+    if complete:
+        offset = os.path.getsize(os.path.join(images_dir, filename))
+    return {"filename": filename, "offset": offset, "complete": complete}
+
+@app.put("/projects/{project_id}/uploads/{filename}", response_model=schemas.UploadStatus)
+async def upload_image_chunk(
+    project_id: int,
+    filename: str,
+    request: Request,
+    content_range: Optional[str] = Header(None),
+    x_content_sha256: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Resumable upload of a single image. Each request appends the body at the offset
+    given by `Content-Range: bytes start-end/total` and must carry exactly end - start + 1
+    bytes; the file is hashed and deduplicated once byte total - 1 arrives. While the
+    total is unknown (`bytes start-end/*`) chunks are only appended. A request without
+    Content-Range carries the whole file. Sending `X-Content-SHA256` up front skips the
+    transfer entirely when the project already holds that content.
+    """
+    await get_project_or_404(db, project_id)
+    images_dir = project_images_dir(project_id)
+    try:
+        filename = uploads.safe_filename(filename)
+        start, end, total = uploads.parse_content_range(content_range) if content_range else (0, None, None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    manifest = uploads.load_manifest(images_dir)
+    if x_content_sha256 and x_content_sha256.lower() in manifest:
+        # Bytes an earlier attempt left behind would otherwise show up as a stale upload
+        uploads.discard_partial(images_dir, filename)
+        return {"filename": manifest[x_content_sha256.lower()], "offset": total or 0, "complete": True,
+                "duplicate": True, "sha256": x_content_sha256.lower()}
+
+    part_path = uploads.partial_path(images_dir, filename)
+    try:
+        with uploads.locked_partial(images_dir, filename) as out:
+            offset = os.fstat(out.fileno()).st_size
+            if start != offset:
+                raise HTTPException(status_code=409, detail={"message": "Upload offset mismatch", "offset": offset})
+
+            expected = None if end is None else end - start + 1
+            received = await uploads.append_stream(request.stream(), out, expected)
+            if expected is not None and received != expected:
+                await run_in_threadpool(uploads.truncate_partial, out, start)
+                raise HTTPException(status_code=400, detail={
+                    "message": f"Body length does not match Content-Range ({expected} bytes)", "offset": start,
+                })
+            offset = start + received
+            if content_range is None:
+                total = offset
+            if total is None or offset < total:
+                return {"filename": filename, "offset": offset, "complete": False}
+
+            digest = await run_in_threadpool(uploads.file_sha256, part_path)
+            if x_content_sha256 and x_content_sha256.lower() != digest:
+                os.remove(part_path)
+                raise HTTPException(status_code=422, detail="Checksum mismatch; upload discarded")
+
+            stored_name, duplicate = await run_in_threadpool(uploads.finalize, images_dir, part_path, filename, digest)
+    except BlockingIOError:
+        raise HTTPException(status_code=409, detail={"message": "Another request is uploading this file",
+                                                     "offset": uploads.partial_offset(images_dir, filename)})
+    return {"filename": stored_name, "offset": offset, "complete": True, "duplicate": duplicate, "sha256": digest}
+
+@app.post("/projects/{project_id}/process")
+async def process_project(project_id: int, priority: Optional[int] = Query(None, ge=0, le=9),
+                          full: bool = False, db: AsyncSession = Depends(get_db)):
+    """
+    Starts the processing pipeline for a project whose images were sent through the
+    resumable upload endpoint. priority (0 = most urgent, 9 = least) overrides and
+    replaces the project's stored queue priority. Images added since the last run are
+    processed incrementally unless full is set.
+    """
+    db_project = await get_project_or_404(db, project_id)
+    if priority is not None:
+        db_project.priority = priority
+    await start_pipeline(db, db_project, full=full)
+    return {"message": f"Processing started for project ID {project_id}."}
+
+# --- Project Listing ---
+PROJECT_PAGE_DEFAULT = 50
+PROJECT_PAGE_MAX = 500
+
+def prefix_range(column, prefix: str):
+    """Prefix match as a range condition, which any B-tree index on the column can serve."""
+    # The highest code point has no successor; bump the last character below it instead
+    stem = prefix.rstrip(chr(sys.maxunicode))
+    if not stem:
+        return column >= prefix
+    upper = stem[:-1] + chr(ord(stem[-1]) + 1)
+    return (column >= prefix) & (column < upper)
+
+def project_filters(status: Optional[str], name_prefix: Optional[str],
+                    created_after: Optional[datetime], created_before: Optional[datetime]) -> list:
+    conditions = []
+    if status:
+        conditions.append(prefix_range(models.Project.status, status))
+    if name_prefix:
+        conditions.append(prefix_range(models.Project.name, name_prefix))
+    if created_after:
+        conditions.append(models.Project.created_at >= created_after)
+    if created_before:
+        conditions.append(models.Project.created_at < created_before)
+    return conditions
+
+@app.get("/projects/", response_model=schemas.ProjectPage)
+async def list_projects(
+    status: Optional[str] = Query(None, description="Status prefix, e.g. COMPLETED, FAILED or PROCESSING"),
+    name_prefix: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    after: Optional[int] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(PROJECT_PAGE_DEFAULT, ge=1, le=PROJECT_PAGE_MAX),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Lists projects newest first with keyset pagination: each page continues below the
+    id in `after`, so deep pages cost the same as the first one.
+    """
+    query = select(models.Project).where(*project_filters(status, name_prefix, created_after, created_before))
+    if after is not None:
+        query = query.where(models.Project.id < after)
+    result = await db.execute(query.order_by(models.Project.id.desc()).limit(limit + 1))
+    items = list(result.scalars())
+
+    next_cursor = items[limit - 1].id if len(items) > limit else None
+    return {"items": items[:limit], "next_cursor": next_cursor, "limit": limit}
+
+@app.get("/projects/summary", response_model=schemas.ProjectSummary)
+async def summarize_projects(
+    name_prefix: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Project counts and CO2 totals per status, and folded into phases (pending ... failed)."""
+    query = (
+        select(models.Project.status, func.count(), func.coalesce(func.sum(models.Project.total_co2_tonnes), 0.0))
+        .where(*project_filters(None, name_prefix, created_after, created_before))
+        .group_by(models.Project.status)
+        .order_by(models.Project.status)
+    )
+    rows = (await db.execute(query)).all()
+
+    by_status = [{"status": status or "", "project_count": count, "total_co2_tonnes": co2} for status, count, co2 in rows]
+    by_phase = {phase: {"status": phase, "project_count": 0, "total_co2_tonnes": 0.0} for phase in batches.PHASES}
+    for row in by_status:
+        phase = by_phase[batches.project_phase(row["status"])]
+        phase["project_count"] += row["project_count"]
+        phase["total_co2_tonnes"] += row["total_co2_tonnes"]
+    return {
+        "project_count": sum(row["project_count"] for row in by_status),
+        "total_co2_tonnes": sum(row["total_co2_tonnes"] for row in by_status),
+        "by_status": by_status,
+        "by_phase": by_phase,
+    }
 
 @app.get("/projects/{project_id}", response_model=schemas.Project)
-def get_project_status(project_id: int, db: Session = Depends(get_db)):
+async def get_project_status(project_id: int, db: AsyncSession = Depends(get_db)):
     """
     Gets the current status and results of a project.
     """
-    db_project = db.query(models.Project).filter(models.Project.id == project_id).first()
-    if db_project is None:
-        raise HTTPException(status_code=404, detail="Project not found")
-    return db_project
\ No newline at end of file
+    return await get_project_or_404(db, project_id)
+
+@app.get("/projects/{project_id}/events")
+async def stream_project_events(project_id: int, request: Request, db: AsyncSession = Depends(get_db)):
+    """
+    Server-Sent Events stream of pipeline progress (stage, percent done, stage timings),
+    pushed by the workers through Redis. The project is looked up once on connect; no
+    further database queries are made while the stream is open. The stream ends after
+    the "completed" or "failed" event.
+    """
+    await get_project_or_404(db, project_id)
+    await db.close()
+
+    async def event_stream():
+        async for event in events.subscribe(project_id):
+            if await request.is_disconnected():
+                break
+            yield events.format_sse(event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/projects/{project_id}/metrics")
+async def get_project_metrics(project_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Per-stage timings of the project's last pipeline run: wall time, peak RSS, bytes
+    read/written and raster dimensions for each stage and its hot-path sub-steps.
+    """
+    await get_project_or_404(db, project_id)
+    project_dir = os.path.join(os.getenv("DATA_DIRECTORY"), str(project_id))
+    stage_metrics = await run_in_threadpool(metrics.read_project_metrics, project_dir)
+    if stage_metrics is None:
+        raise HTTPException(status_code=404, detail="No metrics recorded for this project yet")
+    return stage_metrics
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Pipeline stage and sub-step metrics aggregated over all projects, in Prometheus text format."""
+    try:
+        aggregates, scrape_error = await metrics.read_aggregates(), False
+    except events.redis.RedisError as e:
+        # Report the outage to the scraper instead of failing the whole scrape
+        print(f"Warning: could not read pipeline metrics from Redis: {e}")
+        aggregates, scrape_error = {}, True
+    return PlainTextResponse(
+        metrics.render_prometheus(aggregates, scrape_error), media_type="text/plain; version=0.0.4"
+    )
+
+async def serve_tile(project_id: int, layer: str, z: int, x: int, y: int, ext: str, media_type: str) -> Response:
+    # No database lookup: tiles come straight from the project directory and the tile cache.
+    # The raster stack is imported on the first tile request, not at API startup.
+    from . import tiles
+    try:
+        data = await run_in_threadpool(tiles.get_tile, project_id, layer, z, x, y, ext)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"Project has no {layer} layer yet")
+    return Response(content=data, media_type=media_type, headers={"Cache-Control": "public, max-age=300"})
+
+@app.get("/projects/{project_id}/tiles/{layer}/{z}/{x}/{y}.png")
+async def get_raster_tile(project_id: int, layer: str, z: int, x: int, y: int):
+    """
+    256x256 XYZ map tile (Web Mercator) of a project raster: chm, dsm or dtm. Tiles
+    are rendered on demand from the raster overviews and cached in memory and on disk.
+    """
+    return await serve_tile(project_id, layer, z, x, y, "png", "image/png")
+
+@app.get("/projects/{project_id}/tiles/{layer}/{z}/{x}/{y}.mvt")
+async def get_vector_tile(project_id: int, layer: str, z: int, x: int, y: int):
+    """Mapbox Vector Tile of the project's tree crowns (layer "crowns"), from zoom 16 up."""
+    return await serve_tile(project_id, layer, z, x, y, "mvt", "application/vnd.mapbox-vector-tile")
+
+# --- Batches ---
+
+async def get_batch_or_404(db: AsyncSession, batch_id: int) -> models.Batch:
+    db_batch = await db.get(models.Batch, batch_id)
+    if db_batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return db_batch
+
+async def batch_projects(db: AsyncSession, batch_id: int) -> list:
+    result = await db.execute(
+        select(models.Project).where(models.Project.batch_id == batch_id).order_by(models.Project.id)
+    )
+    return list(result.scalars())
+
+@app.post("/batches/", response_model=schemas.Batch)
+async def create_batch(batch: schemas.BatchCreate, db: AsyncSession = Depends(get_db)):
+    """
+    Creates a batch and all of its projects in one call. Images are then sent per
+    project through the resumable upload endpoint, and the whole batch is started
+    with POST /batches/{id}/process.
+    """
+    db_batch = models.Batch(name=batch.name.strip(), status="PENDING_UPLOAD")
+    db.add(db_batch)
+    await db.flush()
+    db_projects = [
+        models.Project(name=project.name.strip(), status="PENDING_UPLOAD", priority=project.priority, batch_id=db_batch.id)
+        for project in batch.projects
+    ]
+    db.add_all(db_projects)
+    await db.commit()
+
+    for db_project in db_projects:
+        create_project_dirs(db_project.id)
+
+    return {"id": db_batch.id, "name": db_batch.name, "status": db_batch.status, "projects": db_projects}
+
+@app.post("/batches/{batch_id}/process")
+async def process_batch(batch_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Starts the pipelines of every project in the batch as a single Celery chord, so
+    the projects spread over the whole worker pool and the batch is summarized once
+    the last one finishes.
+    """
+    db_batch = await get_batch_or_404(db, batch_id)
+    db_projects = await batch_projects(db, batch_id)
+    for db_project in db_projects:
+        db_project.status = "ACCEPTED"
+    db_batch.status = "ACCEPTED"
+    await db.commit()
+
+    members = [(db_project.id, scheduling.normalize_priority(db_project.priority)) for db_project in db_projects]
+
+    def submit():
+        for project_id, _ in members:
+            events.publish(project_id, "queued", "ACCEPTED")
+        priority = min(priority for _, priority in members)
+        celery_app.send_task(START_BATCH_TASK, (batch_id, members), priority=priority)
+
+    await run_in_threadpool(submit)
+    return {"message": f"Processing started for {len(members)} projects in batch {batch_id}.", "project_ids": [project_id for project_id, _ in members]}
+
+@app.get("/batches/{batch_id}", response_model=schemas.BatchStatus)
+async def get_batch_status(batch_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Aggregated status of a batch: projects per phase, percent finished and the CO2
+    total of the projects completed so far, plus each project's own status.
+    """
+    db_batch = await get_batch_or_404(db, batch_id)
+    db_projects = await batch_projects(db, batch_id)
+    summary = batches.summarize((p.status, p.total_co2_tonnes) for p in db_projects)
+    return {"batch_id": batch_id, "name": db_batch.name, **summary, "projects": db_projects}
+
+@app.get("/batches/{batch_id}/results", response_model=schemas.BatchResults)
+async def get_batch_results(batch_id: int, db: AsyncSession = Depends(get_db)):
+    """Results of every project in the batch (CO2 total and output paths) with the batch total."""
+    db_batch = await get_batch_or_404(db, batch_id)
+    db_projects = await batch_projects(db, batch_id)
+    summary = batches.summarize((p.status, p.total_co2_tonnes) for p in db_projects)
+    return {
+        "batch_id": batch_id,
+        "name": db_batch.name,
+        "status": summary["status"],
+        "total_co2_tonnes": summary["total_co2_tonnes"],
+        "projects": db_projects,
+    }
+
+@app.post("/projects/{project_id}/recompute", response_model=schemas.RecomputeResult)
+async def recompute_carbon(project_id: int, overrides: schemas.CarbonCoefficients, db: AsyncSession = Depends(get_db)):
+    """
+    Re-applies the allometry to the project's stored per-tree metrics with coefficient
+    overrides and returns the new total. Nothing is persisted; the pipeline is not re-run.
+    """
+    from . import artifacts, carbon
+    await get_project_or_404(db, project_id)
+
+    crowns_table_path = os.path.join(os.getenv("DATA_DIRECTORY"), str(project_id), artifacts.CROWNS_TABLE)
+    inventory_metrics = await run_in_threadpool(artifacts.load_tree_metrics, crowns_table_path)
+    if inventory_metrics is None:
+        raise HTTPException(status_code=409, detail="Project has no stored tree metrics yet")
+
+    params = carbon.carbon_parameters(overrides.model_dump(exclude_none=True))
+    total_co2_tonnes, tree_count = await run_in_threadpool(
+        carbon.total_co2_tonnes, inventory_metrics["height_m"], inventory_metrics["crown_area_sqm"], params
+    )
+
+    return {
+        "project_id": project_id,
+        "total_co2_tonnes": total_co2_tonnes,
+        "tree_count": tree_count,
+        "coefficients": params,
+    }
+
+# --- Carbon Inventory Queries ---
+# Filtered and aggregated views of a project's Parquet inventory, so dashboards never
+# download the whole file. Every view accepts the same height and CO2 range filters.
+INVENTORY_TOP_MAX = 1000
+INVENTORY_BINS_MAX = 200
+
+def inventory_ranges(
+    min_height_m: Optional[float] = Query(None, ge=0),
+    max_height_m: Optional[float] = Query(None, ge=0),
+    min_co2_kg: Optional[float] = Query(None, ge=0),
+    max_co2_kg: Optional[float] = Query(None, ge=0),
+) -> dict:
+    for name, low, high in (("height_m", min_height_m, max_height_m), ("co2_kg", min_co2_kg, max_co2_kg)):
+        if low is not None and high is not None and low > high:
+            raise HTTPException(status_code=400, detail=f"min_{name} must not exceed max_{name}")
+    return {"height_m": (min_height_m, max_height_m), "co2_sequestered_kg": (min_co2_kg, max_co2_kg)}
+
+async def query_inventory(db: AsyncSession, project_id: int, view, *args, **kwargs):
+    # Imported here like the other result endpoints: the API starts without the data stack
+    from . import inventory
+    await get_project_or_404(db, project_id)
+    path = inventory.inventory_path(os.path.join(os.getenv("DATA_DIRECTORY"), str(project_id)))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Project has no carbon inventory yet")
+    try:
+        return await run_in_threadpool(getattr(inventory, view), path, *args, **kwargs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/projects/{project_id}/inventory/summary", response_model=schemas.InventorySummary)
+async def get_inventory_summary(project_id: int, ranges: dict = Depends(inventory_ranges), db: AsyncSession = Depends(get_db)):
+    """Tree count, total CO2 and mean dimensions of the project's trees inside the filters."""
+    summary = await query_inventory(db, project_id, "summary", ranges)
+    return {"project_id": project_id, **summary}
+
+@app.get("/projects/{project_id}/inventory/top", response_model=schemas.InventoryTop)
+async def get_top_trees(
+    project_id: int,
+    n: int = Query(15, ge=1, le=INVENTORY_TOP_MAX),
+    by: str = Query("co2_sequestered_kg", description="Inventory column to rank trees by"),
+    columns: Optional[str] = Query(None, description="Comma-separated extra columns, e.g. height_m,crown_area_sqm"),
+    ranges: dict = Depends(inventory_ranges),
+    db: AsyncSession = Depends(get_db),
+):
+    """The n largest trees by an inventory column (CO2 by default), largest first."""
+    extra = [column.strip() for column in columns.split(",") if column.strip()] if columns else []
+    trees = await query_inventory(db, project_id, "top_trees", n, by, extra, ranges)
+    return {"project_id": project_id, "by": by, "trees": trees}
+
+@app.get("/projects/{project_id}/inventory/histogram", response_model=schemas.InventoryHistogram)
+async def get_inventory_histogram(
+    project_id: int,
+    column: str = Query("height_m", description="Inventory column to bin"),
+    bins: int = Query(20, ge=1, le=INVENTORY_BINS_MAX),
+    ranges: dict = Depends(inventory_ranges),
+    db: AsyncSession = Depends(get_db),
+):
+    """Tree counts in equal-width bins of an inventory column over its range."""
+    result = await query_inventory(db, project_id, "histogram", column, bins, ranges)
+    return {"project_id": project_id, **result}
+
+@app.get("/projects/{project_id}/inventory/bands", response_model=schemas.InventoryBands)
+async def get_height_bands(
+    project_id: int,
+    edges: Optional[str] = Query(None, description="Comma-separated band edges in metres, e.g. 0,5,10,20"),
+    ranges: dict = Depends(inventory_ranges),
+    db: AsyncSession = Depends(get_db),
+):
+    """Trees, CO2 and mean crown area per height band."""
+    if edges:
+        try:
+            band_edges = sorted({float(edge) for edge in edges.split(",") if edge.strip()})
+        except ValueError:
+            raise HTTPException(status_code=400, detail="edges must be comma-separated numbers")
+        if len(band_edges) < 2:
+            raise HTTPException(status_code=400, detail="edges needs at least two values")
+        bands = await query_inventory(db, project_id, "height_bands", band_edges, ranges)
+    else:
+        bands = await query_inventory(db, project_id, "height_bands", ranges=ranges)
+    return {"project_id": project_id, "bands": bands}
@@ -0,0 +1,319 @@
+# app/metrics.py
+import os
+import json
+import time
+import resource
+import threading
+import contextvars
+from contextlib import contextmanager
+from . import events
+
+# --- Pipeline Metrics Settings ---
+# Each stage writes its timings to PROJECT_METRICS_FILE in the project directory and
+# adds them to cluster-wide aggregates in Redis, which /metrics renders for Prometheus.
+METRICS_ENABLED = os.getenv("PIPELINE_METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+PROJECT_METRICS_FILE = "metrics.json"
+AGGREGATE_KEY = "metrics:pipeline"
+METRIC_PREFIX = "ccts"
+
+# Figures that add up when a step repeats (e.g. once per tile); other numbers keep their maximum
+ADDITIVE_FIELDS = {"seconds", "read_bytes", "write_bytes", "pixels", "windows", "peaks", "crowns", "trees", "images"}
+
+# The recorder of the stage running in the current context; steps outside a stage are no-ops
+_recorder = contextvars.ContextVar("pipeline_metrics_recorder", default=None)
+
+# Recorders with a step open in this process. The peak RSS counter is process-wide, so
+# it is only reset while a single recorder is measuring; overlapping steps (e.g. in the
+# thread-pool fallback) then report the process peak since the last reset, which can
+# overstate a step's own peak but never drops another step's.
+_open_recorders = 0
+_open_lock = threading.Lock()
+
+
+# --- Process Probes (Linux /proc, with portable fallbacks) ---
+
+def peak_rss_bytes() -> int:
+    """Peak resident set size of this process since start or the last reset_peak_rss()."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    # Resets VmHWM so a step's peak is its own and not an earlier step's
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def io_counters():
+    """(bytes read, bytes written) by this process through read/write calls, cached or not."""
+    counters = {}
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                counters[name] = int(value)
+    except OSError:
+        return 0, 0
+    return counters.get("rchar", 0), counters.get("wchar", 0)
+
+
+# --- Recording ---
+
+class Recorder:
+    """
+    Collects the timed steps of one stage, aggregated by step name: call count, total
+    seconds, peak RSS, bytes read/written and the attributes passed to step().
+    """
+
+    def __init__(self):
+        self.steps = {}
+        self._peaks = []  # running peak RSS of the steps currently open
+
+    def record(self, name: str, measurement: dict):
+        entry = self.steps.get(name)
+        if entry is None:
+            self.steps[name] = {"count": 1, **measurement}
+            return
+        entry["count"] += measurement.get("count", 1)
+        for field, value in measurement.items():
+            if field == "count":
+                continue
+            numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if not numeric or field not in entry:
+                entry[field] = value
+            elif field in ADDITIVE_FIELDS:
+                entry[field] += value
+            else:
+                entry[field] = max(entry[field], value)
+
+    def merge(self, steps: dict):
+        """Folds in steps recorded elsewhere, e.g. returned by a pool worker."""
+        for name, measurement in steps.items():
+            self.record(name, measurement)
+
+    @contextmanager
+    def measure(self, attrs: dict):
+        """Times the enclosed block; fills attrs with seconds, peak RSS and I/O on exit."""
+        global _open_recorders
+        if self._peaks:
+            # Remember the enclosing step's peak before this step resets the counter
+            self._peaks[-1] = max(self._peaks[-1], peak_rss_bytes())
+        with _open_lock:
+            if not self._peaks:
+                _open_recorders += 1
+            if _open_recorders == 1:
+                reset_peak_rss()
+        read_start, write_start = io_counters()
+        self._peaks.append(0)
+        started = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            seconds = time.perf_counter() - started
+            peak = max(self._peaks.pop(), peak_rss_bytes())
+            if not self._peaks:
+                with _open_lock:
+                    _open_recorders -= 1
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            read_end, write_end = io_counters()
+            attrs.update({
+                "seconds": seconds,
+                "peak_rss_bytes": peak,
+                "read_bytes": read_end - read_start,
+                "write_bytes": write_end - write_start,
+            })
+
+
+@contextmanager
+def step(name: str, **attrs):
+    """
+    Times a hot-path sub-step of the running stage. Yields the attribute dict so the
+    block can add figures it only knows at the end (e.g. the number of crowns).
+    Costs a single context-variable lookup when no stage is being recorded.
+    """
+    recorder = _recorder.get()
+    if recorder is None:
+        yield attrs
+        return
+    with recorder.measure(attrs):
+        yield attrs
+    recorder.record(name, attrs)
+
+
+@contextmanager
+def collect():
+    """
+    Records steps into a fresh recorder for the enclosed block and yields it; used by
+    pool workers, which do not see the parent's context, to hand their steps back.
+    """
+    recorder = Recorder()
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+def merge(steps: dict):
+    """Adds steps collected by a pool worker to the running stage, if any."""
+    recorder = _recorder.get()
+    if recorder is not None and steps:
+        recorder.merge(steps)
+
+
+def raster_dims(width: int, height: int) -> dict:
+    return {"width": int(width), "height": int(height), "pixels": int(width) * int(height)}
+
+
+@contextmanager
+def recording(**attrs):
+    """
+    Records the enclosed block and its sub-steps without storing anything. Yields the
+    attribute dict, which holds the totals and a "steps" breakdown on exit.
+    """
+    recorder = Recorder()
+    token = _recorder.set(recorder)
+    try:
+        with recorder.measure(attrs):
+            yield attrs
+    finally:
+        _recorder.reset(token)
+
+    # Steps merged from pool worker processes peaked in their own address space
+    for measurement in recorder.steps.values():
+        attrs["peak_rss_bytes"] = max(attrs["peak_rss_bytes"], measurement["peak_rss_bytes"])
+    attrs["steps"] = recorder.steps
+
+
+@contextmanager
+def stage(project_id: int, name: str, project_dir: str, **attrs):
+    """
+    Records one pipeline stage and its sub-steps. On success the result is stored in
+    the project's metrics file and added to the Redis aggregates; failed stages are
+    not recorded. Yields the stage attribute dict.
+    """
+    if not METRICS_ENABLED:
+        yield attrs
+        return
+
+    with recording(**attrs) as result:
+        yield result
+
+    result["recorded_at"] = time.time()
+    try:
+        write_project_metrics(project_dir, name, result)
+        publish_aggregates(name, result)
+    except Exception as e:
+        print(f"Warning: could not store metrics for project {project_id} stage {name}: {e}")
+
+
+# --- Storage ---
+
+def project_metrics_path(project_dir: str) -> str:
+    return os.path.join(project_dir, PROJECT_METRICS_FILE)
+
+
+def read_project_metrics(project_dir: str):
+    """Stage metrics of a project keyed by stage name, or None if nothing was recorded."""
+    path = project_metrics_path(project_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_project_metrics(project_dir: str, stage_name: str, result: dict):
+    # Stages of one project run one after another, so read-modify-replace is safe
+    metrics = read_project_metrics(project_dir) or {}
+    metrics[stage_name] = result
+    path = project_metrics_path(project_dir)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(metrics, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def publish_aggregates(stage_name: str, result: dict):
+    """Adds a stage result to the cluster-wide sums and counts in Redis."""
+    if not events.HAS_REDIS:
+        return
+    pipe = events.get_client().pipeline()
+    fields = {
+        f"stage_seconds_sum|{stage_name}|": result["seconds"],
+        f"stage_seconds_count|{stage_name}|": 1,
+        f"stage_read_bytes_total|{stage_name}|": result["read_bytes"],
+        f"stage_write_bytes_total|{stage_name}|": result["write_bytes"],
+        f"stage_pixels_total|{stage_name}|": result.get("pixels", 0),
+        f"stage_images_total|{stage_name}|": result.get("images", 0),
+        f"stage_cache_hits_total|{stage_name}|": int(bool(result.get("cached"))),
+    }
+    for step_name, measurement in result["steps"].items():
+        fields[f"step_seconds_sum|{stage_name}|{step_name}"] = measurement["seconds"]
+        fields[f"step_seconds_count|{stage_name}|{step_name}"] = measurement["count"]
+    for field, value in fields.items():
+        pipe.hincrbyfloat(AGGREGATE_KEY, field, value)
+    # Peak memory is a last-value gauge; it is what worker sizing needs
+    pipe.hset(AGGREGATE_KEY, f"stage_peak_rss_bytes|{stage_name}|", result["peak_rss_bytes"])
+    pipe.execute()
+
+
+async def read_aggregates() -> dict:
+    if not events.HAS_REDIS:
+        return {}
+    client = events.aioredis.Redis.from_url(events.REDIS_URL)
+    try:
+        raw = await client.hgetall(AGGREGATE_KEY)
+    finally:
+        await client.aclose()
+    return {key.decode(): float(value) for key, value in raw.items()}
+
+
+# --- Prometheus Exposition ---
+
+METRIC_HELP = {
+    "stage_seconds": ("summary", "Wall time of pipeline stages."),
+    "step_seconds": ("summary", "Wall time of hot-path sub-steps within pipeline stages."),
+    "stage_read_bytes_total": ("counter", "Bytes read by pipeline stages."),
+    "stage_write_bytes_total": ("counter", "Bytes written by pipeline stages."),
+    "stage_pixels_total": ("counter", "Raster pixels processed by pipeline stages."),
+    "stage_images_total": ("counter", "Drone images processed by pipeline stages."),
+    "stage_cache_hits_total": ("counter", "Pipeline stages served from the stage cache."),
+    "stage_peak_rss_bytes": ("gauge", "Peak resident memory of the most recent run of each stage."),
+}
+
+
+def render_prometheus(aggregates: dict, scrape_error: bool = False) -> str:
+    """
+    Renders the Redis aggregates in the Prometheus text exposition format, followed by
+    a gauge that is 1 when the aggregates could not be read.
+    """
+    samples = {}
+    for field, value in aggregates.items():
+        metric, stage_name, step_name = field.split("|")
+        labels = f'stage="{stage_name}"' + (f',step="{step_name}"' if step_name else "")
+        text = str(int(value)) if value.is_integer() else repr(value)
+        samples.setdefault(metric, []).append(f"{METRIC_PREFIX}_{metric}{{{labels}}} {text}")
+
+    lines = []
+    for family, (metric_type, help_text) in METRIC_HELP.items():
+        members = [family] if metric_type != "summary" else [f"{family}_sum", f"{family}_count"]
+        family_samples = [sample for member in members for sample in sorted(samples.get(member, []))]
+        if not family_samples:
+            continue
+        lines.append(f"# HELP {METRIC_PREFIX}_{family} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{family} {metric_type}")
+        lines.extend(family_samples)
+    lines.append(f"# HELP {METRIC_PREFIX}_metrics_scrape_error Whether the pipeline aggregates could not be read from Redis.")
+    lines.append(f"# TYPE {METRIC_PREFIX}_metrics_scrape_error gauge")
+    lines.append(f"{METRIC_PREFIX}_metrics_scrape_error {int(scrape_error)}")
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index, func
 from .database import Base
 
 class Project(Base):
@@ -10,4 +10,24 @@ class Project(Base):
     chm_path = Column(String, nullable=True)
     crowns_path = Column(String, nullable=True)
     carbon_results_path = Column(String, nullable=True)
-    total_co2_tonnes = Column(Float, nullable=True)
\ No newline at end of file
+    total_co2_tonnes = Column(Float, nullable=True)
+    # Queue priority of the project's pipeline stages, 0 (most urgent) to 9; NULL uses the default
+    priority = Column(Integer, nullable=True)
+    # Set for projects submitted together through the batch API
+    batch_id = Column(Integer, ForeignKey("batches.id"), nullable=True, index=True)
+    # Set by the ORM as well as the database: columns added to an existing table have no server default
+    created_at = Column(DateTime, default=func.now(), server_default=func.now(), index=True)
+    updated_at = Column(DateTime, default=func.now(), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        # Serves status-prefix filters and covers the per-status CO2 summary
+        Index("ix_projects_status_co2", "status", "total_co2_tonnes"),
+    )
+
+class Batch(Base):
+    __tablename__ = "batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, index=True)
+    status = Column(String, default="PENDING_UPLOAD")
+    total_co2_tonnes = Column(Float, nullable=True)
@@ -0,0 +1,168 @@
+# app/photogrammetry.py
+import os
+import json
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from . import metrics, raster
+
+# --- Photogrammetry Backend Settings ---
+# "sample" is the local stand-in: it returns DATA_DIRECTORY/sample_odm_outputs/odm_dem.tif
+# whatever the images, so the pipeline runs end to end without an ODM node. "nodeodm"
+# reconstructs on a NodeODM node (the processing API behind WebODM).
+PHOTOGRAMMETRY_BACKEND = os.getenv("PHOTOGRAMMETRY_BACKEND", "sample")
+PHOTOGRAMMETRY_BACKENDS = ("sample", "nodeodm")
+SAMPLE_OUTPUTS_DIR = "sample_odm_outputs"
+SAMPLE_DSM = "odm_dem.tif"
+
+NODEODM_URL = os.getenv("NODEODM_URL", "http://nodeodm:3000").rstrip("/")
+NODEODM_TOKEN = os.getenv("NODEODM_TOKEN", "")
+NODEODM_POLL_S = float(os.getenv("NODEODM_POLL_S", 10))
+NODEODM_TIMEOUT_S = int(os.getenv("NODEODM_TIMEOUT_S", 12 * 3600))
+NODEODM_HTTP_TIMEOUT_S = 300
+# Images are uploaded in batches on a few connections
+NODEODM_UPLOAD_BATCH = 20
+NODEODM_UPLOAD_WORKERS = 4
+DOWNLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+# Only the DSM is used downstream, so the orthophoto, textured mesh and report are
+# skipped. Images arrive already downscaled (see preprocess.py). NODEODM_OPTIONS (JSON
+# object) adds or overrides ODM options.
+NODEODM_OPTIONS = {
+    "dsm": True,
+    "skip-orthophoto": True,
+    "skip-3dmodel": True,
+    "skip-report": True,
+    **json.loads(os.getenv("NODEODM_OPTIONS", "{}")),
+}
+
+# NodeODM task status codes
+STATUS_QUEUED = 10
+STATUS_RUNNING = 20
+STATUS_FAILED = 30
+STATUS_COMPLETED = 40
+STATUS_CANCELED = 50
+
+
+def parameters(backend: str = None) -> dict:
+    """Settings that change the reconstructed DSM."""
+    backend = backend or PHOTOGRAMMETRY_BACKEND
+    if backend == "nodeodm":
+        return {"backend": backend, "options": NODEODM_OPTIONS}
+    return {"backend": backend}
+
+
+def reconstruct(image_paths: list, dsm_path: str, backend: str = None, progress=None) -> str:
+    """
+    Reconstructs the surface model of a set of images with the selected backend and
+    writes it to dsm_path as a COG. progress(done, total) is called while it runs.
+    """
+    backend = backend or PHOTOGRAMMETRY_BACKEND
+    if backend not in PHOTOGRAMMETRY_BACKENDS:
+        raise ValueError(f"Unknown photogrammetry backend {backend!r}; expected one of {', '.join(PHOTOGRAMMETRY_BACKENDS)}")
+
+    with metrics.step("reconstruct", backend=backend, images=len(image_paths)):
+        if backend == "nodeodm":
+            return reconstruct_nodeodm(image_paths, dsm_path, progress)
+        return reconstruct_sample(image_paths, dsm_path, progress)
+
+
+# --- Local Stand-In ---
+
+def reconstruct_sample(image_paths: list, dsm_path: str, progress=None) -> str:
+    sample_path = os.path.join(os.getenv("DATA_DIRECTORY"), SAMPLE_OUTPUTS_DIR, SAMPLE_DSM)
+    raster.to_cog(sample_path, dsm_path)
+    if progress:
+        progress(1, 1)
+    return dsm_path
+
+
+# --- NodeODM ---
+
+def _url(path: str) -> str:
+    return f"{NODEODM_URL}{path}"
+
+
+def _auth() -> dict:
+    return {"token": NODEODM_TOKEN} if NODEODM_TOKEN else {}
+
+
+def _checked(response) -> dict:
+    # NodeODM reports most failures as HTTP 200 with an "error" field
+    response.raise_for_status()
+    body = response.json()
+    if isinstance(body, dict) and body.get("error"):
+        raise RuntimeError(f"NodeODM: {body['error']}")
+    return body
+
+
+def _upload_batch(uuid: str, paths: list):
+    handles = [open(path, "rb") for path in paths]
+    try:
+        files = [("images", (os.path.basename(path), handle)) for path, handle in zip(paths, handles)]
+        _checked(requests.post(_url(f"/task/new/upload/{uuid}"), params=_auth(), files=files,
+                               timeout=NODEODM_HTTP_TIMEOUT_S))
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def reconstruct_nodeodm(image_paths: list, dsm_path: str, progress=None) -> str:
+    """
+    Runs an ODM task on a NodeODM node: init, parallel batched upload, commit, poll,
+    then download only the DSM. Upload is reported as the first 10% of progress.
+    """
+    if not image_paths:
+        raise ValueError("Photogrammetry needs images, but the project has none")
+
+    options = json.dumps([{"name": name, "value": value} for name, value in NODEODM_OPTIONS.items()])
+    name = os.path.basename(os.path.dirname(dsm_path))
+    uuid = _checked(requests.post(_url("/task/new/init"), params=_auth(), data={"name": name, "options": options},
+                                  timeout=NODEODM_HTTP_TIMEOUT_S))["uuid"]
+    print(f"NodeODM task {uuid} created for {len(image_paths)} images.")
+
+    try:
+        batches = [image_paths[i:i + NODEODM_UPLOAD_BATCH] for i in range(0, len(image_paths), NODEODM_UPLOAD_BATCH)]
+        with metrics.step("upload", images=len(image_paths)):
+            with ThreadPoolExecutor(max_workers=NODEODM_UPLOAD_WORKERS) as pool:
+                for done, _ in enumerate(pool.map(_upload_batch, [uuid] * len(batches), batches), 1):
+                    if progress:
+                        progress(done, 10 * len(batches))
+        _checked(requests.post(_url(f"/task/new/commit/{uuid}"), params=_auth(), timeout=NODEODM_HTTP_TIMEOUT_S))
+
+        with metrics.step("odm"):
+            deadline = time.monotonic() + NODEODM_TIMEOUT_S
+            while True:
+                info = _checked(requests.get(_url(f"/task/{uuid}/info"), params=_auth(), timeout=NODEODM_HTTP_TIMEOUT_S))
+                code = info["status"]["code"]
+                if code == STATUS_COMPLETED:
+                    break
+                if code in (STATUS_FAILED, STATUS_CANCELED):
+                    raise RuntimeError(f"NodeODM task {uuid} failed: {info['status'].get('errorMessage', code)}")
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"NodeODM task {uuid} did not finish within {NODEODM_TIMEOUT_S}s")
+                if progress:
+                    progress(10 + 0.9 * float(info.get("progress", 0)), 100)
+                time.sleep(NODEODM_POLL_S)
+
+        download_path = f"{dsm_path}.download"
+        with metrics.step("download"):
+            with requests.get(_url(f"/task/{uuid}/download/dsm.tif"), params=_auth(), stream=True,
+                              timeout=NODEODM_HTTP_TIMEOUT_S) as response:
+                response.raise_for_status()
+                with open(download_path, "wb") as f:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                        f.write(chunk)
+        try:
+            raster.to_cog(download_path, dsm_path)
+        finally:
+            os.remove(download_path)
+    finally:
+        # The node keeps task data until removed; failed tasks are cancelled on the way
+        try:
+            requests.post(_url("/task/remove"), params=_auth(), data={"uuid": uuid}, timeout=NODEODM_HTTP_TIMEOUT_S)
+        except requests.RequestException as e:
+            print(f"Warning: could not remove NodeODM task {uuid}: {e}")
+
+    if progress:
+        progress(1, 1)
+    return dsm_path
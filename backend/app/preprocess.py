@@ -0,0 +1,233 @@
+# app/preprocess.py
+import os
+import re
+import math
+import time
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from . import metrics
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+    print("Warning: Pillow not installed. Images will be passed to photogrammetry unprocessed.")
+
+# --- Image Preprocessing Settings ---
+# Drone frames are read for their position, frames that add nothing over their
+# neighbour on the flight line are dropped, and the rest are downscaled before
+# reconstruction, whose run time grows with image count and resolution.
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".tif", ".tiff", ".png")
+# Threads: Pillow releases the GIL while decoding, resizing and encoding, and Celery
+# prefork children may not start a process pool of their own
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", min(8, os.cpu_count() or 1)))
+# Longest side of the images handed to reconstruction (ODM's own default); 0 keeps full size.
+# Only JPEGs are downscaled; TIFFs (multispectral, 16-bit) pass through untouched.
+PREPROCESS_MAX_DIMENSION_PX = int(os.getenv("PREPROCESS_MAX_DIMENSION_PX", 2048))
+JPEG_QUALITY = 92
+# A frame whose ground footprint overlaps the last kept frame of its flight line by more
+# than this fraction is redundant (hovering, take-off and landing, over-dense
+# triggering). 0.9 still leaves ~80% forward overlap; 1.0 disables culling.
+MAX_FORWARD_OVERLAP = float(os.getenv("MAX_FORWARD_OVERLAP", 0.9))
+# Used when a frame carries no height above take-off (DJI XMP RelativeAltitude)
+DEFAULT_FLIGHT_HEIGHT_M = float(os.getenv("DEFAULT_FLIGHT_HEIGHT_M", 80))
+# Used when a frame carries no 35 mm equivalent focal length (a typical drone wide angle)
+DEFAULT_FOCAL_35MM = 24.0
+# Header bytes searched for XMP metadata; DJI writes it right after EXIF
+XMP_SEARCH_BYTES = 128 * 1024
+RELATIVE_ALTITUDE_PATTERN = re.compile(rb'RelativeAltitude="?\s*([+-]?\d+(?:\.\d+)?)')
+EARTH_RADIUS_M = 6371008.8
+
+# EXIF tags
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+DATETIME_ORIGINAL = 0x9003
+FOCAL_LENGTH_35MM = 0xA405
+
+
+def list_images(images_dir: str) -> list:
+    """Uploaded images of a project, by name; partial uploads and the manifest are hidden files."""
+    if not os.path.isdir(images_dir):
+        return []
+    return sorted(
+        os.path.join(images_dir, name) for name in os.listdir(images_dir)
+        if not name.startswith(".") and name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def _degrees(value, ref) -> float:
+    degrees, minutes, seconds = (float(part) for part in value)
+    sign = -1.0 if ref in ("S", "W") else 1.0
+    return sign * (degrees + minutes / 60.0 + seconds / 3600.0)
+
+
+def _relative_altitude(path: str):
+    with open(path, "rb") as f:
+        match = RELATIVE_ALTITUDE_PATTERN.search(f.read(XMP_SEARCH_BYTES))
+    return float(match.group(1)) if match else None
+
+
+def read_metadata(path: str) -> dict:
+    """
+    Position, capture time and camera geometry of one image. Only the header is read.
+    Missing fields are None; a frame without GPS is never culled.
+    """
+    stat = os.stat(path)
+    record = {"path": path, "size_bytes": stat.st_size, "signature": f"{stat.st_size}:{stat.st_mtime_ns}",
+              "lat": None, "lon": None, "height_m": None, "captured": None, "focal_35mm": None,
+              "width": None, "height": None}
+    if not HAS_PIL:
+        return record
+    try:
+        with Image.open(path) as image:
+            record["width"], record["height"] = image.size
+            exif = image.getexif()
+            gps = exif.get_ifd(GPS_IFD)
+            details = exif.get_ifd(EXIF_IFD)
+    except Exception as e:
+        print(f"Warning: could not read metadata of {os.path.basename(path)}: {e}")
+        return record
+
+    if 2 in gps and 4 in gps:
+        record["lat"] = _degrees(gps[2], gps.get(1, "N"))
+        record["lon"] = _degrees(gps[4], gps.get(3, "E"))
+    record["captured"] = details.get(DATETIME_ORIGINAL)
+    record["focal_35mm"] = float(details[FOCAL_LENGTH_35MM]) if details.get(FOCAL_LENGTH_35MM) else None
+    record["height_m"] = _relative_altitude(path)
+    return record
+
+
+def footprint_m(record: dict) -> float:
+    """Ground length of the short image side; the conservative direction for forward overlap."""
+    height_m = record["height_m"] if record["height_m"] and record["height_m"] > 0 else DEFAULT_FLIGHT_HEIGHT_M
+    focal = record["focal_35mm"] or DEFAULT_FOCAL_35MM
+    # A 35 mm equivalent lens images 36 mm across the long side
+    long_side_m = height_m * 36.0 / focal
+    if record["width"] and record["height"]:
+        return long_side_m * min(record["width"], record["height"]) / max(record["width"], record["height"])
+    return long_side_m * 2.0 / 3.0
+
+
+def ground_distance_m(a: dict, b: dict) -> float:
+    # Equirectangular approximation; exact to well under a centimetre between neighbouring frames
+    mean_lat = math.radians((a["lat"] + b["lat"]) / 2.0)
+    dx = math.radians(b["lon"] - a["lon"]) * math.cos(mean_lat)
+    dy = math.radians(b["lat"] - a["lat"])
+    return EARTH_RADIUS_M * math.hypot(dx, dy)
+
+
+def cull_redundant(records: list, max_overlap: float = MAX_FORWARD_OVERLAP) -> tuple:
+    """
+    Walks the frames in capture order and drops those overlapping the last kept frame
+    by more than max_overlap. Returns (kept, culled) lists of records.
+    """
+    ordered = sorted(records, key=lambda record: (record["captured"] or "", os.path.basename(record["path"])))
+    if max_overlap >= 1.0:
+        return ordered, []
+
+    kept, culled, anchor = [], [], None
+    for record in ordered:
+        if record["lat"] is None:
+            kept.append(record)
+            continue
+        if anchor is not None:
+            overlap = 1.0 - ground_distance_m(anchor, record) / min(footprint_m(anchor), footprint_m(record))
+            if overlap > max_overlap:
+                culled.append(record)
+                continue
+        kept.append(record)
+        anchor = record
+    return kept, culled
+
+
+def prepare_image(src_path: str, out_path: str, max_dimension: int = PREPROCESS_MAX_DIMENSION_PX) -> int:
+    """
+    Writes the reconstruction copy of one image: a downscaled JPEG keeping its EXIF and
+    XMP, or a hard link to the original when no downscaling applies. Returns its size.
+    """
+    tmp_path = f"{out_path}.tmp"
+    if HAS_PIL and max_dimension and src_path.lower().endswith((".jpg", ".jpeg")):
+        with Image.open(src_path) as image:
+            if max(image.size) > max_dimension:
+                exif, xmp = image.info.get("exif"), image.info.get("xmp")
+                # thumbnail() lets the JPEG decoder scale by 1/2..1/8 while decoding when the
+                # source is at least twice the target; bicubic is ~20% cheaper than Lanczos
+                image.thumbnail((max_dimension, max_dimension), Image.Resampling.BICUBIC, reducing_gap=2.0)
+                options = {"exif": exif} if exif else {}
+                if xmp:
+                    options["xmp"] = xmp
+                image.save(tmp_path, "JPEG", quality=JPEG_QUALITY, **options)
+                os.replace(tmp_path, out_path)
+                return os.path.getsize(out_path)
+
+    try:
+        os.link(src_path, tmp_path)
+    except OSError:
+        shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, out_path)
+    return os.path.getsize(out_path)
+
+
+def prepared_dir(project_dir: str, max_dimension: int = PREPROCESS_MAX_DIMENSION_PX) -> str:
+    # One directory per output size, so a settings change never reuses stale copies
+    return os.path.join(project_dir, "images", str(max_dimension or "full"))
+
+
+def _prepare_if_stale(src_path: str, out_path: str, max_dimension: int) -> int:
+    if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(src_path):
+        return os.path.getsize(out_path)
+    return prepare_image(src_path, out_path, max_dimension)
+
+
+def preprocess_images(images_dir: str, project_dir: str, max_dimension: int = PREPROCESS_MAX_DIMENSION_PX,
+                      max_overlap: float = MAX_FORWARD_OVERLAP, workers: int = PREPROCESS_WORKERS,
+                      progress=None) -> dict:
+    """
+    Reads the metadata of every uploaded image, culls redundant frames and writes the
+    kept ones to prepared_dir() on a thread pool. Copies already prepared from an
+    unchanged original are reused. Returns the kept paths, the metadata records of all
+    images (prepared_path is None for culled frames) and a throughput report.
+    progress(done, total) is called as images are prepared.
+    """
+    started = time.perf_counter()
+    sources = list_images(images_dir)
+    out_dir = prepared_dir(project_dir, max_dimension)
+    os.makedirs(out_dir, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        with metrics.step("read_exif", images=len(sources)):
+            records = list(pool.map(read_metadata, sources))
+        kept, culled = cull_redundant(records, max_overlap)
+        for record in culled:
+            record["prepared_path"] = None
+        for record in kept:
+            record["prepared_path"] = os.path.join(out_dir, os.path.basename(record["path"]))
+
+        out_paths = [record["prepared_path"] for record in kept]
+        with metrics.step("downscale", images=len(kept)):
+            sizes = []
+            for size in pool.map(_prepare_if_stale, [record["path"] for record in kept], out_paths,
+                                 [max_dimension] * len(kept)):
+                sizes.append(size)
+                if progress:
+                    progress(len(sizes), len(kept))
+
+    # Copies of images that were culled or deleted since the last run must not be reconstructed
+    keep_names = {os.path.basename(path) for path in out_paths}
+    for name in os.listdir(out_dir):
+        if name not in keep_names:
+            os.remove(os.path.join(out_dir, name))
+
+    seconds = time.perf_counter() - started
+    report = {
+        "images": len(sources),
+        "images_kept": len(kept),
+        "images_culled": len(culled),
+        "images_without_gps": sum(record["lat"] is None for record in records),
+        "input_bytes": sum(record["size_bytes"] for record in records),
+        "prepared_bytes": sum(sizes),
+        "preprocess_seconds": round(seconds, 3),
+        "images_per_s": round(len(sources) / seconds, 1) if seconds > 0 else 0.0,
+    }
+    return {"images": out_paths, "records": kept + culled, "report": report}
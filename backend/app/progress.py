@@ -0,0 +1,90 @@
+# app/progress.py
+import os
+import time
+import threading
+from sqlalchemy import update
+from . import database, models
+
+# --- Status Reporter Settings ---
+# Status writes from pipeline stages are buffered and coalesced; pending values reach
+# the database at most this many seconds after they were reported.
+STATUS_FLUSH_INTERVAL_S = float(os.getenv("STATUS_FLUSH_INTERVAL_S", 1.0))
+
+
+class StatusReporter:
+    """
+    Buffers project status/column updates per worker process and writes them in
+    batches through one long-lived session. Updates to the same project coalesce
+    (the latest value per column wins); anything pending is flushed at most
+    flush_interval seconds later, or immediately when final=True.
+    """
+
+    def __init__(self, session_factory=database.SessionLocal, flush_interval: float = STATUS_FLUSH_INTERVAL_S):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._session = None
+        self._timer = None
+        self._last_flush = 0.0
+
+    def _check_fork(self):
+        # Prefork workers inherit the parent's reporter; start clean in the child
+        if os.getpid() != self._pid:
+            self._reset()
+
+    def update(self, project_id: int, status: str = None, data: dict = None, final: bool = False):
+        self._check_fork()
+        with self._lock:
+            values = self._pending.setdefault(project_id, {})
+            if status is not None:
+                values["status"] = status
+            if data:
+                values.update(data)
+
+            due = final or (time.monotonic() - self._last_flush) >= self.flush_interval
+            if not due and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush_quietly)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Writes every pending update in one transaction."""
+        self._check_fork()
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+            if not pending:
+                return
+
+            if self._session is None:
+                self._session = self.session_factory()
+            try:
+                for project_id, values in pending.items():
+                    self._session.execute(
+                        update(models.Project).where(models.Project.id == project_id).values(**values)
+                    )
+                self._session.commit()
+            except Exception:
+                self._session.rollback()
+                # Keep the failed batch for the next flush without clobbering newer values
+                for project_id, values in pending.items():
+                    self._pending[project_id] = {**values, **self._pending.get(project_id, {})}
+                raise
+
+    def flush_quietly(self):
+        """flush() for timer threads and signal handlers: a failed write is logged and retried later."""
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Warning: could not flush project status updates: {e}")
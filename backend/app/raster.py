@@ -0,0 +1,304 @@
+# app/raster.py
+import os
+import hashlib
+import tempfile
+from contextlib import contextmanager, ExitStack
+import numpy as np
+from . import metrics
+
+# Optional imports - handle gracefully if not available
+try:
+    import rasterio
+    import rasterio.shutil
+    from rasterio.windows import Window
+    HAS_RASTERIO = True
+except ImportError:
+    HAS_RASTERIO = False
+    print("Warning: Rasterio not installed. Windowed raster processing will be unavailable.")
+
+
+# --- Raster Engine Settings ---
+# Edge length (pixels) of the square windows streamed through memory. Peak memory
+# is roughly 3 * BLOCK_SIZE^2 * 4 bytes regardless of the raster size.
+BLOCK_SIZE = 1024
+# Internal GeoTIFF tile size; BLOCK_SIZE should be a multiple of this so every
+# window write lands on whole tiles.
+TILE_SIZE = 512
+CHM_NODATA = -9999.0
+
+# --- Cloud-Optimized GeoTIFF Output ---
+# Final rasters (DSM copy, DTM, CHM) are COGs: TILE_SIZE tiles, DEFLATE with the
+# floating-point predictor for float data, and internal overviews down to a single tile.
+COG_COMPRESSION = "DEFLATE"
+COG_OVERVIEW_RESAMPLING = "AVERAGE"
+
+# --- Memory-Mapped Intermediates ---
+# Stages that need a whole band at once (segmentation, zonal statistics) read it
+# through an uncompressed .npy copy opened with np.memmap instead of decoding the COG
+# onto the heap. Its pages live in the OS page cache, so pool workers and later stages
+# share one physical copy, and the kernel drops clean pages under memory pressure
+# instead of the worker swapping. The copy is made once per version of the raster.
+RASTER_MMAP_ENABLED = os.getenv("RASTER_MMAP_ENABLED", "true").lower() in ("1", "true", "yes")
+# Where the copies are kept; default is a .mmap directory next to the raster. A local
+# disk or tmpfs (/dev/shm) directory shared by all projects also works.
+RASTER_MMAP_DIRECTORY = os.getenv("RASTER_MMAP_DIRECTORY", "")
+MMAP_DIRECTORY_NAME = ".mmap"
+# Rows of label or value strips copied through the heap at a time, as a pixel budget
+MMAP_STRIP_PIXELS = BLOCK_SIZE * BLOCK_SIZE
+
+
+def iter_windows(width: int, height: int, block_size: int = BLOCK_SIZE):
+    """Yields row-major windows of at most block_size x block_size covering the raster."""
+    for row_off in range(0, height, block_size):
+        for col_off in range(0, width, block_size):
+            yield Window(
+                col_off, row_off,
+                min(block_size, width - col_off),
+                min(block_size, height - row_off),
+            )
+
+
+def tiled_profile(src_profile: dict, dtype: str = "float32", nodata=None) -> dict:
+    """Builds a single-band, tiled and compressed GeoTIFF profile from a source profile."""
+    profile = dict(src_profile)
+    profile.update(
+        driver="GTiff",
+        count=1,
+        dtype=dtype,
+        nodata=nodata,
+        tiled=True,
+        blockxsize=TILE_SIZE,
+        blockysize=TILE_SIZE,
+        compress="deflate",
+        predictor=3 if np.dtype(dtype).kind == "f" else 2,
+        BIGTIFF="IF_SAFER",
+    )
+    return profile
+
+
+def cog_options(dtype: str, resampling: str = COG_OVERVIEW_RESAMPLING) -> dict:
+    """Creation options for the GDAL COG driver."""
+    return {
+        "driver": "COG",
+        "BLOCKSIZE": TILE_SIZE,
+        "COMPRESS": COG_COMPRESSION,
+        "PREDICTOR": "FLOATING_POINT" if np.dtype(dtype).kind == "f" else "STANDARD",
+        "OVERVIEWS": "AUTO",
+        "OVERVIEW_RESAMPLING": resampling,
+        "BIGTIFF": "IF_SAFER",
+        "NUM_THREADS": "ALL_CPUS",
+    }
+
+
+def to_cog(src_path: str, cog_path: str, resampling: str = COG_OVERVIEW_RESAMPLING) -> str:
+    """Copies any raster GDAL can read into a COG, atomically replacing cog_path."""
+    with rasterio.open(src_path) as src:
+        dtype = src.dtypes[0]
+    tmp_path = f"{cog_path}.tmp"
+    rasterio.shutil.copy(src_path, tmp_path, **cog_options(dtype, resampling))
+    os.replace(tmp_path, cog_path)
+    return cog_path
+
+
+@contextmanager
+def cog_output(cog_path: str, resampling: str = COG_OVERVIEW_RESAMPLING):
+    """
+    Yields a scratch path for a windowed writer (the COG driver cannot be written
+    block by block); once the block completes, the scratch GeoTIFF is converted into
+    a COG at cog_path. The scratch file is always removed.
+    """
+    scratch_path = f"{os.path.splitext(cog_path)[0]}.scratch.tif"
+    try:
+        yield scratch_path
+        with metrics.step("cog", output=os.path.basename(cog_path)):
+            to_cog(scratch_path, cog_path, resampling)
+    finally:
+        if os.path.exists(scratch_path):
+            os.remove(scratch_path)
+
+
+def chm_block(dsm, ground, window):
+    """CHM and ground heights (float32) of one window; DSM nodata or missing ground become CHM_NODATA."""
+    chm_block = dsm.read(1, window=window, out_dtype="float32")
+    dtm_block = ground.read(window)
+
+    invalid = np.isnan(dtm_block)
+    if dsm.nodata is not None:
+        # NaN never compares equal, so a NaN nodata value is matched with isnan
+        invalid |= np.isnan(chm_block) if np.isnan(dsm.nodata) else chm_block == dsm.nodata
+
+    np.subtract(chm_block, dtm_block, out=chm_block)
+    chm_block[invalid] = CHM_NODATA
+    return chm_block, np.where(np.isnan(dtm_block), CHM_NODATA, dtm_block).astype(np.float32)
+
+
+def write_chm_windowed(dsm_path: str, ground, chm_path: str, dtm_path: str = None,
+                       block_size: int = BLOCK_SIZE, progress=None) -> str:
+    """
+    Streams DSM windows, subtracts the ground surface block by block and writes the
+    CHM as a COG. `ground` is any object whose read(window) returns the terrain heights
+    for a window (NaN where unknown), e.g. a dtm ground model; with dtm_path the ground
+    surface is written as a COG in the same pass. Pixels that are DSM nodata or have no
+    ground become CHM_NODATA. progress(done, total) is called after each window.
+    """
+    with ExitStack() as stack:
+        dsm = stack.enter_context(rasterio.open(dsm_path))
+        profile = tiled_profile(dsm.profile, dtype="float32", nodata=CHM_NODATA)
+        chm_scratch = stack.enter_context(cog_output(chm_path))
+        dtm_scratch = stack.enter_context(cog_output(dtm_path)) if dtm_path else None
+
+        with ExitStack() as writers:
+            dst = writers.enter_context(rasterio.open(chm_scratch, "w", **profile))
+            dtm_dst = writers.enter_context(rasterio.open(dtm_scratch, "w", **profile)) if dtm_scratch else None
+
+            windows = list(iter_windows(dsm.width, dsm.height, block_size))
+            with metrics.step("subtract", **metrics.raster_dims(dsm.width, dsm.height), windows=len(windows)):
+                for done, window in enumerate(windows, start=1):
+                    chm_values, dtm_values = chm_block(dsm, ground, window)
+                    dst.write(chm_values, 1, window=window)
+                    if dtm_dst is not None:
+                        dtm_dst.write(dtm_values, 1, window=window)
+                    if progress is not None:
+                        progress(done, len(windows))
+
+    return chm_path
+
+
+def windows_within(region, width: int, height: int, block_size: int = BLOCK_SIZE) -> list:
+    """The block-grid windows that intersect a region (a Window), clipped to the raster."""
+    return [
+        window for window in iter_windows(width, height, block_size)
+        if window.col_off < region.col_off + region.width and region.col_off < window.col_off + window.width
+        and window.row_off < region.row_off + region.height and region.row_off < window.row_off + window.height
+    ]
+
+
+def update_chm_windowed(dsm_path: str, ground, chm_path: str, dtm_path: str, region,
+                        block_size: int = BLOCK_SIZE, progress=None) -> int:
+    """
+    Recomputes an existing CHM and DTM only in the block windows intersecting region.
+    The old rasters are copied block for block by GDAL and the result is written back as
+    COGs. Returns the number of windows recomputed.
+    """
+    with ExitStack() as stack:
+        dsm = stack.enter_context(rasterio.open(dsm_path))
+        profile = tiled_profile(dsm.profile, dtype="float32", nodata=CHM_NODATA)
+        copy_options = {key: profile[key] for key in ("tiled", "blockxsize", "blockysize", "compress", "predictor", "BIGTIFF")}
+        chm_scratch = stack.enter_context(cog_output(chm_path))
+        dtm_scratch = stack.enter_context(cog_output(dtm_path))
+
+        with metrics.step("copy_unchanged"):
+            rasterio.shutil.copy(chm_path, chm_scratch, driver="GTiff", **copy_options)
+            rasterio.shutil.copy(dtm_path, dtm_scratch, driver="GTiff", **copy_options)
+
+        windows = windows_within(region, dsm.width, dsm.height, block_size)
+        with ExitStack() as writers:
+            dst = writers.enter_context(rasterio.open(chm_scratch, "r+"))
+            dtm_dst = writers.enter_context(rasterio.open(dtm_scratch, "r+"))
+            pixels = sum(window.width * window.height for window in windows)
+            with metrics.step("subtract", pixels=pixels, windows=len(windows)):
+                for done, window in enumerate(windows, start=1):
+                    chm_values, dtm_values = chm_block(dsm, ground, window)
+                    dst.write(chm_values, 1, window=window)
+                    dtm_dst.write(dtm_values, 1, window=window)
+                    if progress is not None:
+                        progress(done, len(windows))
+
+    return len(windows)
+
+
+# --- Memory-Mapped Intermediates ---
+
+def _mmap_dir(path: str) -> str:
+    return RASTER_MMAP_DIRECTORY or os.path.join(os.path.dirname(os.path.abspath(path)), MMAP_DIRECTORY_NAME)
+
+
+def _mmap_prefix(path: str) -> str:
+    name = os.path.splitext(os.path.basename(path))[0]
+    if RASTER_MMAP_DIRECTORY:
+        # One directory for many projects: tell equally named rasters apart by location
+        name = f"{hashlib.sha256(os.path.realpath(path).encode()).hexdigest()[:16]}-{name}"
+    return f"{name}."
+
+
+def mmap_path(path: str, dtype: str = "float32") -> str:
+    """Path of the uncompressed copy of a raster's first band; it names the raster's version."""
+    stat = os.stat(path)
+    version = f"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    return os.path.join(_mmap_dir(path), f"{_mmap_prefix(path)}{version}.{np.dtype(dtype).name}.npy")
+
+
+def band_memmap(path: str, dtype: str = "float32") -> np.ndarray:
+    """
+    Read-only np.memmap of a raster's first band. The first caller for a version of the
+    raster decodes it window by window into the .npy copy (replacing copies of older
+    versions); everyone else maps the existing file. Nodata pixels keep their value.
+    """
+    out_path = mmap_path(path, dtype)
+    if not os.path.exists(out_path):
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tmp_path = f"{out_path}.{os.getpid()}.tmp"
+        with rasterio.open(path) as src:
+            with metrics.step("mmap_decode", **metrics.raster_dims(src.width, src.height)):
+                band = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(src.height, src.width))
+                for window in iter_windows(src.width, src.height):
+                    band[window.toslices()] = src.read(1, window=window, out_dtype=dtype)
+                band.flush()
+                del band
+        os.replace(tmp_path, out_path)
+
+        release_band(path, keep=out_path)
+    return np.load(out_path, mmap_mode="r")
+
+
+def release_band(path: str, keep: str = None):
+    """
+    Removes the memory-mapped copies of a raster (except keep). Processes still mapping
+    one keep their view until they unmap it.
+    """
+    directory, prefix = _mmap_dir(path), _mmap_prefix(path)
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        copy_path = os.path.join(directory, name)
+        # <prefix><version>.<dtype>.npy; other rasters sharing the prefix have more dots
+        if name.startswith(prefix) and name.endswith(".npy") and name[len(prefix):].count(".") == 2 \
+                and copy_path != keep:
+            try:
+                os.remove(copy_path)
+            except OSError:
+                pass
+
+
+def read_band(path: str, window=None, dtype: str = "float32") -> np.ndarray:
+    """
+    A raster's first band (or one window of it) for read-only use: a view into
+    band_memmap() when RASTER_MMAP_ENABLED, otherwise a fresh array read by rasterio.
+    """
+    if RASTER_MMAP_ENABLED:
+        band = band_memmap(path, dtype)
+        return band if window is None else band[window.toslices()]
+    with rasterio.open(path) as src:
+        return src.read(1, window=window, out_dtype=dtype)
+
+
+@contextmanager
+def scratch_band(path: str, name: str, shape: tuple, dtype):
+    """
+    Yields a writable np.memmap for a full-size intermediate derived from the raster at
+    path (e.g. a label image), backed by a file next to its memory-mapped copy and
+    removed afterwards. Yields None when RASTER_MMAP_ENABLED is off; callers then
+    allocate on the heap.
+    """
+    if not RASTER_MMAP_ENABLED:
+        yield None
+        return
+    os.makedirs(_mmap_dir(path), exist_ok=True)
+    fd, scratch_path = tempfile.mkstemp(prefix=f"{_mmap_prefix(path)}{name}.", suffix=".scratch", dir=_mmap_dir(path))
+    os.close(fd)
+    band = np.memmap(scratch_path, mode="w+", dtype=dtype, shape=shape)
+    try:
+        yield band
+    finally:
+        del band
+        os.remove(scratch_path)
@@ -0,0 +1,162 @@
+# app/scheduling.py
+import os
+import time
+import socket
+from contextlib import contextmanager
+from . import events
+
+# --- Stage Queues ---
+# Each stage is routed to the queue matching the resource it is bound by, so workers
+# can be sized per resource (see docker-compose.yml) and a long segmentation job never
+# sits in front of cheap carbon recalculations. A worker started without -Q consumes
+# all three.
+QUEUE_IO = "pipeline.io"        # photogrammetry inputs and the DSM -> CHM warp
+QUEUE_CPU = "pipeline.cpu"      # watershed segmentation
+QUEUE_LIGHT = "pipeline.light"  # orchestration, carbon, error handling
+QUEUES = (QUEUE_IO, QUEUE_CPU, QUEUE_LIGHT)
+
+TASK_ROUTES = {
+    "app.tasks.run_photogrammetry": {"queue": QUEUE_IO},
+    "app.tasks.generate_chm": {"queue": QUEUE_IO},
+    "app.tasks.segment_trees": {"queue": QUEUE_CPU},
+    "app.tasks.calculate_carbon": {"queue": QUEUE_LIGHT},
+    "app.tasks.start_processing_pipeline": {"queue": QUEUE_LIGHT},
+    "app.tasks.handle_error": {"queue": QUEUE_LIGHT},
+    "app.tasks.start_batch_pipeline": {"queue": QUEUE_LIGHT},
+    "app.tasks.summarize_batch": {"queue": QUEUE_LIGHT},
+    "app.tasks.handle_batch_error": {"queue": QUEUE_LIGHT},
+}
+
+# --- Project Priority ---
+# Celery's Redis transport serves lower numbers first: 0 is the most urgent project.
+MIN_PRIORITY = 0
+MAX_PRIORITY = 9
+DEFAULT_PRIORITY = int(os.getenv("DEFAULT_PROJECT_PRIORITY", 5))
+
+# --- Memory-Aware Admission ---
+# Heavy stages reserve their estimated peak memory from the worker host's budget before
+# starting; a stage that does not fit is put back with a short delay so smaller jobs run
+# meanwhile. A job larger than the whole budget runs once nothing else is reserved.
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+MEMORY_BUDGET_FRACTION = float(os.getenv("WORKER_MEMORY_BUDGET_FRACTION", 0.8))
+ADMISSION_RETRY_S = int(os.getenv("ADMISSION_RETRY_S", 15))
+# Reservations of workers that died are dropped after this long
+RESERVATION_TTL_S = 6 * 3600
+# Peak bytes per CHM pixel of a single-process segmentation (CHM, working grid, labels,
+# full-resolution labels and zonal sort keys), measured with benchmarks/bench.py
+SEGMENT_BYTES_PER_PIXEL = 28
+# With raster.RASTER_MMAP_ENABLED the CHM and, in a single pass, the full-resolution
+# labels are file-backed page cache shared between processes, not worker heap
+MAPPED_CHM_BYTES_PER_PIXEL = 4
+MAPPED_LABEL_BYTES_PER_PIXEL = 4
+# generate_chm streams windows; its peak is a few float32 blocks plus GDAL's block cache
+CHM_WINDOW_BLOCKS = 8
+GDAL_CACHE_BYTES = 256 * 1024 ** 2
+
+
+def normalize_priority(priority) -> int:
+    if priority is None:
+        return DEFAULT_PRIORITY
+    return min(max(int(priority), MIN_PRIORITY), MAX_PRIORITY)
+
+
+def memory_budget_bytes() -> int:
+    """Bytes of this host (or container, if it has a cgroup limit) heavy stages may reserve."""
+    budget = os.getenv("WORKER_MEMORY_BUDGET_BYTES")
+    if budget:
+        return int(budget)
+    total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            total = min(total, int(limit))
+    return int(total * MEMORY_BUDGET_FRACTION)
+
+
+def estimate_bytes(stage: str, width: int, height: int) -> int:
+    """Estimated peak memory of a stage for a raster of the given dimensions."""
+    # Imported here: this module is loaded by the API and light workers, which never
+    # estimate and should not pay for rasterio and scikit-image
+    from . import raster, segmentation
+    pixels = width * height
+    if stage == "generate_chm":
+        return CHM_WINDOW_BLOCKS * raster.BLOCK_SIZE ** 2 * 4 + GDAL_CACHE_BYTES
+    if stage == "segment_trees":
+        mapped = MAPPED_CHM_BYTES_PER_PIXEL if raster.RASTER_MMAP_ENABLED else 0
+        if not segmentation.use_tiled_mode(width, height):
+            if raster.RASTER_MMAP_ENABLED:
+                mapped += MAPPED_LABEL_BYTES_PER_PIXEL
+            return pixels * (SEGMENT_BYTES_PER_PIXEL - mapped)
+        tile_pixels = (segmentation.TILE_SIZE + 2 * segmentation.TILE_HALO) ** 2
+        workers = max(1, min(segmentation.SEGMENTATION_WORKERS, -(-pixels // segmentation.TILE_SIZE ** 2)))
+        return tile_pixels * (SEGMENT_BYTES_PER_PIXEL - mapped) * workers
+    return 0
+
+
+def reservations_key(host: str) -> str:
+    return f"admission:{host}"
+
+
+def try_reserve(client, key: str, reservation_id: str, size: int, budget: int) -> bool:
+    """
+    Atomically adds a reservation if the live reservations plus this one fit the
+    budget (or nothing else is reserved). Expired reservations are dropped on the way.
+    """
+    def reserve(pipe):
+        now = time.time()
+        reserved, stale = 0, []
+        for field, value in pipe.hgetall(key).items():
+            reserved_size, expires_at = value.decode().split()
+            if float(expires_at) < now:
+                stale.append(field)
+            elif field.decode() != reservation_id:
+                reserved += int(reserved_size)
+        admitted = reserved == 0 or reserved + size <= budget
+        pipe.multi()
+        if stale:
+            pipe.hdel(key, *stale)
+        if admitted:
+            pipe.hset(key, reservation_id, f"{size} {now + RESERVATION_TTL_S}")
+        return admitted
+
+    return client.transaction(reserve, key, value_from_callable=True)
+
+
+@contextmanager
+def admission(task, stage: str, width: int, height: int):
+    """
+    Holds a memory reservation for the enclosed block. If the estimated peak does not
+    fit the host's remaining budget, the task is retried after ADMISSION_RETRY_S
+    (celery.exceptions.Retry propagates out of the block, so declare the task with
+    max_retries=None). Best effort: without Redis the stage simply runs.
+    """
+    size = estimate_bytes(stage, width, height)
+    if not ADMISSION_ENABLED or not events.HAS_REDIS or size == 0:
+        yield size
+        return
+
+    key = reservations_key(socket.gethostname())
+    reservation_id = task.request.id or f"{stage}:{os.getpid()}"
+    try:
+        client = events.get_client()
+        admitted = try_reserve(client, key, reservation_id, size, memory_budget_bytes())
+    except Exception as e:
+        print(f"Warning: memory admission unavailable, running {stage} without a reservation: {e}")
+        yield size
+        return
+
+    if not admitted:
+        print(f"Deferring {stage} ({size / 1024 ** 2:.0f} MiB estimated): worker memory budget is in use.")
+        raise task.retry(countdown=ADMISSION_RETRY_S)
+
+    try:
+        yield size
+    finally:
+        try:
+            client.hdel(key, reservation_id)
+        except Exception as e:
+            print(f"Warning: could not release memory reservation {reservation_id}: {e}")
@@ -1,16 +1,130 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, List, Any
+from datetime import datetime
+from .batches import MAX_BATCH_PROJECTS
 
 class ProjectBase(BaseModel):
     name: str
 
 class ProjectCreate(ProjectBase):
-    pass
+    # Pipeline queue priority: 0 is the most urgent, 9 the least; None uses the default
+    priority: Optional[int] = Field(None, ge=0, le=9)
 
 class Project(ProjectBase):
     id: int
     status: str
     total_co2_tonnes: Optional[float] = None
+    priority: Optional[int] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class CarbonCoefficients(BaseModel):
+    MAX_REALISTIC_TREE_HEIGHT_M: Optional[float] = None
+    MAX_REALISTIC_CROWN_AREA_SQM: Optional[float] = None
+    MIN_REALISTIC_TREE_HEIGHT_M: Optional[float] = None
+    MIN_REALISTIC_CROWN_AREA_SQM: Optional[float] = None
+    DBH_FROM_HEIGHT_SLOPE: Optional[float] = None
+    DBH_FROM_HEIGHT_INTERCEPT: Optional[float] = None
+    WOOD_DENSITY_RHO: Optional[float] = None
+    ALLOM_COEFF_A: Optional[float] = None
+    ALLOM_COEFF_B: Optional[float] = None
+    BGB_TO_AGB_RATIO: Optional[float] = None
+    CARBON_FRACTION: Optional[float] = None
+    CO2_CONVERSION_FACTOR: Optional[float] = None
+
+class RecomputeResult(BaseModel):
+    project_id: int
+    total_co2_tonnes: float
+    tree_count: int
+    coefficients: Dict[str, float]
+
+class UploadStatus(BaseModel):
+    filename: str
+    offset: int
+    complete: bool
+    duplicate: bool = False
+    sha256: Optional[str] = None
+
+class ProjectResult(Project):
+    chm_path: Optional[str] = None
+    crowns_path: Optional[str] = None
+    carbon_results_path: Optional[str] = None
+
+class BatchCreate(BaseModel):
+    name: str
+    projects: List[ProjectCreate] = Field(..., min_length=1, max_length=MAX_BATCH_PROJECTS)
+
+class Batch(BaseModel):
+    id: int
+    name: str
+    status: str
+    total_co2_tonnes: Optional[float] = None
+    projects: List[Project]
+
+class BatchStatus(BaseModel):
+    batch_id: int
+    name: str
+    status: str
+    project_count: int
+    phase_counts: Dict[str, int]
+    percent_finished: float
+    total_co2_tonnes: float
+    projects: List[Project]
+
+class BatchResults(BaseModel):
+    batch_id: int
+    name: str
+    status: str
+    total_co2_tonnes: float
+    projects: List[ProjectResult]
+
+class ProjectPage(BaseModel):
+    items: List[Project]
+    # Pass as `after` to fetch the next page; None on the last page
+    next_cursor: Optional[int] = None
+    limit: int
+
+class StatusTotal(BaseModel):
+    status: str
+    project_count: int
+    total_co2_tonnes: float
+
+class ProjectSummary(BaseModel):
+    project_count: int
+    total_co2_tonnes: float
+    by_status: List[StatusTotal]
+    by_phase: Dict[str, StatusTotal]
+
+class InventorySummary(BaseModel):
+    project_id: int
+    trees: int
+    total_co2_tonnes: float
+    mean_height_m: Optional[float] = None
+    max_height_m: Optional[float] = None
+    mean_crown_area_sqm: Optional[float] = None
+
+class InventoryTop(BaseModel):
+    project_id: int
+    by: str
+    trees: List[Dict[str, Any]]
+
+class InventoryHistogram(BaseModel):
+    project_id: int
+    column: str
+    # len(edges) == len(counts) + 1; both are empty when no trees match the filters
+    edges: List[float]
+    counts: List[int]
+
+class HeightBand(BaseModel):
+    min_height_m: float
+    max_height_m: float
+    trees: int
+    co2_tonnes: float
+    mean_crown_area_sqm: Optional[float] = None
+
+class InventoryBands(BaseModel):
+    project_id: int
+    bands: List[HeightBand]
@@ -1,277 +1,334 @@
 # app/tasks.py
 import os
-import shutil
-from celery import Celery
-from sqlalchemy.orm import Session
-import numpy as np
-from . import database, models
 import time
-import requests
-import zipfile
-import io
-
-# Optional imports - handle gracefully if not available
-try:
-    from osgeo import gdal
-    HAS_GDAL = True
-except ImportError:
-    HAS_GDAL = False
-    print("Warning: GDAL not installed. Geospatial processing will be limited.")
-
-try:
-    import rasterio
-    from rasterio import features, mask
-    HAS_RASTERIO = True
-except ImportError:
-    HAS_RASTERIO = False
-    print("Warning: Rasterio not installed. Raster processing will be limited.")
-
-try:
-    from scipy import ndimage as ndi
-    from skimage.segmentation import watershed
-    from skimage.feature import peak_local_max
-    from skimage.transform import rescale
-    HAS_SKIMAGE = True
-except ImportError:
-    HAS_SKIMAGE = False
-    print("Warning: Scikit-image/SciPy not installed. Image processing will be limited.")
-
-try:
-    import geopandas as gpd
-    from shapely.geometry import shape
-    HAS_GEOPANDAS = True
-except ImportError:
-    HAS_GEOPANDAS = False
-    print("Warning: GeoPandas not installed. Vector processing will be limited.")
-
-try:
-    import pandas as pd
-    HAS_PANDAS = True
-except ImportError:
-    HAS_PANDAS = False
-    print("Warning: Pandas not installed.")
-
-# --- Celery Configuration ---
-celery_app = Celery(
-    "tasks",
-    broker="redis://redis:6379/0",
-    backend="redis://redis:6379/0",
-)
-celery_app.conf.update(task_track_started=True)
+import importlib
+from celery import chord, signals
+from sqlalchemy import update
+from . import database, models, progress, events, metrics, cache, scheduling
+from .celery_app import celery_app
+
+# --- Lazy Stage Imports ---
+# Stage modules pull in rasterio, SciPy, scikit-image, GeoPandas and pandas (~200 MiB and
+# over a second of imports). Each task imports what it needs when it runs, so the API and
+# light workers never load them; io/cpu workers preload them once in the parent process
+# so their prefork children share the pages copy-on-write.
+STAGE_MODULES = ("raster", "preprocess", "photogrammetry", "incremental", "dtm", "segmentation", "inventory", "artifacts", "carbon")
+HEAVY_QUEUES = (scheduling.QUEUE_IO, scheduling.QUEUE_CPU)
 
 # --- Helper Functions ---
-def get_db():
-    return database.SessionLocal()
-
-def update_project_status(db: Session, project_id: int, status: str, data: dict = None):
-    project = db.query(models.Project).filter(models.Project.id == project_id).first()
-    if project:
-        project.status = status
-        if data:
-            for key, value in data.items():
-                setattr(project, key, value)
-        db.commit()
-
-# --- Placeholder Scientific & Filter Coefficients ---
-MAX_REALISTIC_TREE_HEIGHT_M = 50.0
-MAX_REALISTIC_CROWN_AREA_SQM = 500.0
-MIN_REALISTIC_TREE_HEIGHT_M = 0.5
-MIN_REALISTIC_CROWN_AREA_SQM = 0.5
-DBH_FROM_HEIGHT_SLOPE = 0.3
-DBH_FROM_HEIGHT_INTERCEPT = 0.1
-WOOD_DENSITY_RHO = 0.65
-ALLOM_COEFF_A = 0.1
-ALLOM_COEFF_B = 2.46
-BGB_TO_AGB_RATIO = 0.5
-CARBON_FRACTION = 0.47
-CO2_CONVERSION_FACTOR = 3.67
+# One reporter per worker process: status writes reuse a single session and rapid
+# updates are coalesced into batched commits.
+status_reporter = progress.StatusReporter()
+
+def update_project_status(project_id: int, status: str, data: dict = None, final: bool = False):
+    status_reporter.update(project_id, status, data, final=final)
+
+def finish_stage(stage_progress: events.StageProgress, previous_task_result: dict) -> dict:
+    """Publishes a stage's completion event and returns the per-stage timings so far."""
+    stage_progress.finish()
+    timings = dict(previous_task_result.get("timings", {}))
+    timings[stage_progress.stage] = round(stage_progress.elapsed(), 3)
+    return timings
+
+@signals.celeryd_after_setup.connect
+def _preload_stage_modules(sender, instance, conf, **kwargs):
+    queues = set(instance.app.amqp.queues.consume_from or instance.app.amqp.queues)
+    if queues & set(HEAVY_QUEUES):
+        started = time.perf_counter()
+        for name in STAGE_MODULES:
+            importlib.import_module(f".{name}", __package__)
+        print(f"Preloaded stage modules in {time.perf_counter() - started:.2f}s.")
+
+@signals.worker_process_init.connect
+def _dispose_inherited_connections(**kwargs):
+    # Pooled connections must not be shared with the parent across fork()
+    database.engine.dispose(close=False)
+
+@signals.before_task_publish.connect
+def _flush_before_publish(**kwargs):
+    # A stage's status must be written before the next stage of the chain is enqueued,
+    # otherwise a fast next stage could be overwritten by our late flush.
+    status_reporter.flush_quietly()
+
+@signals.task_postrun.connect
+def _flush_after_task(**kwargs):
+    # Guaranteed flush when any task finishes, whether it succeeded or failed
+    status_reporter.flush_quietly()
 
 # --- Celery Task Chain ---
-@celery_app.task
-def start_processing_pipeline(project_id: int):
-    db = get_db()
-    update_project_status(db, project_id, "PROCESSING: PHOTOGRAMMETRY")
-    db.close()
-    
-    pipeline = (
-        run_photogrammetry.s(project_id) |
-        generate_chm.s() |
-        segment_trees.s() |
-        calculate_carbon.s()
+def pipeline_signature(project_id: int, priority: int = None, full: bool = False):
+    """
+    The four-stage chain of one project; every stage carries the project's priority onto
+    its stage queue. Unless full is set, stages only redo what added images changed.
+    """
+    priority = scheduling.normalize_priority(priority)
+    return (
+        run_photogrammetry.s(project_id, full).set(priority=priority) |
+        generate_chm.s().set(priority=priority) |
+        segment_trees.s().set(priority=priority) |
+        calculate_carbon.s().set(priority=priority)
     ).on_error(handle_error.s(project_id))
-    
-    pipeline.delay()
+
+@celery_app.task
+def start_processing_pipeline(project_id: int, priority: int = None, full: bool = False):
+    update_project_status(project_id, "PROCESSING: PHOTOGRAMMETRY")
+    pipeline_signature(project_id, priority, full).delay()
+
+@celery_app.task
+def start_batch_pipeline(batch_id: int, members: list):
+    """
+    Fans the pipelines of a batch's projects out as one chord: members is a list of
+    (project_id, priority) pairs, and summarize_batch runs once every chain is done.
+    """
+    for project_id, _ in members:
+        update_project_status(project_id, "PROCESSING: PHOTOGRAMMETRY")
+    record_batch(batch_id, status="PROCESSING", total_co2_tonnes=None)
+
+    header = [pipeline_signature(project_id, priority) for project_id, priority in members]
+    chord(header)(summarize_batch.s(batch_id).on_error(handle_batch_error.s(batch_id)))
+
+def record_batch(batch_id: int, **values):
+    with database.SessionLocal() as session:
+        session.execute(update(models.Batch).where(models.Batch.id == batch_id).values(**values))
+        session.commit()
+
+@celery_app.task
+def summarize_batch(results: list, batch_id: int) -> dict:
+    total_co2_tonnes = sum(result["total_co2_tonnes"] for result in results)
+    record_batch(batch_id, status="COMPLETED", total_co2_tonnes=total_co2_tonnes)
+    print(f"Batch {batch_id} complete: {len(results)} projects, {total_co2_tonnes:.2f} tonnes CO2.")
+    return {"batch_id": batch_id, "projects": len(results), "total_co2_tonnes": total_co2_tonnes}
+
+@celery_app.task
+def handle_batch_error(request, exc, traceback, batch_id):
+    # Called once every chain has finished and at least one failed; the per-project
+    # outcome stays on the projects themselves
+    record_batch(batch_id, status="COMPLETED_WITH_ERRORS")
+    print(f"Batch {batch_id} finished with failed projects: {exc}")
 
 @celery_app.task
 def handle_error(request, exc, traceback, project_id):
-    db = get_db()
-    update_project_status(db, project_id, f"FAILED: {str(exc)}")
-    db.close()
+    update_project_status(project_id, f"FAILED: {str(exc)}", final=True)
+    events.publish(project_id, "failed", f"FAILED: {str(exc)}", 100.0)
     print(f"Pipeline failed for project {project_id}: {exc}")
 
 # --- Individual Processing Tasks ---
 
 @celery_app.task(bind=True)
-def run_photogrammetry(self, project_id: int) -> dict:
-    # THIS TASK IS CURRENTLY A SIMULATION FOR PROTOTYPING SPEED
-    # To enable real processing, replace this with the WebODM API version.
-    print(f"[{project_id}] SIMULATING photogrammetry...")
-    data_dir = os.getenv("DATA_DIRECTORY")
-    
-    # CORRECT: Path is built using the unique project_id
-    project_dir = os.path.join(data_dir, str(project_id))
-    sample_dir = os.path.join(data_dir, "sample_odm_outputs")
-
+def run_photogrammetry(self, project_id: int, full: bool = False) -> dict:
+    from . import preprocess, photogrammetry, incremental
+    print(f"[{project_id}] Starting photogrammetry ({photogrammetry.PHOTOGRAMMETRY_BACKEND} backend)...")
+    stage_progress = events.StageProgress(project_id, "photogrammetry", "PROCESSING: PHOTOGRAMMETRY")
+    project_dir = os.path.join(os.getenv("DATA_DIRECTORY"), str(project_id))
     dsm_path = os.path.join(project_dir, "dsm.tif")
-    shutil.copy(os.path.join(sample_dir, "odm_dem.tif"), dsm_path)
-    
-    db = get_db()
-    update_project_status(db, project_id, "PROCESSING: GENERATING CHM")
-    db.close()
+    state = incremental.load_state(project_dir)
+    backend_params = photogrammetry.parameters()
 
-    return {"project_id": project_id, "dsm_path": dsm_path}
+    with metrics.stage(project_id, "run_photogrammetry", project_dir, backend=photogrammetry.PHOTOGRAMMETRY_BACKEND) as stage_metrics:
+        # Culling and downscaling come first: they cut the expensive reconstruction's workload
+        prepared = preprocess.preprocess_images(
+            os.path.join(project_dir, "raw_images"), project_dir, progress=stage_progress.span(0, 10)
+        )
+        report = prepared["report"]
+        stage_metrics.update(report)
+        print(f"[{project_id}] Preprocessed {report['images']} images at {report['images_per_s']} images/s: "
+              f"{report['images_kept']} kept, {report['images_culled']} redundant.")
 
-@celery_app.task
-def generate_chm(previous_task_result: dict) -> dict:
+        plan = incremental.plan_reconstruction(state, prepared["records"], dsm_path, backend_params, full)
+        stage_metrics["mode"] = plan["mode"]
+        print(f"[{project_id}] Photogrammetry mode: {plan['mode']} ({plan['reason']}).")
+
+        # The DSM is stored as a COG so later windowed reads and previews touch only what they need
+        if plan["mode"] == "full":
+            photogrammetry.reconstruct(prepared["images"], dsm_path, progress=stage_progress.span(10, 100))
+            changed_window = None
+        elif plan["mode"] == "patch":
+            patch_path = os.path.join(project_dir, "dsm_patch.tif")
+            try:
+                photogrammetry.reconstruct(plan["images"], patch_path, progress=stage_progress.span(10, 95))
+                with metrics.step("merge_patch", images=len(plan["images"])) as step:
+                    step.update(incremental.merge_patch(dsm_path, patch_path, plan["window"]))
+            finally:
+                if os.path.exists(patch_path):
+                    os.remove(patch_path)
+            stage_metrics["images_reconstructed"] = len(plan["images"])
+            # Regions of earlier runs whose later stages never finished are redone as well
+            changed_window = incremental.union_windows(state.get("pending_window"), plan["window"])
+        else:
+            changed_window = state.get("pending_window")
+
+    incremental.update_state(project_dir, images=incremental.image_state(prepared["records"]),
+                             photogrammetry=backend_params, pending_window=changed_window)
+    timings = finish_stage(stage_progress, {})
+    update_project_status(project_id, "PROCESSING: GENERATING CHM")
+
+    return {"project_id": project_id, "dsm_path": dsm_path, "changed_window": changed_window, "images": report, "timings": timings}
+
+@celery_app.task(bind=True, max_retries=None)
+def generate_chm(self, previous_task_result: dict) -> dict:
     project_id = previous_task_result["project_id"]
     dsm_path = previous_task_result["dsm_path"]
     
     # CORRECT: We get the project directory from the path passed by the previous task
     project_dir = os.path.dirname(dsm_path)
+    import rasterio
+    from rasterio.windows import Window
+    from . import raster, dtm, incremental
     print(f"[{project_id}] Generating CHM from DSM at {dsm_path}...")
-    
+    stage_progress = events.StageProgress(project_id, "chm", "PROCESSING: GENERATING CHM")
+    chm_path = os.path.join(project_dir, "chm.tif")
     dtm_path = os.path.join(project_dir, "dtm.tif")
-    low_res_path = os.path.join(project_dir, "dsm_low_res.tif")
+    state = incremental.load_state(project_dir)
+    
+    # The DSM content digest roots the cache keys of every downstream stage
+    dsm_key = cache.file_digest(dsm_path) if cache.STAGE_CACHE_ENABLED else dsm_path
+    chm_key = cache.stage_key("generate_chm", dsm_key, {**dtm.parameters(), "format": "COG"})
+    with metrics.stage(project_id, "generate_chm", project_dir) as stage_metrics:
+        with rasterio.open(dsm_path) as src:
+            stage_metrics.update(metrics.raster_dims(src.width, src.height))
+            # A DSM change moves the ground surface a little beyond the changed pixels
+            changed_window = previous_task_result.get("changed_window")
+            if changed_window:
+                changed_window = incremental.grow_window(changed_window, dtm.influence_pixels(src.transform), src.width, src.height)
+        patchable = (
+            changed_window is not None and incremental.matches(state, "generate_chm", dtm.parameters())
+            and os.path.exists(chm_path) and os.path.exists(dtm_path)
+        )
 
-    with rasterio.open(dsm_path) as src:
-        profile = src.profile
+        cached = cache.fetch(chm_key, project_dir)
+        stage_metrics["cached"] = bool(cached)
 
-    gdal.Warp(low_res_path, dsm_path, xRes=5, yRes=5, resampleAlg='near')
-    gdal.Warp(dtm_path, low_res_path, width=profile['width'], height=profile['height'], resampleAlg='cubic')
+        if cached:
+            print(f"[{project_id}] Reusing cached CHM ({chm_key[:12]}).")
+            chm_path = cached["files"]["chm.tif"]
+        else:
+            with scheduling.admission(self, "generate_chm", stage_metrics["width"], stage_metrics["height"]):
+                # The ground surface stays in memory; CHM and DTM are written in one windowed pass
+                ground = dtm.ground_model(dsm_path)
 
-    chm_path = os.path.join(project_dir, "chm.tif")
-    ds_dsm = gdal.Open(dsm_path)
-    ds_dtm = gdal.Open(dtm_path)
-    chm_array = ds_dsm.ReadAsArray() - ds_dtm.ReadAsArray()
-    
-    driver = gdal.GetDriverByName('GTiff')
-    ds_chm = driver.Create(chm_path, ds_dsm.RasterXSize, ds_dsm.RasterYSize, 1, gdal.GDT_Float32)
-    ds_chm.SetGeoTransform(ds_dsm.GetGeoTransform())
-    ds_chm.SetProjection(ds_dsm.GetProjection())
-    ds_chm.GetRasterBand(1).WriteArray(chm_array)
-    ds_chm.FlushCache()
-    ds_dsm = ds_dtm = ds_chm = None
-
-    db = get_db()
-    update_project_status(db, project_id, "PROCESSING: SEGMENTING TREES")
-    db.close()
+                if patchable:
+                    stage_metrics["windows_recomputed"] = raster.update_chm_windowed(
+                        dsm_path, ground, chm_path, dtm_path, Window(*changed_window), progress=stage_progress
+                    )
+                else:
+                    cache.detach(chm_path, dtm_path)
+                    raster.write_chm_windowed(dsm_path, ground, chm_path, dtm_path=dtm_path, progress=stage_progress)
+                cache.store(chm_key, {"chm.tif": chm_path, "dtm.tif": dtm_path})
+            stage_metrics["incremental"] = patchable
+
+    incremental.update_state(project_dir, generate_chm=dtm.parameters())
+    timings = finish_stage(stage_progress, previous_task_result)
+    update_project_status(project_id, "PROCESSING: SEGMENTING TREES")
     
-    return {"project_id": project_id, "chm_path": chm_path}
+    return {"project_id": project_id, "chm_path": chm_path, "cache_key": chm_key,
+            "changed_window": changed_window if patchable or cached else None, "timings": timings}
 
-@celery_app.task
-def segment_trees(previous_task_result: dict) -> dict:
+@celery_app.task(bind=True, max_retries=None)
+def segment_trees(self, previous_task_result: dict) -> dict:
     project_id = previous_task_result["project_id"]
     chm_path = previous_task_result["chm_path"]
     project_dir = os.path.dirname(chm_path)
+    import rasterio
+    from . import segmentation, artifacts, incremental, raster
     print(f"[{project_id}] Starting tree segmentation...")
+    stage_progress = events.StageProgress(project_id, "segmentation", "PROCESSING: SEGMENTING TREES")
+    state = incremental.load_state(project_dir)
+    changed_window = previous_task_result.get("changed_window")
+    changed_tiles = None
     
-    with rasterio.open(chm_path) as src:
-        chm = src.read(1)
-        transform = src.transform
-        crs = src.crs
-    
-    chm[chm < 1] = 0
+    segment_key = cache.stage_key("segment_trees", previous_task_result["cache_key"], segmentation.parameters())
+    with metrics.stage(project_id, "segment_trees", project_dir) as stage_metrics:
+        cached = cache.fetch(segment_key, project_dir)
+        stage_metrics["cached"] = bool(cached)
 
-    scale_factor = 0.5 
-    chm_small = rescale(chm, scale_factor, anti_aliasing=True, preserve_range=True)
-    new_transform = transform * transform.scale(scale_factor)
-    
-    chm_smooth = ndi.gaussian_filter(chm_small, sigma=2)
-    local_max_coords = peak_local_max(chm_smooth, min_distance=3, labels=chm_small > 0, exclude_border=False)
-    
-    markers = np.zeros_like(chm_small, dtype=np.int32)
-    markers[tuple(local_max_coords.T)] = np.arange(len(local_max_coords)) + 1
-    
-    labels = watershed(-chm_smooth, markers, mask=chm_small > 0)
-    
-    polygons = []
-    for label_id in np.unique(labels):
-        if label_id == 0: continue
-        mask_array = labels == label_id
-        shapes_gen = features.shapes(mask_array.astype(np.int16), mask=mask_array, transform=new_transform)
-        for geom, val in shapes_gen:
-            if shape(geom).area > 2:
-                polygons.append({'geometry': shape(geom), 'label_id': label_id})
-
-    crowns_path = os.path.join(project_dir, "tree_crowns.gpkg")
-    if polygons:
-        gdf = gpd.GeoDataFrame(polygons, crs=crs)
-        gdf.to_file(crowns_path, driver="GPKG")
-    
-    db = get_db()
-    update_project_status(db, project_id, "PROCESSING: CALCULATING CARBON", data={"crowns_path": crowns_path})
-    db.close()
+        if cached:
+            print(f"[{project_id}] Reusing cached crowns ({segment_key[:12]}).")
+            crowns_table_path = cached["files"][artifacts.CROWNS_TABLE]
+        else:
+            with rasterio.open(chm_path) as src:
+                stage_metrics.update(metrics.raster_dims(src.width, src.height))
+            crowns_table_path = os.path.join(project_dir, artifacts.CROWNS_TABLE)
+            patchable = (
+                changed_window is not None and incremental.matches(state, "segment_trees", segmentation.parameters())
+                and incremental.can_update_crowns(crowns_table_path, chm_path)
+            )
+            with scheduling.admission(self, "segment_trees", src.width, src.height) as reserved_bytes:
+                stage_metrics["reserved_bytes"] = reserved_bytes
+                if patchable:
+                    # Only the tiles reading changed CHM pixels are segmented again
+                    crowns, changed_tiles = incremental.update_crowns(chm_path, crowns_table_path, changed_window, progress=stage_progress)
+                    stage_metrics["tiles_recomputed"] = len(changed_tiles)
+                else:
+                    crowns = segmentation.segment_chm(chm_path, progress=stage_progress)
+                    crowns['crown_area_sqm'] = crowns.geometry.area
+            stage_metrics["crowns"] = len(crowns)
+            stage_metrics["incremental"] = patchable
+
+            # Hand crowns to the next stage as a columnar table; the GPKG is only a final export
+            cache.detach(crowns_table_path)
+            crowns_table_path = artifacts.write_crown_table(crowns, project_dir)
+            cache.store(segment_key, {artifacts.CROWNS_TABLE: crowns_table_path})
 
-    return {"project_id": project_id, "chm_path": chm_path, "crowns_path": crowns_path}
+    incremental.update_state(project_dir, segment_trees=segmentation.parameters())
+    # Segmentation was the last reader of the memory-mapped CHM; calculate_carbon runs on
+    # light workers and only maps the CHM again for crown tables without heights
+    raster.release_band(chm_path)
+    timings = finish_stage(stage_progress, previous_task_result)
+    update_project_status(project_id, "PROCESSING: CALCULATING CARBON")
+
+    return {"project_id": project_id, "chm_path": chm_path, "crowns_table_path": crowns_table_path, "cache_key": segment_key,
+            "changed_tiles": changed_tiles, "timings": timings}
 
 @celery_app.task
 def calculate_carbon(previous_task_result: dict) -> dict:
     project_id = previous_task_result["project_id"]
     chm_path = previous_task_result["chm_path"]
-    crowns_path = previous_task_result["crowns_path"]
+    crowns_table_path = previous_task_result["crowns_table_path"]
     project_dir = os.path.dirname(chm_path)
+    from . import inventory, artifacts, carbon, incremental
     print(f"[{project_id}] Starting carbon calculation...")
+    stage_progress = events.StageProgress(project_id, "carbon", "PROCESSING: CALCULATING CARBON")
+    state = incremental.load_state(project_dir)
+    changed_tiles = previous_task_result.get("changed_tiles")
 
-    try:
-        crowns_gdf = gpd.read_file(crowns_path)
-        chm_src = rasterio.open(chm_path)
-    except Exception as e:
-        raise ValueError(f"Could not load files for calculation: {e}")
-
-    tree_data = []
-    for index, row in crowns_gdf.iterrows():
-        try:
-            out_image, out_transform = mask.mask(chm_src, [row.geometry], crop=True, filled=False)
-            height = np.nanmax(out_image) if out_image.size > 0 and np.any(np.isfinite(out_image)) else 0
-            crown_area = row.geometry.area
-            tree_data.append({'tree_id': row['label_id'], 'height_m': height, 'crown_area_sqm': crown_area})
-        except Exception as e:
-            print(f"Error extracting metrics for tree {row['label_id']}: {e}")
-            continue
-    
-    chm_src.close()
-    
-    if not tree_data:
-        raise ValueError("No trees found after initial metric extraction.")
+    carbon_key = cache.stage_key("calculate_carbon", previous_task_result["cache_key"],
+                                 {**carbon.carbon_parameters(), "inventory_format": inventory.INVENTORY_FORMAT,
+                                  "csv_export": inventory.INVENTORY_CSV_EXPORT})
+    with metrics.stage(project_id, "calculate_carbon", project_dir) as stage_metrics:
+        cached = cache.fetch(carbon_key, project_dir)
+        stage_metrics["cached"] = bool(cached)
+        if cached:
+            print(f"[{project_id}] Reusing cached carbon inventory ({carbon_key[:12]}).")
+            carbon_results_path = cached["files"][inventory.CARBON_INVENTORY]
+            total_co2_tonnes = cached["values"]["total_co2_tonnes"]
+        else:
+            updated = None
+            if (changed_tiles is not None and incremental.matches(state, "calculate_carbon", carbon.carbon_parameters())
+                    and os.path.exists(os.path.join(project_dir, inventory.CARBON_INVENTORY))):
+                # Rows of trees outside the re-segmented tiles are carried over as they are
+                updated = inventory.update_inventory(crowns_table_path, project_dir, changed_tiles)
+            if updated is not None:
+                carbon_results_path, total_co2_tonnes, stage_metrics["trees_updated"] = updated
+            else:
+                carbon_results_path, total_co2_tonnes = inventory.compute_inventory(chm_path, crowns_table_path, project_dir)
+            cache.store(carbon_key, inventory.output_files(project_dir), {"total_co2_tonnes": total_co2_tonnes})
 
-    df = pd.DataFrame(tree_data)
-    
-    print("\n--- Tree Dimension Statistics (Before Filtering) ---")
-    print(df[['height_m', 'crown_area_sqm']].describe())
-    print("----------------------------------------------------\n")
-    
-    df_filtered = df.query(
-        f"{MIN_REALISTIC_CROWN_AREA_SQM} <= crown_area_sqm <= {MAX_REALISTIC_CROWN_AREA_SQM} and "
-        f"{MIN_REALISTIC_TREE_HEIGHT_M} <= height_m <= {MAX_REALISTIC_TREE_HEIGHT_M}"
-    ).copy()
-    
-    if df_filtered.empty:
-        raise ValueError("No valid trees found after filtering. Adjust filter parameters if this is unexpected.")
+        # The GPKG export depends only on the crowns, so coefficient changes reuse it
+        export_key = cache.stage_key("export_crowns", previous_task_result["cache_key"], {})
+        cached = cache.fetch(export_key, project_dir)
+        if cached:
+            crowns_path = cached["files"][artifacts.CROWNS_EXPORT]
+        else:
+            cache.detach(os.path.join(project_dir, artifacts.CROWNS_EXPORT))
+            with metrics.step("export_gpkg"):
+                crowns_path = artifacts.export_crowns_gpkg(crowns_table_path, project_dir)
+            cache.store(export_key, {artifacts.CROWNS_EXPORT: crowns_path})
 
-    df_filtered['estimated_dbh_cm'] = (DBH_FROM_HEIGHT_SLOPE * df_filtered['height_m']) + DBH_FROM_HEIGHT_INTERCEPT
-    df_filtered['agb_kg'] = ALLOM_COEFF_A * (WOOD_DENSITY_RHO * (df_filtered['estimated_dbh_cm'] ** ALLOM_COEFF_B))
-    df_filtered['total_biomass_kg'] = df_filtered['agb_kg'] * (1 + BGB_TO_AGB_RATIO)
-    df_filtered['carbon_kg'] = df_filtered['total_biomass_kg'] * CARBON_FRACTION
-    df_filtered['co2_sequestered_kg'] = df_filtered['carbon_kg'] * CO2_CONVERSION_FACTOR
-
-    carbon_results_path = os.path.join(project_dir, "carbon_inventory.csv")
-    df_filtered.to_csv(carbon_results_path, index=False)
-    
-    total_co2_tonnes = float(df_filtered['co2_sequestered_kg'].sum() / 1000)
-    
-    db = get_db()
-    update_project_status(db, project_id, "COMPLETED", data={"carbon_results_path": carbon_results_path, "total_co2_tonnes": total_co2_tonnes})
-    db.close()
+    # Every stage is now up to date with the images
+    incremental.update_state(project_dir, calculate_carbon=carbon.carbon_parameters(), pending_window=None)
+    timings = finish_stage(stage_progress, previous_task_result)
+    update_project_status(project_id, "COMPLETED", data={"chm_path": chm_path, "crowns_path": crowns_path, "carbon_results_path": carbon_results_path, "total_co2_tonnes": total_co2_tonnes}, final=True)
+    events.publish(project_id, "completed", "COMPLETED", 100.0, total_co2_tonnes=total_co2_tonnes, timings=timings)
 
     print(f"[{project_id}] Calculation complete. Total CO2: {total_co2_tonnes:.2f} tonnes.")
     return {"project_id": project_id, "total_co2_tonnes": total_co2_tonnes}
\ No newline at end of file
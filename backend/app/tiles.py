@@ -0,0 +1,350 @@
+# app/tiles.py
+import os
+import io
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+from . import artifacts
+
+# Optional imports - handle gracefully if not available
+try:
+    import rasterio
+    from rasterio.vrt import WarpedVRT
+    from rasterio.enums import Resampling
+    from rasterio.transform import from_bounds
+    from rasterio.warp import transform_bounds
+    HAS_RASTERIO = True
+except ImportError:
+    HAS_RASTERIO = False
+    print("Warning: Rasterio not installed. Raster map tiles will be unavailable.")
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+    print("Warning: Pillow not installed. PNG map tiles will be unavailable.")
+
+try:
+    import geopandas as gpd
+    from shapely.geometry import box
+    import mapbox_vector_tile
+    HAS_MVT = True
+except ImportError:
+    HAS_MVT = False
+    print("Warning: mapbox-vector-tile not installed. Crown vector tiles will be unavailable.")
+
+# --- Map Tile Settings ---
+# XYZ tiles in Web Mercator, rendered on demand from the project rasters (their
+# internal overviews serve the low zooms) and kept in a two-level LRU cache.
+TILE_SIZE_PX = 256
+WEB_MERCATOR = "EPSG:3857"
+WEB_MERCATOR_HALF_WIDTH_M = 20037508.342789244
+MAX_ZOOM = 24
+RASTER_LAYERS = {"chm": "chm.tif", "dsm": "dsm.tif", "dtm": "dtm.tif"}
+VECTOR_LAYERS = ("crowns",)
+CHM_COLOR_RANGE_M = (0.0, 40.0)
+CHM_MIN_VISIBLE_M = 0.5
+# Below this zoom a crown tile would hold too many polygons to be useful
+CROWN_TILE_MIN_ZOOM = int(os.getenv("CROWN_TILE_MIN_ZOOM", 16))
+MVT_EXTENT = 4096
+CROWN_PROPERTIES = ("label_id", "crown_area_sqm", "height_max_m")
+
+TILE_MEMORY_CACHE_ENTRIES = int(os.getenv("TILE_MEMORY_CACHE_ENTRIES", 4096))
+TILE_CACHE_DIRECTORY = os.getenv(
+    "TILE_CACHE_DIRECTORY", os.path.join(os.getenv("DATA_DIRECTORY", "."), "tile_cache")
+)
+TILE_CACHE_MAX_BYTES = int(os.getenv("TILE_CACHE_MAX_BYTES", 5 * 1024 ** 3))
+# Disk eviction walks the cache directory, so it only runs every this many writes
+TILE_EVICT_EVERY_WRITES = 500
+
+# Viridis-like ramp used for all raster layers
+COLOR_STOPS = np.array([
+    [68, 1, 84], [59, 82, 139], [33, 145, 140], [94, 201, 98], [253, 231, 37],
+], dtype=np.float64)
+COLOR_TABLE = np.stack([
+    np.interp(np.linspace(0, 1, 256), np.linspace(0, 1, len(COLOR_STOPS)), COLOR_STOPS[:, channel])
+    for channel in range(3)
+], axis=1).astype(np.uint8)
+
+
+def project_dir(project_id: int) -> str:
+    return os.path.join(os.getenv("DATA_DIRECTORY"), str(project_id))
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple:
+    """(left, bottom, right, top) of an XYZ tile in Web Mercator metres."""
+    if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError(f"Invalid tile {z}/{x}/{y}")
+    size = 2 * WEB_MERCATOR_HALF_WIDTH_M / 2 ** z
+    left = -WEB_MERCATOR_HALF_WIDTH_M + x * size
+    top = WEB_MERCATOR_HALF_WIDTH_M - y * size
+    return left, top - size, left + size, top
+
+
+def source_version(path: str) -> str:
+    """Changes whenever the file is rewritten (outputs are replaced, never edited in place)."""
+    stat = os.stat(path)
+    return f"{stat.st_ino:x}-{stat.st_mtime_ns:x}"
+
+
+# --- Two-Level Tile Cache ---
+
+class TileCache:
+    """
+    LRU of encoded tiles: the most recent TILE_MEMORY_CACHE_ENTRIES in memory, and
+    every rendered tile on disk until TILE_CACHE_MAX_BYTES is exceeded. Disk entries
+    are refreshed on read so eviction drops the least recently served tiles first.
+    """
+
+    def __init__(self, directory: str = TILE_CACHE_DIRECTORY, max_entries: int = TILE_MEMORY_CACHE_ENTRIES,
+                 max_bytes: int = TILE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _path(self, key: tuple) -> str:
+        project_id, layer, version, z, x, y, ext = key
+        return os.path.join(self.directory, str(project_id), layer, version, str(z), str(x), f"{y}.{ext}")
+
+    def get(self, key: tuple):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        self._remember(key, data)
+        return data
+
+    def put(self, key: tuple, data: bytes):
+        self._remember(key, data)
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: could not write tile to disk cache: {e}")
+            return
+
+        with self._lock:
+            self._writes += 1
+            due = self._writes % TILE_EVICT_EVERY_WRITES == 0
+        if due:
+            self.evict()
+
+    def _remember(self, key: tuple, data: bytes):
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def evict(self):
+        """Deletes the least recently served disk tiles until the cache fits max_bytes."""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+tile_cache = TileCache()
+
+
+# --- Raster (PNG) Tiles ---
+
+_thread_local = threading.local()
+
+
+def _open_source(path: str, version: str, level=None):
+    # Dataset handles are not thread-safe; each threadpool worker keeps its own
+    handles = getattr(_thread_local, "handles", None)
+    if handles is None:
+        handles = _thread_local.handles = OrderedDict()
+    key = (path, version, level)
+    src = handles.get(key)
+    if src is None:
+        src = handles[key] = rasterio.open(path) if level is None else rasterio.open(path, overview_level=level)
+        while len(handles) > 16:
+            handles.popitem(last=False)[1].close()
+    else:
+        handles.move_to_end(key)
+    return src
+
+
+def overview_level(src, bounds: tuple):
+    """
+    Index of the coarsest overview still at least as fine as the tile, or None for full
+    resolution. The warper does not pick overviews by itself, and warping a low-zoom
+    tile from full-resolution pixels costs hundreds of milliseconds.
+    """
+    left, _, right, _ = transform_bounds(WEB_MERCATOR, src.crs, *bounds)
+    tile_resolution = (right - left) / TILE_SIZE_PX
+    level = None
+    for index, factor in enumerate(src.overviews(1)):
+        if abs(src.transform.a) * factor <= tile_resolution:
+            level = index
+    return level
+
+
+@lru_cache(maxsize=64)
+def color_range(path: str, version: str, layer: str) -> tuple:
+    """Value range mapped onto the colour ramp; DSM/DTM use the 2-98% range of the coarsest overview."""
+    if layer == "chm":
+        return CHM_COLOR_RANGE_M
+    with rasterio.open(path) as src:
+        factor = (src.overviews(1) or [1])[-1]
+        values = src.read(
+            1, out_shape=(max(1, src.height // factor), max(1, src.width // factor)), masked=True
+        ).compressed()
+    if values.size == 0:
+        return 0.0, 1.0
+    low, high = np.percentile(values, [2, 98])
+    return float(low), float(max(high, low + 1e-3))
+
+
+def colorize(values: np.ndarray, valid: np.ndarray, value_range: tuple) -> np.ndarray:
+    low, high = value_range
+    index = np.clip((values - low) / (high - low) * 255, 0, 255).astype(np.uint8)
+    rgba = np.empty(values.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = COLOR_TABLE[index]
+    rgba[..., 3] = np.where(valid, 255, 0)
+    return rgba
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def render_raster_tile(path: str, version: str, layer: str, z: int, x: int, y: int) -> bytes:
+    """
+    Warps one tile out of the raster into Web Mercator, reading from the internal
+    overview that matches the zoom so low zooms never touch full-resolution data.
+    """
+    bounds = tile_bounds(z, x, y)
+    src = _open_source(path, version)
+    level = overview_level(src, bounds)
+    if level is not None:
+        src = _open_source(path, version, level)
+    transform = from_bounds(*bounds, TILE_SIZE_PX, TILE_SIZE_PX)
+    with WarpedVRT(src, crs=WEB_MERCATOR, transform=transform, width=TILE_SIZE_PX, height=TILE_SIZE_PX,
+                   resampling=Resampling.bilinear) as vrt:
+        data = vrt.read(1, masked=True)
+
+    value_range = color_range(path, version, layer)
+    values = data.filled(value_range[0]).astype(np.float32)
+    valid = ~np.ma.getmaskarray(data)
+    if layer == "chm":
+        valid &= values >= CHM_MIN_VISIBLE_M
+    return encode_png(colorize(values, valid, value_range))
+
+
+# --- Vector (MVT) Tiles ---
+
+@lru_cache(maxsize=8)
+def _crowns_web_mercator(path: str, version: str):
+    crowns = gpd.read_parquet(path) if path.endswith(".parquet") else gpd.read_file(path)
+    columns = [column for column in CROWN_PROPERTIES if column in crowns.columns]
+    crowns = crowns[columns + ["geometry"]].to_crs(WEB_MERCATOR)
+    crowns.sindex  # build the spatial index once, not on the first tile request
+    return crowns
+
+
+def render_crown_tile(path: str, version: str, z: int, x: int, y: int) -> bytes:
+    """Encodes the crowns intersecting a tile (clipped to it) as a Mapbox Vector Tile."""
+    bounds = tile_bounds(z, x, y)
+    features = []
+    if z >= CROWN_TILE_MIN_ZOOM:
+        crowns = _crowns_web_mercator(path, version)
+        hits = crowns.iloc[crowns.sindex.query(box(*bounds), predicate="intersects")]
+        # Outlines are simplified to one screen pixel; the one-pixel buffer keeps
+        # clipped edges from drawing seams between neighbouring tiles
+        pixel = (bounds[2] - bounds[0]) / TILE_SIZE_PX
+        clipped = hits.geometry.simplify(pixel).clip_by_rect(
+            bounds[0] - pixel, bounds[1] - pixel, bounds[2] + pixel, bounds[3] + pixel
+        )
+        properties = hits.drop(columns="geometry").to_dict("records")
+        for geometry, props in zip(clipped, properties):
+            if geometry is None or geometry.is_empty:
+                continue
+            features.append({
+                "geometry": geometry,
+                "properties": {name: (int(value) if name == "label_id" else float(value)) for name, value in props.items()},
+            })
+    return mapbox_vector_tile.encode(
+        [{"name": "crowns", "features": features}],
+        default_options={"quantize_bounds": bounds, "extents": MVT_EXTENT},
+    )
+
+
+# --- Entry Point ---
+
+def layer_source(project_id: int, layer: str):
+    """Path of the file a layer is rendered from, or None if the project has none yet."""
+    directory = project_dir(project_id)
+    if layer in RASTER_LAYERS:
+        candidates = [RASTER_LAYERS[layer]]
+    elif layer in VECTOR_LAYERS:
+        candidates = [artifacts.CROWNS_TABLE, artifacts.CROWNS_EXPORT]
+    else:
+        raise ValueError(f"Unknown layer {layer!r}")
+    for name in candidates:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def get_tile(project_id: int, layer: str, z: int, x: int, y: int, ext: str):
+    """
+    Returns the encoded tile (PNG for raster layers, MVT for crowns), serving it from
+    the tile cache when possible. Returns None if the project has no such layer yet;
+    raises ValueError for unknown layers, formats or tile coordinates.
+    """
+    if (ext == "png") != (layer in RASTER_LAYERS) or ext not in ("png", "mvt"):
+        raise ValueError(f"Layer {layer!r} is not available as .{ext}")
+    tile_bounds(z, x, y)
+
+    path = layer_source(project_id, layer)
+    if path is None:
+        return None
+    key = (project_id, layer, source_version(path), z, x, y, ext)
+    data = tile_cache.get(key)
+    if data is None:
+        if ext == "png":
+            data = render_raster_tile(path, key[2], layer, z, x, y)
+        else:
+            data = render_crown_tile(path, key[2], z, x, y)
+        tile_cache.put(key, data)
+    return data
@@ -0,0 +1,176 @@
+# app/uploads.py
+import os
+import re
+import uuid
+import fcntl
+import hashlib
+from contextlib import contextmanager
+from starlette.concurrency import run_in_threadpool
+
+# --- Upload Settings ---
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+# sha256sum-compatible manifest ("<digest>  <filename>" per line) of every image a
+# project holds; appends are atomic, so concurrent uploads never rewrite it.
+MANIFEST_NAME = ".sha256"
+PARTIAL_SUFFIX = ".part"
+CONTENT_RANGE_PATTERN = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+
+
+def safe_filename(filename: str) -> str:
+    """Strips any directory components from a client-supplied name and rejects hidden/empty names."""
+    name = os.path.basename((filename or "").replace("\\", "/"))
+    if not name or name.startswith("."):
+        raise ValueError(f"Invalid file name: {filename!r}")
+    return name
+
+
+def parse_content_range(value: str):
+    """Parses 'bytes start-end/total' into (start, end, total); total is None for '*'."""
+    match = CONTENT_RANGE_PATTERN.match(value.strip())
+    if not match:
+        raise ValueError(f"Malformed Content-Range: {value!r}")
+    start, end, total = match.groups()
+    start, end = int(start), int(end)
+    total = None if total == "*" else int(total)
+    if end < start or (total is not None and end >= total):
+        raise ValueError(f"Invalid Content-Range: {value!r}")
+    return start, end, total
+
+
+def load_manifest(images_dir: str) -> dict:
+    """Maps content digest -> stored file name for every image the project holds."""
+    manifest = {}
+    manifest_path = os.path.join(images_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            for line in f:
+                digest, _, filename = line.rstrip("\n").partition("  ")
+                if digest and filename:
+                    manifest[digest] = filename
+    return manifest
+
+
+def _record(images_dir: str, digest: str, filename: str):
+    with open(os.path.join(images_dir, MANIFEST_NAME), "a") as f:
+        f.write(f"{digest}  {filename}\n")
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def finalize(images_dir: str, part_path: str, filename: str, digest: str):
+    """
+    Moves a fully received file into place unless the project already holds the same
+    content. A different file arriving under an existing name gets a digest suffix
+    instead of overwriting it. Returns (stored_name, duplicate).
+    """
+    manifest = load_manifest(images_dir)
+    if digest in manifest:
+        os.remove(part_path)
+        return manifest[digest], True
+
+    stored_name = filename
+    if os.path.exists(os.path.join(images_dir, stored_name)):
+        stem, ext = os.path.splitext(filename)
+        stored_name = f"{stem}_{digest[:8]}{ext}"
+
+    os.replace(part_path, os.path.join(images_dir, stored_name))
+    _record(images_dir, digest, stored_name)
+    return stored_name, False
+
+
+def _write_chunk(out, digest, chunk: bytes):
+    digest.update(chunk)
+    out.write(chunk)
+
+
+async def save_upload(upload, images_dir: str):
+    """
+    Copies a multipart UploadFile to disk in UPLOAD_CHUNK_BYTES chunks, hashing while
+    writing, off the event loop. Returns (stored_name, digest, duplicate). Starlette has
+    already spooled the body to a temporary file by the time this runs; only the
+    resumable PUT endpoint (append_stream) writes straight from the network.
+    """
+    filename = safe_filename(upload.filename)
+    part_path = os.path.join(images_dir, f".{filename}.{uuid.uuid4().hex}{PARTIAL_SUFFIX}")
+    digest = hashlib.sha256()
+
+    try:
+        with open(part_path, "wb") as out:
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                await run_in_threadpool(_write_chunk, out, digest, chunk)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+    hexdigest = digest.hexdigest()
+    stored_name, duplicate = await run_in_threadpool(finalize, images_dir, part_path, filename, hexdigest)
+    return stored_name, hexdigest, duplicate
+
+
+# --- Resumable Uploads ---
+
+def partial_path(images_dir: str, filename: str) -> str:
+    return os.path.join(images_dir, f".{filename}{PARTIAL_SUFFIX}")
+
+
+def discard_partial(images_dir: str, filename: str):
+    """Removes the partial file of a resumable upload, if any."""
+    path = partial_path(images_dir, filename)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def partial_offset(images_dir: str, filename: str) -> int:
+    """Number of bytes of a resumable upload already on disk."""
+    path = partial_path(images_dir, filename)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+@contextmanager
+def locked_partial(images_dir: str, filename: str):
+    """
+    Opens the partial file of a resumable upload for appending under an exclusive lock,
+    so two requests for the same file cannot interleave their bytes. Raises
+    BlockingIOError when another request holds the lock.
+    """
+    with open(partial_path(images_dir, filename), "ab") as out:
+        fcntl.flock(out, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        try:
+            yield out
+        finally:
+            fcntl.flock(out, fcntl.LOCK_UN)
+
+
+def truncate_partial(out, size: int):
+    """Drops the bytes of a rejected chunk, leaving the partial file at size."""
+    out.flush()
+    os.ftruncate(out.fileno(), size)
+
+
+async def append_stream(stream, out, limit: int = None) -> int:
+    """
+    Appends a request body stream to an open partial file, coalescing the small network
+    chunks into UPLOAD_CHUNK_BYTES writes. Returns the number of bytes received; reading
+    stops as soon as that exceeds limit, so an oversized body is never written in full.
+    """
+    received = 0
+    buffer = bytearray()
+    async for chunk in stream:
+        received += len(chunk)
+        buffer += chunk
+        if limit is not None and received > limit:
+            break
+        if len(buffer) >= UPLOAD_CHUNK_BYTES:
+            await run_in_threadpool(out.write, bytes(buffer))
+            buffer.clear()
+    if buffer:
+        await run_in_threadpool(out.write, bytes(buffer))
+    await run_in_threadpool(out.flush)
+    return received
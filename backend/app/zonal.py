@@ -0,0 +1,132 @@
+# app/zonal.py
+import numpy as np
+from . import metrics, raster
+
+# Optional imports - handle gracefully if not available
+try:
+    import rasterio
+    from rasterio import features
+    HAS_RASTERIO = True
+except ImportError:
+    HAS_RASTERIO = False
+    print("Warning: Rasterio not installed. Raster processing will be limited.")
+
+try:
+    from scipy import ndimage as ndi
+    HAS_SCIPY = True
+except ImportError:
+    HAS_SCIPY = False
+    print("Warning: SciPy not installed. Zonal statistics will be unavailable.")
+
+try:
+    import pandas as pd
+    HAS_PANDAS = True
+except ImportError:
+    HAS_PANDAS = False
+    print("Warning: Pandas not installed.")
+
+# --- Zonal Statistics Settings ---
+HEIGHT_PERCENTILE = 95
+HEIGHT_COLUMNS = ["height_max_m", "height_mean_m", f"height_p{HEIGHT_PERCENTILE}_m"]
+
+
+def label_stats(values: np.ndarray, labels: np.ndarray, index, percentile: float = HEIGHT_PERCENTILE,
+                min_value: float = None) -> dict:
+    """
+    Computes max, mean and a percentile of `values` for every label in `index` in one
+    vectorized pass. Labels without any pixels get NaN; values below min_value count as
+    0. Neither array is written, so both may be read-only memory maps.
+    """
+    with metrics.step("zonal_stats", **metrics.raster_dims(labels.shape[1], labels.shape[0]), crowns=len(index)):
+        return _label_stats(values, labels, index, percentile, min_value)
+
+
+def _orderable_bits(values: np.ndarray) -> np.ndarray:
+    """float32 values as uint32 whose unsigned order matches the float order."""
+    bits = values.astype(np.float32, copy=False).view(np.uint32)
+    negative = bits >= np.uint32(0x80000000)
+    return np.where(negative, ~bits, bits | np.uint32(0x80000000))
+
+
+def _from_orderable_bits(bits: np.ndarray) -> np.ndarray:
+    bits = bits.astype(np.uint32)
+    positive = bits >= np.uint32(0x80000000)
+    return np.where(positive, bits & np.uint32(0x7FFFFFFF), ~bits).view(np.float32).astype(np.float64)
+
+
+def _label_stats(values: np.ndarray, labels: np.ndarray, index, percentile: float, min_value: float = None) -> dict:
+    index = np.asarray(index, dtype=np.int64)
+    if index.size == 0:
+        empty = np.empty(0, dtype=np.float64)
+        return dict(zip(HEIGHT_COLUMNS, (empty, empty, empty)))
+
+    # Only labelled pixels are touched; no full-size temporaries beyond this mask
+    in_crown = labels > 0
+    flat_labels = labels[in_crown].astype(np.int64)
+    flat_values = values[in_crown]
+    del in_crown
+    if min_value is not None:
+        flat_values[flat_values < min_value] = 0
+
+    top = max(int(index.max()), int(flat_labels.max()) if flat_labels.size else 0) + 1
+    sums = np.bincount(flat_labels, weights=flat_values, minlength=top)[index]
+
+    # Sort every labelled pixel by (label, value) once as a single uint64 key: label in
+    # the high word, order-preserving value bits in the low word. Each label's pixels
+    # then form one sorted run; max and percentile (linear interpolation, same as
+    # np.percentile) are picked by rank inside the run.
+    keys = (flat_labels.astype(np.uint64) << np.uint64(32)) | _orderable_bits(flat_values)
+    del flat_labels, flat_values
+    keys.sort()
+
+    starts = np.searchsorted(keys, index.astype(np.uint64) << np.uint64(32), side="left")
+    stops = np.searchsorted(keys, (index + 1).astype(np.uint64) << np.uint64(32), side="left")
+    counts = stops - starts
+    empty = counts == 0
+
+    maxima = np.full(index.size, np.nan)
+    percentiles = np.full(index.size, np.nan)
+    if keys.size:
+        last = keys.size - 1
+        maxima = _from_orderable_bits(keys[np.clip(stops - 1, 0, last)])
+        span = np.maximum(counts - 1, 0)
+        position = starts + span * (percentile / 100.0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, starts + span)
+        lower_values = _from_orderable_bits(keys[np.minimum(lower, last)])
+        upper_values = _from_orderable_bits(keys[np.minimum(upper, last)])
+        percentiles = lower_values + (upper_values - lower_values) * (position - lower)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    maxima[empty] = np.nan
+    means[empty] = np.nan
+    percentiles[empty] = np.nan
+
+    return dict(zip(HEIGHT_COLUMNS, (maxima, means, percentiles)))
+
+
+def crown_zonal_stats(chm_path: str, crowns) -> "pd.DataFrame":
+    """
+    Bulk per-crown height extraction: rasterizes every crown's label_id onto the CHM
+    grid once and reduces the CHM over those labels. CHM nodata pixels are ignored.
+    The CHM and the label image are memory-mapped when raster.RASTER_MMAP_ENABLED.
+    """
+    chm = raster.read_band(chm_path)
+    with rasterio.open(chm_path) as src:
+        transform, nodata = src.transform, src.nodata
+
+    label_ids = np.unique(crowns["label_id"].to_numpy())
+    with raster.scratch_band(chm_path, "zonal_labels", chm.shape, np.int32) as labels:
+        labels = features.rasterize(
+            zip(crowns.geometry, crowns["label_id"].astype("int32")),
+            out_shape=chm.shape,
+            transform=transform,
+            fill=0,
+            out=labels,
+            dtype="int32",
+        )
+        if nodata is not None:
+            labels[np.isnan(chm) if np.isnan(nodata) else chm == nodata] = 0
+        stats = label_stats(chm, labels, label_ids)
+    return pd.DataFrame({"label_id": label_ids, **stats})
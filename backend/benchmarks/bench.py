@@ -0,0 +1,273 @@
+# benchmarks/bench.py
+"""
+Pipeline benchmark harness. Generates synthetic scenes with a known tree count, runs
+the stage functions directly (no Celery, Redis or database) and appends wall time,
+peak memory and throughput to a JSON history that later runs are compared against.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench run --scales 1k 2k 4k
+    python -m benchmarks.bench compare            # last run against the one before
+    python -m benchmarks.bench compare --baseline 20261001T120000 --threshold 0.15
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import numpy as np
+import rasterio
+from app import raster, dtm, segmentation, artifacts, inventory, metrics
+from benchmarks import synthetic
+
+# --- Benchmark Settings ---
+STAGES = ("chm", "segment", "carbon")
+DEFAULT_SCALES = ("1k", "2k", "4k")
+DEFAULT_HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.json")
+DEFAULT_WORKDIR = os.path.join(os.getenv("DATA_DIRECTORY", tempfile.gettempdir()), "benchmarks")
+# A stage regresses when it gets slower (or hungrier) by more than the threshold AND by
+# more than these absolute margins, so sub-second noise on small scales is ignored.
+REGRESSION_THRESHOLD = 0.10
+MIN_REGRESSION_SECONDS = 0.25
+MIN_REGRESSION_RSS_BYTES = 64 * 1024 ** 2
+
+
+# --- Stage Runners ---
+
+def run_chm(scene: dict, out_dir: str) -> dict:
+    ground = dtm.ground_model(scene["dsm_path"])
+    chm_path = raster.write_chm_windowed(scene["dsm_path"], ground, os.path.join(out_dir, "chm.tif"))
+    return {"chm_path": chm_path}
+
+
+def chm_error(chm_path: str, truth_path: str) -> float:
+    """Mean absolute error (metres) of a derived CHM against the true canopy heights."""
+    total, count = 0.0, 0
+    with rasterio.open(chm_path) as chm, rasterio.open(truth_path) as truth:
+        for window in raster.iter_windows(chm.width, chm.height):
+            derived = chm.read(1, window=window)
+            valid = derived != raster.CHM_NODATA
+            error = np.abs(derived[valid] - truth.read(1, window=window)[valid])
+            total += float(error.sum(dtype=np.float64))
+            count += int(valid.sum())
+    return total / max(count, 1)
+
+
+def run_segment(chm_path: str, out_dir: str) -> dict:
+    crowns = segmentation.segment_chm(chm_path)
+    crowns['crown_area_sqm'] = crowns.geometry.area
+    return {"crowns_table_path": artifacts.write_crown_table(crowns, out_dir), "trees": len(crowns)}
+
+
+def run_carbon(chm_path: str, crowns_table_path: str, out_dir: str) -> dict:
+    _, total_co2_tonnes = inventory.compute_inventory(chm_path, crowns_table_path, out_dir)
+    return {"total_co2_tonnes": total_co2_tonnes}
+
+
+def timed(function, *args) -> tuple:
+    """Runs a stage function under the metrics recorder; returns (function result, measurement)."""
+    with metrics.recording() as measurement:
+        result = function(*args)
+    return result, measurement
+
+
+def throughput(measurement: dict, pixels: int, trees: int = None) -> dict:
+    seconds = max(measurement["seconds"], 1e-9)
+    figures = {
+        "seconds": round(measurement["seconds"], 4),
+        "peak_rss_bytes": measurement["peak_rss_bytes"],
+        "read_bytes": measurement["read_bytes"],
+        "write_bytes": measurement["write_bytes"],
+        "pixels_per_s": round(pixels / seconds, 1),
+        "steps": {name: round(step["seconds"], 4) for name, step in measurement["steps"].items()},
+    }
+    if trees is not None:
+        figures["trees_per_s"] = round(trees / seconds, 1)
+    return figures
+
+
+def benchmark_scale(scale: str, stages, workdir: str, seed: int) -> dict:
+    started = time.perf_counter()
+    scene = synthetic.generate(workdir, scale, seed)
+    print(f"[{scale}] scene {scene['size']}x{scene['size']} px with {scene['trees']} trees "
+          f"({time.perf_counter() - started:.1f}s to generate or load)")
+
+    out_dir = tempfile.mkdtemp(prefix=f"bench-{scale}-", dir=workdir)
+    pixels = scene["size"] ** 2
+    result = {"size": scene["size"], "pixels": pixels, "trees_true": scene["trees"], "stages": {}}
+    try:
+        chm_path = scene["chm_truth_path"]
+        if "chm" in stages:
+            outputs, measurement = timed(run_chm, scene, out_dir)
+            chm_path = outputs["chm_path"]
+            result["stages"]["chm"] = throughput(measurement, pixels)
+            result["chm_mae_m"] = round(chm_error(chm_path, scene["chm_truth_path"]), 4)
+
+        crowns_table_path = None
+        if "segment" in stages or "carbon" in stages:
+            outputs, measurement = timed(run_segment, chm_path, out_dir)
+            crowns_table_path = outputs["crowns_table_path"]
+            result["trees_detected"] = outputs["trees"]
+            result["detection_ratio"] = round(outputs["trees"] / max(scene["trees"], 1), 4)
+            if "segment" in stages:
+                result["stages"]["segment"] = throughput(measurement, pixels, outputs["trees"])
+
+        if "carbon" in stages:
+            outputs, measurement = timed(run_carbon, chm_path, crowns_table_path, out_dir)
+            result["total_co2_tonnes"] = outputs["total_co2_tonnes"]
+            result["stages"]["carbon"] = throughput(measurement, pixels, result["trees_detected"])
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    for stage, figures in result["stages"].items():
+        print(f"[{scale}] {stage:8s} {figures['seconds']:9.3f}s  "
+              f"{figures['peak_rss_bytes'] / 1024 ** 2:8.1f} MiB peak  "
+              f"{figures['pixels_per_s'] / 1e6:8.2f} Mpx/s"
+              + (f"  {figures['trees_per_s']:10.1f} trees/s" if "trees_per_s" in figures else ""))
+    return result
+
+
+# --- History ---
+
+def load_history(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)["runs"]
+
+
+def save_history(path: str, runs: list):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"runs": runs}, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_run(runs: list, run_id: str, default_index: int) -> dict:
+    if run_id is None:
+        return runs[default_index]
+    for run in runs:
+        if run["run_id"] == run_id:
+            return run
+    raise SystemExit(f"No run {run_id!r} in the history.")
+
+
+def compare_runs(baseline: dict, candidate: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    """Returns one row per (scale, stage) measured in both runs, flagging regressions."""
+    rows = []
+    for scale, candidate_scale in candidate["scales"].items():
+        baseline_scale = baseline["scales"].get(scale)
+        if baseline_scale is None:
+            continue
+        for stage, new in candidate_scale["stages"].items():
+            old = baseline_scale["stages"].get(stage)
+            if old is None:
+                continue
+            time_ratio = new["seconds"] / max(old["seconds"], 1e-9)
+            rss_ratio = new["peak_rss_bytes"] / max(old["peak_rss_bytes"], 1)
+            slower = time_ratio > 1 + threshold and new["seconds"] - old["seconds"] > MIN_REGRESSION_SECONDS
+            hungrier = (rss_ratio > 1 + threshold and
+                        new["peak_rss_bytes"] - old["peak_rss_bytes"] > MIN_REGRESSION_RSS_BYTES)
+            rows.append({
+                "scale": scale,
+                "stage": stage,
+                "baseline_seconds": old["seconds"],
+                "candidate_seconds": new["seconds"],
+                "time_ratio": round(time_ratio, 3),
+                "rss_ratio": round(rss_ratio, 3),
+                "regression": slower or hungrier,
+            })
+    return rows
+
+
+# --- Command Line ---
+
+def command_run(args) -> int:
+    os.makedirs(args.workdir, exist_ok=True)
+    if args.dtm_algorithm:
+        dtm.DTM_ALGORITHM = args.dtm_algorithm
+    run = {
+        "run_id": time.strftime("%Y%m%dT%H%M%S"),
+        "label": args.label,
+        "git_revision": git_revision(),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "dtm_algorithm": dtm.DTM_ALGORITHM,
+            "segmentation_mode": segmentation.SEGMENTATION_MODE,
+            "segmentation_resolution": segmentation.SEGMENTATION_RESOLUTION,
+            "segmentation_workers": segmentation.SEGMENTATION_WORKERS,
+        },
+        "seed": args.seed,
+        "scales": {},
+    }
+    for scale in args.scales:
+        run["scales"][scale] = benchmark_scale(scale, args.stages, args.workdir, args.seed)
+
+    runs = load_history(args.history)
+    runs.append(run)
+    save_history(args.history, runs)
+    print(f"Recorded run {run['run_id']} in {args.history}")
+    return 0
+
+
+def command_compare(args) -> int:
+    runs = load_history(args.history)
+    if len(runs) < 2 and not (args.baseline and args.candidate):
+        raise SystemExit("Need at least two runs in the history to compare.")
+    baseline = find_run(runs, args.baseline, -2)
+    candidate = find_run(runs, args.candidate, -1)
+
+    rows = compare_runs(baseline, candidate, args.threshold)
+    print(f"Baseline {baseline['run_id']} ({baseline.get('git_revision')}) -> "
+          f"candidate {candidate['run_id']} ({candidate.get('git_revision')})")
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else ""
+        print(f"  {row['scale']:>4s} {row['stage']:8s} {row['baseline_seconds']:9.3f}s -> "
+              f"{row['candidate_seconds']:9.3f}s  time x{row['time_ratio']:.2f}  memory x{row['rss_ratio']:.2f}  {flag}")
+
+    regressions = [row for row in rows if row["regression"]]
+    print(f"{len(regressions)} regression(s) over a {args.threshold:.0%} threshold.")
+    return 1 if regressions else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the processing stages on synthetic scenes.")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON history file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="benchmark the stages and append the results to the history")
+    run_parser.add_argument("--scales", nargs="+", default=list(DEFAULT_SCALES), choices=list(synthetic.SCALES))
+    run_parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES))
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help="where synthetic scenes are kept")
+    run_parser.add_argument("--dtm-algorithm", choices=list(dtm.DTM_ALGORITHMS), help="ground surface algorithm")
+    run_parser.add_argument("--label", help="free-form note stored with the run")
+    run_parser.set_defaults(handler=command_run)
+
+    compare_parser = commands.add_parser("compare", help="compare two runs and flag regressions")
+    compare_parser.add_argument("--baseline", help="run id (default: second to last run)")
+    compare_parser.add_argument("--candidate", help="run id (default: last run)")
+    compare_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    compare_parser.set_defaults(handler=command_compare)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
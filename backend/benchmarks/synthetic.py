@@ -0,0 +1,131 @@
+# benchmarks/synthetic.py
+"""
+Synthetic DSM/CHM generator with a known number of trees. Rasters are written block by
+block, so even the 40k x 40k scale never needs more than a few blocks in memory.
+"""
+import os
+import json
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from app import raster
+
+# --- Synthetic Scene Parameters ---
+GSD_M = 0.1
+TREE_SPACING_M = 6.0
+TREE_JITTER_M = 1.0
+CROWN_RADIUS_RANGE_M = (1.5, 2.8)
+TREE_HEIGHT_RANGE_M = (4.0, 25.0)
+# Crowns are ellipsoid caps sitting on a crown base at this fraction of the tree
+# height, so the whole crown disk clears segmentation.MIN_CANOPY_HEIGHT_M.
+CROWN_BASE_FRACTION = 0.6
+ORIGIN = (500000.0, 3000000.0)
+CRS = "EPSG:32643"
+
+# Edge length in pixels of each named benchmark scale
+SCALES = {
+    "1k": 1024,
+    "2k": 2048,
+    "4k": 4096,
+    "10k": 10240,
+    "20k": 20480,
+    "40k": 40960,
+}
+
+
+def plant_trees(size: int, seed: int = 0):
+    """
+    Places trees on a jittered grid that keeps every crown inside the raster. Returns
+    (rows, cols, radii) in pixels and heights in metres.
+    """
+    rng = np.random.default_rng(seed)
+    spacing = TREE_SPACING_M / GSD_M
+    margin = (CROWN_RADIUS_RANGE_M[1] + TREE_JITTER_M) / GSD_M + 1
+    centres = np.arange(margin, size - margin, spacing)
+    rows, cols = np.meshgrid(centres, centres, indexing="ij")
+
+    count = rows.size
+    jitter = TREE_JITTER_M / GSD_M
+    rows = rows.ravel() + rng.uniform(-jitter, jitter, count)
+    cols = cols.ravel() + rng.uniform(-jitter, jitter, count)
+    radii = rng.uniform(*CROWN_RADIUS_RANGE_M, count) / GSD_M
+    heights = rng.uniform(*TREE_HEIGHT_RANGE_M, count)
+    return rows, cols, radii, heights
+
+
+def terrain_block(window) -> np.ndarray:
+    """Smooth, gently sloping ground surface (metres) for a window."""
+    y = (np.arange(window.row_off, window.row_off + window.height, dtype=np.float32)[:, None] + 0.5) * GSD_M
+    x = (np.arange(window.col_off, window.col_off + window.width, dtype=np.float32)[None, :] + 0.5) * GSD_M
+    return (100.0 + 0.02 * x + 3.0 * np.sin(x / 80.0) * np.cos(y / 60.0)).astype(np.float32)
+
+
+def canopy_block(window, trees) -> np.ndarray:
+    """Canopy heights above ground (metres) for a window; 0 outside crowns."""
+    rows, cols, radii, heights = trees
+    top, left = window.row_off, window.col_off
+    bottom, right = top + window.height, left + window.width
+    block = np.zeros((window.height, window.width), dtype=np.float32)
+
+    reach = radii.max()
+    nearby = np.flatnonzero(
+        (rows + reach >= top) & (rows - reach < bottom) & (cols + reach >= left) & (cols - reach < right)
+    )
+    for i in nearby:
+        r0, r1 = max(int(rows[i] - radii[i]), top), min(int(rows[i] + radii[i]) + 1, bottom)
+        c0, c1 = max(int(cols[i] - radii[i]), left), min(int(cols[i] + radii[i]) + 1, right)
+        if r0 >= r1 or c0 >= c1:
+            continue
+        dy = (np.arange(r0, r1) + 0.5 - rows[i])[:, None] / radii[i]
+        dx = (np.arange(c0, c1) + 0.5 - cols[i])[None, :] / radii[i]
+        d2 = dy * dy + dx * dx
+        crown = heights[i] * (CROWN_BASE_FRACTION + (1 - CROWN_BASE_FRACTION) * np.sqrt(np.clip(1 - d2, 0, 1)))
+        crown[d2 > 1] = 0
+        patch = block[r0 - top:r1 - top, c0 - left:c1 - left]
+        np.maximum(patch, crown, out=patch)
+    return block
+
+
+def generate(workdir: str, scale: str, seed: int = 0) -> dict:
+    """
+    Writes dsm.tif (terrain + canopy) and chm_truth.tif (canopy only) for a named scale
+    into workdir/<scale>-<seed>/, reusing an earlier generation with the same inputs.
+    Returns the scene description, including the true tree count.
+    """
+    size = SCALES[scale]
+    scene_dir = os.path.join(workdir, f"{scale}-{seed}")
+    truth_path = os.path.join(scene_dir, "truth.json")
+    if os.path.exists(truth_path):
+        with open(truth_path) as f:
+            return json.load(f)
+
+    os.makedirs(scene_dir, exist_ok=True)
+    trees = plant_trees(size, seed)
+    base_profile = {
+        "width": size,
+        "height": size,
+        "crs": CRS,
+        "transform": from_origin(ORIGIN[0], ORIGIN[1], GSD_M, GSD_M),
+    }
+    dsm_path = os.path.join(scene_dir, "dsm.tif")
+    chm_path = os.path.join(scene_dir, "chm_truth.tif")
+
+    profile = raster.tiled_profile(base_profile, dtype="float32")
+    with rasterio.open(dsm_path, "w", **profile) as dsm, rasterio.open(chm_path, "w", **profile) as chm:
+        for window in raster.iter_windows(size, size):
+            canopy = canopy_block(window, trees)
+            chm.write(canopy, 1, window=window)
+            dsm.write(terrain_block(window) + canopy, 1, window=window)
+
+    scene = {
+        "scale": scale,
+        "seed": seed,
+        "size": size,
+        "gsd_m": GSD_M,
+        "trees": int(trees[0].size),
+        "dsm_path": dsm_path,
+        "chm_truth_path": chm_path,
+    }
+    with open(truth_path, "w") as f:
+        json.dump(scene, f, indent=2)
+    return scene
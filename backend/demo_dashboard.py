@@ -1,29 +1,42 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
+import requests
 
 # --- Page Configuration ---
 st.set_page_config(layout="wide")
 st.title("Live CO₂ Sequestration Calculation Dashboard")
 st.markdown("This dashboard demonstrates how the raw measurements from drone imagery are converted into a final carbon sequestration value.")
 
-# --- File Uploader ---
-st.header("Step 1: Upload the Backend Output File")
-st.write("After the backend finishes processing, it generates a `carbon_inventory.csv`. Please upload that file here to see the calculation breakdown.")
-uploaded_file = st.file_uploader("Upload carbon_inventory.csv", type=['csv'])
+# --- Project Selection ---
+# Everything shown here comes from the backend's inventory query endpoints, which read
+# only the columns and rows each view needs; the inventory file is never downloaded.
+st.header("Step 1: Choose a Processed Project")
+st.write("After the backend finishes processing a project, its carbon inventory can be queried by project ID.")
+base_url = st.text_input("Backend URL", value="http://localhost:8000").rstrip("/")
+project_id = st.number_input("Project ID", min_value=1, step=1, value=None)
+CALCULATION_COLUMNS = "height_m,crown_area_sqm,agb_kg,total_biomass_kg,carbon_kg"
 
-if uploaded_file is not None:
+
+@st.cache_data(ttl=60)
+def query_inventory(base_url: str, project_id: int, view: str, **params):
+    response = requests.get(f"{base_url}/projects/{project_id}/inventory/{view}", params=params, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+
+if project_id is not None:
     # Load the data
     try:
-        df = pd.read_csv(uploaded_file)
-        st.success("File successfully loaded!")
+        summary = query_inventory(base_url, int(project_id), "summary")
+        df = pd.DataFrame(query_inventory(base_url, int(project_id), "top", n=15, columns=CALCULATION_COLUMNS)["trees"])
+        st.success("Inventory successfully loaded!")
     except Exception as e:
-        st.error(f"Error reading file: {e}")
+        st.error(f"Error querying the inventory: {e}")
         st.stop()
 
     # --- Display Raw Data ---
     st.header("Step 2: Review Raw Data from Drone Analysis")
-    st.write(f"The backend successfully identified **{len(df)}** trees. Here are the direct measurements for a sample of them:")
+    st.write(f"The backend successfully identified **{summary['trees']}** trees. Here are the direct measurements for the largest of them:")
     st.dataframe(df[['tree_id', 'height_m', 'crown_area_sqm']].head())
 
     # --- Explain the Calculation Steps ---
@@ -73,7 +86,7 @@ if uploaded_file is not None:
 
     # --- Final Results ---
     st.header("Step 4: Final Aggregated Results")
-    total_co2_tonnes = df['co2_sequestered_kg'].sum() / 1000
+    total_co2_tonnes = summary['total_co2_tonnes']
 
     st.metric(
         label="Total CO₂ Sequestered for this Plot",
@@ -85,11 +98,19 @@ if uploaded_file is not None:
     st.header("Visualization: CO₂ Contribution per Tree")
     st.write("This chart shows the CO₂ sequestered by the top 15 largest trees in the plot.")
 
-    # Prepare data for charting
-    chart_data = df.sort_values('co2_sequestered_kg', ascending=False).head(15)
-    chart_data = chart_data.set_index('tree_id')
+    # The endpoint already returns the largest trees first
+    chart_data = df.set_index('tree_id')
 
     st.bar_chart(chart_data['co2_sequestered_kg'])
 
+    st.header("Visualization: Tree Height Distribution")
+    histogram = query_inventory(base_url, int(project_id), "histogram", column="height_m", bins=20)
+    edges = histogram['edges']
+    st.bar_chart(pd.Series(histogram['counts'], index=[f"{low:.1f}-{high:.1f} m" for low, high in zip(edges, edges[1:])]))
+
+    st.write("CO₂ stored per height band:")
+    bands = pd.DataFrame(query_inventory(base_url, int(project_id), "bands")['bands'])
+    st.dataframe(bands)
+
 else:
-    st.info("Waiting for you to upload a `carbon_inventory.csv` file.")
\ No newline at end of file
+    st.info("Waiting for you to enter the ID of a processed project.")
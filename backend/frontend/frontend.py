@@ -3,6 +3,7 @@ import streamlit as st
 import requests
 import os
 import time
+import json
 
 # --- Configuration ---
 BACKEND_URL = "https://unproscribed-shaniqua-twirly.ngrok-free.dev/" # PASTE YOUR NGROK URL HERE
@@ -63,17 +64,73 @@ else:
 st.header("Step 3: Monitor Project Status")
 project_id_to_check = st.number_input("Enter Project ID to check:", min_value=1, step=1, value=st.session_state.get('project_id', 1))
 
-if st.button("Refresh Status"):
+def show_project(data):
+    st.write(f"**Project Name:** `{data['name']}`")
+    st.write(f"**Status:** `{data['status']}`")
+    if data['status'] == 'COMPLETED':
+        st.metric(label="Total CO₂ Sequestered (Tonnes)", value=f"{data['total_co2_tonnes']:.8f}")
+        st.balloons()
+
+col_refresh, col_watch = st.columns(2)
+
+if col_refresh.button("Refresh Status"):
     try:
         response = requests.get(f"{BACKEND_URL}/projects/{project_id_to_check}")
         if response.status_code == 200:
-            data = response.json()
-            st.write(f"**Project Name:** `{data['name']}`")
-            st.write(f"**Status:** `{data['status']}`")
-            if data['status'] == 'COMPLETED':
-                st.metric(label="Total CO₂ Sequestered (Tonnes)", value=f"{data['total_co2_tonnes']:.8f}")
-                st.balloons()
+            show_project(response.json())
         else:
             st.error("Project not found.")
     except requests.exceptions.ConnectionError:
         st.error("Connection Error: Could not connect to the backend.")
+
+if col_watch.button("Watch Live Progress"):
+    # The backend pushes progress events as they happen, so there is nothing to poll
+    progress_bar = st.progress(0)
+    stage_text = st.empty()
+    try:
+        with requests.get(f"{BACKEND_URL}/projects/{project_id_to_check}/events", stream=True, timeout=(5, 60)) as response:
+            if response.status_code != 200:
+                st.error("Project not found.")
+            else:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    event = json.loads(line[len("data:"):])
+                    progress_bar.progress(min(int(event['percent']), 100))
+                    stage_text.write(f"**{event['stage']}** — `{event['status']}` ({event.get('stage_elapsed_s', 0):.1f}s in stage)")
+                    if event['stage'] in ("completed", "failed"):
+                        break
+                final = requests.get(f"{BACKEND_URL}/projects/{project_id_to_check}")
+                if final.status_code == 200:
+                    show_project(final.json())
+    except requests.exceptions.ConnectionError:
+        st.error("Connection Error: Could not connect to the backend.")
+
+# --- 4. All Projects ---
+st.header("All Projects")
+status_filter = st.selectbox("Status", ["", "COMPLETED", "PROCESSING", "FAILED", "PENDING_UPLOAD", "ACCEPTED"])
+name_filter = st.text_input("Name starts with:")
+
+if st.button("Load Projects"):
+    st.session_state['project_pages'] = []
+    st.session_state['project_cursor'] = None
+    st.session_state['project_filters'] = {"status": status_filter or None, "name_prefix": name_filter or None}
+
+if 'project_filters' in st.session_state:
+    try:
+        summary = requests.get(f"{BACKEND_URL}/projects/summary", params={"name_prefix": st.session_state['project_filters']["name_prefix"]}).json()
+        columns = st.columns(len(summary['by_phase']) + 1)
+        columns[0].metric("Total CO₂ (Tonnes)", f"{summary['total_co2_tonnes']:.2f}")
+        for column, (phase, totals) in zip(columns[1:], summary['by_phase'].items()):
+            column.metric(phase.title(), totals['project_count'])
+
+        # Keyset pagination: every "Load More" continues after the last project shown
+        pages = st.session_state['project_pages']
+        if not pages or (st.button("Load More") and st.session_state['project_cursor']):
+            params = {**st.session_state['project_filters'], "after": st.session_state['project_cursor'], "limit": 50}
+            page = requests.get(f"{BACKEND_URL}/projects/", params=params).json()
+            pages.extend(page['items'])
+            st.session_state['project_cursor'] = page['next_cursor']
+        st.dataframe(pages, use_container_width=True)
+    except requests.exceptions.ConnectionError:
+        st.error("Connection Error: Could not connect to the backend.")
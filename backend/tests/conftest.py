@@ -0,0 +1,38 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+# The app reads its settings from the environment at import time; point everything at a
+# throwaway directory before any app module is imported.
+_TEST_DATA = tempfile.mkdtemp(prefix="ccts-tests-")
+os.environ.setdefault("DATA_DIRECTORY", _TEST_DATA)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_TEST_DATA, 'test.db')}")
+os.environ.setdefault("STAGE_CACHE_DIRECTORY", os.path.join(_TEST_DATA, "stage_cache"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import database, models
+from app.main import app
+
+
+@pytest.fixture
+def db():
+    """A session on the test database, with the projects of earlier tests removed."""
+    models.Base.metadata.create_all(bind=database.engine)
+    session = database.SessionLocal()
+    session.query(models.Project).delete()
+    session.commit()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client(db):
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,53 @@
+# tests/test_batches.py
+import pytest
+
+from app import batches
+
+
+def test_summarize_mixed_member_states():
+    summary = batches.summarize([
+        ("PENDING_UPLOAD", None),
+        ("ACCEPTED", None),
+        ("PROCESSING: SEGMENTING TREES", None),
+        ("COMPLETED", 12.5),
+        ("COMPLETED", 7.25),
+        ("FAILED: DSM has no valid pixels", None),
+    ])
+
+    assert summary["status"] == "PROCESSING"
+    assert summary["project_count"] == 6
+    assert summary["phase_counts"] == {"pending": 1, "queued": 1, "processing": 1, "completed": 2, "failed": 1}
+    assert summary["percent_finished"] == 50.0
+    assert summary["total_co2_tonnes"] == pytest.approx(19.75)
+
+
+def test_summarize_only_counts_carbon_of_completed_projects():
+    # A project that failed on re-processing keeps its old figure on the row
+    summary = batches.summarize([("COMPLETED", 3.0), ("FAILED: worker lost", 40.0), ("COMPLETED", None)])
+
+    assert summary["status"] == "COMPLETED_WITH_ERRORS"
+    assert summary["percent_finished"] == 100.0
+    assert summary["total_co2_tonnes"] == pytest.approx(3.0)
+
+
+@pytest.mark.parametrize("statuses, expected", [
+    (["COMPLETED", "COMPLETED"], "COMPLETED"),
+    (["FAILED: a", "FAILED: b"], "FAILED"),
+    (["PENDING_UPLOAD", "PENDING_UPLOAD"], "PENDING_UPLOAD"),
+    (["PENDING_UPLOAD", "COMPLETED"], "PROCESSING"),
+    (["ACCEPTED", "PENDING_UPLOAD"], "PROCESSING"),
+])
+def test_summarize_batch_status(statuses, expected):
+    assert batches.summarize((status, None) for status in statuses)["status"] == expected
+
+
+def test_summarize_empty_batch():
+    summary = batches.summarize([])
+
+    assert summary == {
+        "status": "PENDING_UPLOAD",
+        "project_count": 0,
+        "phase_counts": {phase: 0 for phase in batches.PHASES},
+        "percent_finished": 0.0,
+        "total_co2_tonnes": 0,
+    }
@@ -0,0 +1,95 @@
+# tests/test_cache.py
+import os
+import pytest
+
+from app import cache
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "STAGE_CACHE_DIRECTORY", str(tmp_path / "cache"))
+    monkeypatch.setattr(cache, "STAGE_CACHE_ENABLED", True)
+    return tmp_path / "cache"
+
+
+def write(path, content: bytes) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    return str(path)
+
+
+def test_miss_returns_none(tmp_path):
+    assert cache.fetch(cache.stage_key("segment_trees", "upstream", {}), str(tmp_path / "project")) is None
+
+
+def test_hit_restores_files_as_hard_links_and_values(tmp_path):
+    source = write(tmp_path / "a" / "chm.tif", b"chm")
+    key = cache.stage_key("generate_chm", "dsm-digest", {"cell": 2})
+    cache.store(key, {"chm.tif": source}, {"total": 1.5})
+
+    project_dir = tmp_path / "b"
+    project_dir.mkdir()
+    hit = cache.fetch(key, str(project_dir))
+    assert hit["values"] == {"total": 1.5}
+    restored = hit["files"]["chm.tif"]
+    assert restored == str(project_dir / "chm.tif")
+    assert open(restored, "rb").read() == b"chm"
+    assert os.path.samefile(restored, source)
+
+
+def test_key_depends_on_upstream_and_parameters():
+    key = cache.stage_key("generate_chm", "a", {"cell": 2})
+    assert key != cache.stage_key("generate_chm", "b", {"cell": 2})
+    assert key != cache.stage_key("generate_chm", "a", {"cell": 3})
+    assert key == cache.stage_key("generate_chm", "a", {"cell": 2})
+
+
+def test_cross_device_falls_back_to_copy(tmp_path, monkeypatch):
+    source = write(tmp_path / "a" / "crowns.parquet", b"crowns")
+
+    def no_link(src, dst):
+        raise OSError(18, "Invalid cross-device link")
+
+    monkeypatch.setattr(cache.os, "link", no_link)
+    key = cache.stage_key("segment_trees", "x", {})
+    cache.store(key, {"crowns.parquet": source})
+    hit = cache.fetch(key, str(tmp_path / "a"))
+    assert hit is not None
+
+    restored = hit["files"]["crowns.parquet"]
+    assert open(restored, "rb").read() == b"crowns"
+    cached = os.path.join(cache._entry_dir(key), "crowns.parquet")
+    assert not os.path.samefile(restored, cached)
+    assert not [name for name in os.listdir(tmp_path / "a") if name.endswith(".tmp")]
+
+
+def test_detach_protects_cached_entry(tmp_path):
+    path = write(tmp_path / "p" / "chm.tif", b"old")
+    key = cache.stage_key("generate_chm", "x", {})
+    cache.store(key, {"chm.tif": path})
+    cache.detach(path)
+    write(path, b"new")
+    assert open(os.path.join(cache._entry_dir(key), "chm.tif"), "rb").read() == b"old"
+
+
+def test_eviction_drops_least_recently_used_first(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "STAGE_CACHE_MAX_BYTES", 10 ** 9)
+    keys = []
+    for i, name in enumerate(("oldest", "middle", "newest")):
+        key = cache.stage_key("stage", name, {})
+        cache.store(key, {"out.bin": write(tmp_path / name / "out.bin", b"x" * 100)})
+        os.utime(os.path.join(cache._entry_dir(key), cache.MANIFEST_NAME), (1000 + i, 1000 + i))
+        keys.append(key)
+
+    # A hit makes the oldest entry the most recently used
+    (tmp_path / "restore").mkdir()
+    assert cache.fetch(keys[0], str(tmp_path / "restore")) is not None
+    cache.evict(max_bytes=sum(cache._entry_size(cache._entry_dir(key)) for key in (keys[0], keys[2])))
+
+    assert os.path.exists(cache._entry_dir(keys[0]))
+    assert not os.path.exists(cache._entry_dir(keys[1]))
+    assert os.path.exists(cache._entry_dir(keys[2]))
+
+    cache.evict(max_bytes=0)
+    assert not any(os.path.exists(cache._entry_dir(key)) for key in keys)
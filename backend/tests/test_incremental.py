@@ -0,0 +1,204 @@
+# tests/test_incremental.py
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.warp import transform as transform_points
+
+from app import incremental
+
+CRS = "EPSG:32633"
+ORIGIN = (500000.0, 5000000.0)
+PIXEL_M = 0.5
+SIZE = 1000  # 500 m square
+BACKEND = {"backend": "odm", "quality": "medium"}
+
+
+def write_dsm(path, values, origin=ORIGIN, nodata=-9999.0):
+    profile = dict(driver="GTiff", width=values.shape[1], height=values.shape[0], count=1, dtype="float32",
+                   crs=CRS, transform=from_origin(*origin, PIXEL_M, PIXEL_M), nodata=nodata)
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(values.astype("float32"), 1)
+    return path
+
+
+def image(name, col, row, signature="v1"):
+    """A preprocess record for an image taken above DSM pixel (col, row)."""
+    (lon,), (lat,) = transform_points(CRS, "EPSG:4326", [ORIGIN[0] + col * PIXEL_M], [ORIGIN[1] - row * PIXEL_M])
+    # 10 m above ground with a 24 mm lens: a 15 m x 11.25 m footprint
+    return {"path": f"/raw/{name}.jpg", "prepared_path": f"/prepared/{name}.jpg", "signature": signature,
+            "lat": lat, "lon": lon, "width": 4000, "height": 3000, "height_m": 10.0, "focal_35mm": 24.0}
+
+
+@pytest.fixture
+def survey(tmp_path):
+    """Ten images spread over a flat DSM, and the state of the run that built it."""
+    dsm_path = write_dsm(str(tmp_path / "dsm.tif"), np.full((SIZE, SIZE), 100.0))
+    records = [image(f"img{i}", 100 + 60 * i, 500) for i in range(10)]
+    state = {"images": incremental.image_state(records), "photogrammetry": BACKEND}
+    return dsm_path, records, state
+
+
+def modified(record, signature="v2"):
+    return {**record, "signature": signature}
+
+
+def test_plan_unchanged(survey):
+    dsm_path, records, state = survey
+    assert incremental.plan_reconstruction(state, records, dsm_path, BACKEND)["mode"] == "unchanged"
+
+
+def test_plan_patches_the_window_of_a_changed_image(survey):
+    dsm_path, records, state = survey
+    records[4] = modified(records[4])  # above pixel (340, 500)
+
+    plan = incremental.plan_reconstruction(state, records, dsm_path, BACKEND)
+
+    assert plan["mode"] == "patch"
+    assert plan["changed"] == 1
+    col_off, row_off, width, height = plan["window"]
+    assert col_off <= 340 < col_off + width and row_off <= 500 < row_off + height
+    # Square of the 15 m long side, 30 px, give or take the UTM/lon-lat round trip
+    assert 28 <= width <= 34 and 28 <= height <= 34
+    # Neighbours 60 px away are within INCREMENTAL_CONTEXT_M (30 m) of the footprint, 120 px is not
+    assert sorted(plan["images"]) == ["/prepared/img3.jpg", "/prepared/img4.jpg", "/prepared/img5.jpg"]
+
+
+def test_plan_patches_a_new_image(survey):
+    dsm_path, records, state = survey
+    records.append(image("new", 900, 100))
+
+    plan = incremental.plan_reconstruction(state, records, dsm_path, BACKEND)
+
+    assert plan["mode"] == "patch"
+    assert plan["images"] == ["/prepared/new.jpg"]
+    col_off, row_off, width, height = plan["window"]
+    assert col_off <= 900 < col_off + width and row_off <= 100 < row_off + height
+
+
+def test_plan_union_of_changed_windows(survey):
+    dsm_path, records, state = survey
+    records[1], records[3] = modified(records[1]), modified(records[3])  # pixels 160 and 280
+
+    plan = incremental.plan_reconstruction(state, records, dsm_path, BACKEND)
+
+    col_off, _, width, _ = plan["window"]
+    assert col_off <= 160 - 15 and 280 + 15 <= col_off + width
+    assert "/prepared/img2.jpg" in plan["images"] and "/prepared/img6.jpg" not in plan["images"]
+
+
+def test_plan_unchanged_when_every_changed_image_was_culled(survey):
+    dsm_path, records, state = survey
+    records[4] = {**modified(records[4]), "prepared_path": None}
+    records.append({**image("redundant", 345, 500), "prepared_path": None})
+
+    plan = incremental.plan_reconstruction(state, records, dsm_path, BACKEND)
+
+    assert plan["mode"] == "unchanged" and "culled" in plan["reason"]
+
+
+def test_plan_patches_only_the_kept_changed_images(survey):
+    dsm_path, records, state = survey
+    records.append({**image("redundant", 345, 500), "prepared_path": None})
+    records.append(image("new", 900, 100))
+
+    plan = incremental.plan_reconstruction(state, records, dsm_path, BACKEND)
+
+    assert plan["mode"] == "patch" and plan["changed"] == 1
+    assert plan["images"] == ["/prepared/new.jpg"]
+    assert plan["window"][0] > 345
+
+
+@pytest.mark.parametrize("change, reason", [
+    (lambda records: records.pop(), "images were removed"),
+    (lambda records: records.append(image("outside", SIZE + 200, 500)), "extend the surveyed area"),
+    (lambda records: records.append({**image("nogps", 500, 500), "lat": None, "lon": None}), "no GPS"),
+    (lambda records: records.__setitem__(slice(0, 4), [modified(r) for r in records[:4]]), "4 of 10 images changed"),
+])
+def test_plan_falls_back_to_full(survey, change, reason):
+    dsm_path, records, state = survey
+    change(records)
+
+    plan = incremental.plan_reconstruction(state, records, dsm_path, BACKEND)
+
+    assert plan["mode"] == "full" and reason in plan["reason"]
+
+
+def test_plan_full_when_settings_or_outputs_differ(survey, tmp_path):
+    dsm_path, records, state = survey
+    records[4] = modified(records[4])
+
+    assert incremental.plan_reconstruction(state, records, dsm_path, BACKEND, full=True)["mode"] == "full"
+    assert incremental.plan_reconstruction(state, records, dsm_path, {**BACKEND, "quality": "high"})["mode"] == "full"
+    assert incremental.plan_reconstruction({}, records, dsm_path, BACKEND)["mode"] == "full"
+    assert incremental.plan_reconstruction(state, records, str(tmp_path / "missing.tif"), BACKEND)["mode"] == "full"
+
+
+def test_plan_full_when_the_footprint_covers_too_much(survey):
+    dsm_path, records, state = survey
+    # From 400 m up the footprint spans 600 m, more than the whole DSM
+    records[4] = {**modified(records[4]), "height_m": 400.0}
+
+    assert "too much of the DSM" in incremental.plan_reconstruction(state, records, dsm_path, BACKEND)["reason"]
+
+
+# --- DSM patches ---
+
+def slope(shape, row_off=0, col_off=0):
+    rows, cols = np.mgrid[row_off:row_off + shape[0], col_off:col_off + shape[1]]
+    return 100.0 + 0.01 * rows + 0.02 * cols
+
+
+@pytest.fixture
+def patched(tmp_path):
+    """A sloping DSM and a patch over pixels 200-400 that sits 2 m higher and adds a 5 m mound."""
+    dsm = slope((600, 600))
+    dsm[:10, :10] = -9999.0
+    dsm_path = write_dsm(str(tmp_path / "dsm.tif"), dsm)
+
+    patch = slope((200, 200), 200, 200) + 2.0
+    patch[90:110, 90:110] += 5.0
+    patch[:5, :5] = incremental.PATCH_NODATA
+    origin = (ORIGIN[0] + 200 * PIXEL_M, ORIGIN[1] - 200 * PIXEL_M)
+    patch_path = write_dsm(str(tmp_path / "patch.tif"), patch, origin, nodata=incremental.PATCH_NODATA)
+    return dsm_path, patch_path, dsm
+
+
+def test_merge_patch_replaces_only_the_window(patched):
+    dsm_path, patch_path, before = patched
+    window = [250, 260, 100, 80]
+
+    result = incremental.merge_patch(dsm_path, patch_path, window)
+
+    with rasterio.open(dsm_path) as src:
+        after = src.read(1)
+        assert src.nodata == -9999.0
+        assert src.profile["tiled"] and src.overviews(1)
+    inside = np.zeros(before.shape, dtype=bool)
+    inside[260:340, 250:350] = True
+
+    assert result["level_offset_m"] == pytest.approx(2.0, abs=1e-3)
+    assert result["replaced_pixels"] == inside.sum()
+    np.testing.assert_array_equal(after[~inside], before[~inside].astype("float32"))
+    # Levelled onto the existing surface: the mound is all that changes
+    expected = before.copy()
+    expected[290:310, 290:310] += 5.0
+    np.testing.assert_allclose(after[inside], expected[inside], atol=1e-3)
+
+
+def test_merge_patch_keeps_pixels_the_patch_did_not_cover(patched):
+    dsm_path, patch_path, before = patched
+    # Overhangs the patch's nodata corner (200-205) and its edge at 400
+    window = [190, 190, 250, 30]
+
+    result = incremental.merge_patch(dsm_path, patch_path, window)
+
+    with rasterio.open(dsm_path) as src:
+        after = src.read(1)
+    covered = np.zeros(before.shape, dtype=bool)
+    covered[200:220, 200:400] = True
+    covered[200:205, 200:205] = False
+
+    assert result["replaced_pixels"] == covered.sum()
+    np.testing.assert_array_equal(after[~covered], before[~covered].astype("float32"))
+    np.testing.assert_allclose(after[covered], before[covered], atol=1e-3)
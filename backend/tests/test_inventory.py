@@ -0,0 +1,218 @@
+# tests/test_inventory.py
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import inventory, models, zonal
+
+
+def crown_table(path, heights, tile_ids=None, label_ids=None):
+    """A crown metrics table as segment_trees stores it, one crown per height."""
+    heights = np.asarray(heights, dtype="float32")
+    label_ids = np.arange(1, len(heights) + 1) if label_ids is None else label_ids
+    df = pd.DataFrame({
+        "label_id": np.asarray(label_ids, dtype="int64"),
+        "crown_area_sqm": np.full(len(heights), 10.0),
+        **{column: heights for column in zonal.HEIGHT_COLUMNS},
+    })
+    if tile_ids is not None:
+        df["tile_id"] = np.asarray(tile_ids, dtype="int32")
+    df.to_parquet(path)
+    return str(path)
+
+
+def test_update_inventory_replaces_the_rows_of_changed_tiles(tmp_path):
+    crowns_path = crown_table(tmp_path / "crowns.parquet", [10.0, 20.0, 30.0], tile_ids=[0, 1, 1])
+    inventory.compute_inventory(None, crowns_path, str(tmp_path))
+    before = pd.read_parquet(tmp_path / inventory.CARBON_INVENTORY).set_index("tree_id")
+
+    # Tile 1 was re-segmented: crown 3 is taller, and crown 2 is gone
+    crown_table(tmp_path / "crowns.parquet", [10.0, 40.0], tile_ids=[0, 1], label_ids=[1, 3])
+
+    _, total_co2_tonnes, trees_updated = inventory.update_inventory(crowns_path, str(tmp_path), [1])
+    after = pd.read_parquet(tmp_path / inventory.CARBON_INVENTORY).set_index("tree_id")
+
+    assert trees_updated == 1
+    assert sorted(after.index) == [1, 3]
+    pd.testing.assert_series_equal(after.loc[1], before.loc[1])
+    assert after.loc[3, "height_m"] == 40.0
+    assert total_co2_tonnes == pytest.approx(after["co2_sequestered_kg"].sum() / 1000)
+
+
+def test_update_inventory_declines_tables_without_tile_ids(tmp_path):
+    crowns_path = crown_table(tmp_path / "crowns.parquet", [10.0, 20.0])
+
+    assert inventory.update_inventory(crowns_path, str(tmp_path), [0]) is None
+
+
+# --- Inventory Queries ---
+
+@pytest.fixture
+def inventory_file(tmp_path, monkeypatch):
+    """An inventory of 1000 trees over ten row groups, heights on a 0.5 m grid so ranks tie."""
+    monkeypatch.setattr(inventory, "INVENTORY_ROW_GROUP_ROWS", 100)
+    rng = np.random.default_rng(7)
+    heights = np.round(rng.uniform(1.0, 45.0, 1000) * 2) / 2
+    heights[:3] = 50.0  # exactly on the top band edge
+    crowns_path = crown_table(tmp_path / "crowns.parquet", heights)
+    crowns = pd.read_parquet(crowns_path)
+    crowns["crown_area_sqm"] = rng.uniform(1.0, 80.0, len(crowns))
+    crowns.to_parquet(crowns_path)
+
+    path, _ = inventory.compute_inventory(None, crowns_path, str(tmp_path))
+    assert inventory.pq.ParquetFile(path).num_row_groups == 10
+    return path, pd.read_parquet(path)
+
+
+def within(df, height=(None, None), co2=(None, None)):
+    mask = np.ones(len(df), dtype=bool)
+    for column, (low, high) in (("height_m", height), ("co2_sequestered_kg", co2)):
+        if low is not None:
+            mask &= df[column] >= low
+        if high is not None:
+            mask &= df[column] <= high
+    return df[mask]
+
+
+RANGES = [
+    {},
+    {"height_m": (10.0, 20.0)},
+    {"co2_sequestered_kg": (30.0, None)},
+    {"height_m": (None, 30.0), "co2_sequestered_kg": (5.0, 60.0)},
+]
+
+
+@pytest.mark.parametrize("ranges", RANGES)
+def test_summary(inventory_file, ranges):
+    path, df = inventory_file
+    expected = within(df, ranges.get("height_m", (None, None)), ranges.get("co2_sequestered_kg", (None, None)))
+
+    summary = inventory.summary(path, ranges)
+
+    assert summary["trees"] == len(expected)
+    assert summary["total_co2_tonnes"] == pytest.approx(expected["co2_sequestered_kg"].sum() / 1000)
+    assert summary["mean_height_m"] == pytest.approx(expected["height_m"].mean())
+    assert summary["max_height_m"] == pytest.approx(expected["height_m"].max())
+    assert summary["mean_crown_area_sqm"] == pytest.approx(expected["crown_area_sqm"].mean())
+
+
+def test_summary_without_matches(inventory_file):
+    path, _ = inventory_file
+    summary = inventory.summary(path, {"height_m": (60.0, None)})
+
+    assert summary["trees"] == 0 and summary["total_co2_tonnes"] == 0.0 and summary["mean_height_m"] is None
+
+
+@pytest.mark.parametrize("by", ["co2_sequestered_kg", "height_m", "crown_area_sqm"])
+@pytest.mark.parametrize("ranges", RANGES)
+def test_top_trees(inventory_file, by, ranges):
+    path, df = inventory_file
+    expected = within(df, ranges.get("height_m", (None, None)), ranges.get("co2_sequestered_kg", (None, None)))
+    expected = expected.sort_values([by, "tree_id"], ascending=[False, True]).head(25)
+
+    trees = inventory.top_trees(path, 25, by, ["height_m"], ranges)
+
+    # Ties on `by` at the cut may keep any of the tied trees, but order is by value then id
+    np.testing.assert_allclose([tree[by] for tree in trees], expected[by], rtol=1e-6)
+    assert [(-tree[by], tree["tree_id"]) for tree in trees] == sorted((-tree[by], tree["tree_id"]) for tree in trees)
+    assert set(trees[0]) == {"tree_id", by, "height_m"}
+
+
+def test_top_trees_rejects_unknown_columns(inventory_file):
+    path, _ = inventory_file
+    with pytest.raises(ValueError, match="Unknown inventory columns"):
+        inventory.top_trees(path, 5, "dbh")
+
+
+@pytest.mark.parametrize("ranges", RANGES)
+def test_histogram_spans_the_filtered_values(inventory_file, ranges):
+    path, df = inventory_file
+    values = within(df, ranges.get("height_m", (None, None)), ranges.get("co2_sequestered_kg", (None, None)))["height_m"]
+
+    result = inventory.histogram(path, "height_m", 12, ranges)
+
+    counts, edges = np.histogram(values.to_numpy(), bins=12, range=(values.min(), values.max()))
+    assert result["counts"] == counts.tolist()
+    np.testing.assert_allclose(result["edges"], edges, rtol=1e-6)
+
+
+def test_histogram_with_an_explicit_range(inventory_file):
+    path, df = inventory_file
+    result = inventory.histogram(path, "height_m", 5, value_range=(0.0, 50.0))
+
+    assert result["edges"] == [0.0, 10.0, 20.0, 30.0, 40.0, 50.0]
+    assert sum(result["counts"]) == len(df)
+
+
+def test_histogram_without_matches(inventory_file):
+    path, _ = inventory_file
+    result = inventory.histogram(path, "co2_sequestered_kg", 10, {"height_m": (46.0, 49.0)})
+
+    assert result == {"column": "co2_sequestered_kg", "edges": [], "counts": []}
+
+
+@pytest.mark.parametrize("edges", [inventory.DEFAULT_HEIGHT_BANDS_M, (10, 20, 30), (0, 50)])
+def test_height_bands(inventory_file, edges):
+    path, df = inventory_file
+
+    bands = inventory.height_bands(path, edges)
+
+    cut = pd.cut(df["height_m"], bins=list(edges), right=False, include_lowest=True)
+    # The last band is closed: trees exactly at the top edge belong to it
+    cut[df["height_m"] == edges[-1]] = cut.cat.categories[-1]
+    groups = df.groupby(cut, observed=False)
+    assert [band["trees"] for band in bands] == groups.size().tolist()
+    np.testing.assert_allclose([band["co2_tonnes"] for band in bands], groups["co2_sequestered_kg"].sum() / 1000)
+    assert [band["min_height_m"] for band in bands] == [float(edge) for edge in edges[:-1]]
+    if edges[-1] == 50:
+        assert bands[-1]["trees"] >= 3
+
+
+def test_height_bands_with_filters(inventory_file):
+    path, df = inventory_file
+    bands = inventory.height_bands(path, (0, 25, 50), {"co2_sequestered_kg": (50.0, None)})
+
+    assert sum(band["trees"] for band in bands) == len(within(df, co2=(50.0, None)))
+
+
+# --- Inventory Endpoints ---
+
+@pytest.fixture
+def project_inventory(client, db, inventory_file):
+    project = models.Project(name="plot", status="COMPLETED")
+    db.add(project)
+    db.commit()
+    project_dir = os.path.join(os.environ["DATA_DIRECTORY"], str(project.id))
+    os.makedirs(project_dir, exist_ok=True)
+    shutil.copy(inventory_file[0], inventory.inventory_path(project_dir))
+    return project.id, inventory_file[1]
+
+
+@pytest.mark.parametrize("params", [
+    {"min_height_m": 20, "max_height_m": 10},
+    {"min_co2_kg": 5, "max_co2_kg": 1},
+])
+def test_endpoints_reject_inverted_ranges(client, project_inventory, params):
+    project_id, _ = project_inventory
+    for view in ("summary", "top", "histogram", "bands"):
+        response = client.get(f"/projects/{project_id}/inventory/{view}", params=params)
+        assert response.status_code == 400, view
+
+
+def test_histogram_endpoint_without_matches(client, project_inventory):
+    project_id, _ = project_inventory
+    response = client.get(f"/projects/{project_id}/inventory/histogram", params={"min_height_m": 60})
+
+    assert response.status_code == 200
+    assert response.json() == {"project_id": project_id, "column": "height_m", "edges": [], "counts": []}
+
+
+def test_bands_endpoint(client, project_inventory):
+    project_id, df = project_inventory
+    response = client.get(f"/projects/{project_id}/inventory/bands", params={"edges": "0,25,50", "min_height_m": 5})
+
+    assert response.status_code == 200
+    assert sum(band["trees"] for band in response.json()["bands"]) == len(within(df, height=(5, None)))
@@ -0,0 +1,74 @@
+# tests/test_metrics.py
+import threading
+
+import numpy as np
+import pytest
+
+from app import metrics
+
+ALLOCATION_BYTES = 400 * 1024 ** 2
+
+
+def allocate():
+    # Touch every page so the allocation counts towards resident memory
+    block = np.ones(ALLOCATION_BYTES // 8)
+    del block
+
+
+def peak_resets():
+    allocate()
+    before = metrics.peak_rss_bytes()
+    metrics.reset_peak_rss()
+    return metrics.peak_rss_bytes() < before - ALLOCATION_BYTES // 2
+
+
+needs_peak_reset = pytest.mark.skipif(not peak_resets(), reason="peak RSS cannot be reset on this platform")
+
+
+@needs_peak_reset
+def test_overlapping_steps_keep_each_others_peaks():
+    allocated, finished = threading.Event(), threading.Event()
+    results = {}
+
+    def first():
+        with metrics.recording() as result:
+            with metrics.step("allocate"):
+                allocate()
+                allocated.set()
+                finished.wait(10)
+        results["first"] = result
+
+    def second():
+        allocated.wait(10)
+        with metrics.recording() as result:
+            with metrics.step("overlap"):
+                pass
+        results["second"] = result
+        finished.set()
+
+    threads = [threading.Thread(target=first), threading.Thread(target=second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(20)
+
+    # The second step starting must not reset away the first step's peak...
+    assert results["first"]["steps"]["allocate"]["peak_rss_bytes"] >= ALLOCATION_BYTES
+    # ...so while they overlap, peaks are process-wide and include the other step
+    assert results["second"]["steps"]["overlap"]["peak_rss_bytes"] >= ALLOCATION_BYTES
+    assert metrics._open_recorders == 0
+
+
+@needs_peak_reset
+def test_nested_steps_report_their_own_peak():
+    with metrics.recording() as result:
+        with metrics.step("outer"):
+            with metrics.step("allocate"):
+                allocate()
+            with metrics.step("small"):
+                pass
+
+    steps = result["steps"]
+    assert steps["allocate"]["peak_rss_bytes"] >= ALLOCATION_BYTES
+    assert steps["outer"]["peak_rss_bytes"] >= ALLOCATION_BYTES
+    assert steps["small"]["peak_rss_bytes"] < ALLOCATION_BYTES
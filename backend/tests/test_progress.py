@@ -0,0 +1,56 @@
+# tests/test_progress.py
+import threading
+
+import pytest
+
+from app import database, models
+from app.progress import StatusReporter
+
+
+class FailingSession:
+    """A session whose commits fail until the database comes back."""
+
+    def __init__(self):
+        self.down = True
+        self.session = database.SessionLocal()
+
+    def execute(self, statement):
+        return self.session.execute(statement)
+
+    def commit(self):
+        if self.down:
+            raise RuntimeError("database is down")
+        self.session.commit()
+
+    def rollback(self):
+        self.session.rollback()
+
+
+@pytest.fixture
+def thread_errors(monkeypatch):
+    errors = []
+    monkeypatch.setattr(threading, "excepthook", errors.append)
+    return errors
+
+
+def test_timer_flush_survives_a_database_error(db, thread_errors):
+    project = models.Project(name="status", status="ACCEPTED")
+    db.add(project)
+    db.commit()
+    session = FailingSession()
+    reporter = StatusReporter(session_factory=lambda: session, flush_interval=0.05)
+    reporter._last_flush = float("inf")  # the first update is not due yet, so it arms the timer
+
+    reporter.update(project.id, "PROCESSING: GENERATING CHM")
+    timer = reporter._timer
+    timer.join(1.0)
+
+    assert thread_errors == []
+    assert reporter._pending == {project.id: {"status": "PROCESSING: GENERATING CHM"}}
+    assert reporter._timer is None
+
+    session.down = False
+    reporter.update(project.id, "PROCESSING: SEGMENTING TREES", final=True)
+    db.expire_all()
+    assert db.get(models.Project, project.id).status == "PROCESSING: SEGMENTING TREES"
+    assert reporter._pending == {}
@@ -0,0 +1,78 @@
+# tests/test_projects.py
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+from app import models
+from app.main import prefix_range
+
+TOP = chr(0x10FFFF)
+
+
+def add_projects(db, names, status="PENDING_UPLOAD", created_at=None):
+    projects = [models.Project(name=name, status=status, created_at=created_at) for name in names]
+    db.add_all(projects)
+    db.commit()
+    return [project.id for project in projects]
+
+
+def matching(db, prefix):
+    query = select(models.Project.name).where(prefix_range(models.Project.name, prefix))
+    return sorted(db.execute(query).scalars())
+
+
+def all_pages(client, **params):
+    ids, after = [], None
+    while True:
+        page = client.get("/projects/", params={**params, **({"after": after} if after is not None else {})}).json()
+        ids.extend(item["id"] for item in page["items"])
+        after = page["next_cursor"]
+        if after is None:
+            return ids
+
+
+def test_prefix_range_matches_startswith(db):
+    names = ["oak", "oak grove", "oaks", "oal", "oa", "Oak", "pine"]
+    add_projects(db, names)
+
+    assert matching(db, "oak") == sorted(name for name in names if name.startswith("oak"))
+
+
+@pytest.mark.parametrize("prefix", ["a\uffff", "a" + TOP, "a" + TOP + TOP, TOP])
+def test_prefix_range_at_the_top_of_the_code_space(db, prefix):
+    names = ["a", "a\ufffe", "a\uffff", "a\uffffz", "a\U00010000", "a" + TOP, "a" + TOP + TOP, TOP, TOP + "x", "b"]
+    add_projects(db, names)
+
+    assert matching(db, prefix) == sorted(name for name in names if name.startswith(prefix))
+
+
+def test_pages_round_trip_through_the_cursor(client, db):
+    ids = add_projects(db, [f"site {i}" for i in range(23)])
+
+    first = client.get("/projects/", params={"limit": 10}).json()
+    assert [item["id"] for item in first["items"]] == sorted(ids, reverse=True)[:10]
+    assert first["next_cursor"] == first["items"][-1]["id"]
+
+    assert all_pages(client, limit=10) == sorted(ids, reverse=True)
+    assert all_pages(client, limit=23) == sorted(ids, reverse=True)
+    assert client.get("/projects/", params={"limit": 23}).json()["next_cursor"] is None
+
+
+def test_pages_split_ties_on_created_at(client, db):
+    # Projects of one batch share a timestamp; the id cursor must neither skip nor repeat them
+    created_at = datetime(2024, 5, 1, 12, 0, 0)
+    tied = add_projects(db, [f"plot {i}" for i in range(7)], created_at=created_at)
+    others = add_projects(db, ["later"], created_at=datetime(2024, 5, 2))
+
+    assert all_pages(client, limit=3) == sorted(tied + others, reverse=True)
+    assert all_pages(client, limit=2, created_before="2024-05-02T00:00:00") == sorted(tied, reverse=True)
+
+
+def test_pages_keep_their_filters_across_the_cursor(client, db):
+    completed = add_projects(db, [f"done {i}" for i in range(5)], status="COMPLETED")
+    add_projects(db, ["failed"], status="FAILED: DSM has no valid pixels")
+    completed += add_projects(db, [f"done {i}" for i in range(5, 9)], status="COMPLETED_WITH_ERRORS")
+
+    assert all_pages(client, limit=4, status="COMPLETED") == sorted(completed, reverse=True)
+    assert all_pages(client, limit=4, status="COMPLETED", name_prefix="done 1") == [completed[1]]
@@ -0,0 +1,39 @@
+# tests/test_raster.py
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+from app import raster
+
+
+class FlatGround:
+    """Ground at a constant height, unknown (NaN) in the first column."""
+
+    def __init__(self, height):
+        self.height = height
+
+    def read(self, window):
+        ground = np.full((window.height, window.width), self.height, dtype=np.float32)
+        ground[:, 0] = np.nan
+        return ground
+
+
+@pytest.mark.parametrize("nodata", [np.nan, -9999.0])
+def test_chm_block_masks_dsm_nodata(tmp_path, nodata):
+    dsm = np.full((4, 5), 112.0, dtype=np.float32)
+    dsm[1, 2] = dsm[3, 4] = nodata
+    path = str(tmp_path / "dsm.tif")
+    with rasterio.open(path, "w", driver="GTiff", width=5, height=4, count=1, dtype="float32",
+                       crs="EPSG:32633", transform=from_origin(500000, 5000000, 0.5, 0.5), nodata=nodata) as dst:
+        dst.write(dsm, 1)
+
+    with rasterio.open(path) as src:
+        chm, dtm = raster.chm_block(src, FlatGround(100.0), Window(0, 0, 5, 4))
+
+    expected = np.full((4, 5), 12.0, dtype=np.float32)
+    expected[:, 0] = expected[1, 2] = expected[3, 4] = raster.CHM_NODATA
+    np.testing.assert_array_equal(chm, expected)
+    assert not np.isnan(chm).any()
+    assert (dtm[:, 0] == raster.CHM_NODATA).all() and (dtm[:, 1:] == 100.0).all()
@@ -0,0 +1,105 @@
+# tests/test_uploads.py
+import hashlib
+import os
+import shutil
+
+import pytest
+
+from app import models, uploads
+from app.main import project_images_dir
+
+DATA = bytes(range(256)) * 40  # 10240 bytes
+
+
+@pytest.fixture
+def project(db):
+    project = models.Project(name="uploads", status="PENDING_UPLOAD")
+    db.add(project)
+    db.commit()
+    # Ids are reused once earlier tests' projects are deleted; start from an empty folder
+    shutil.rmtree(project_images_dir(project.id), ignore_errors=True)
+    os.makedirs(project_images_dir(project.id))
+    return project.id
+
+
+def put(client, project_id, body, content_range=None, name="img.jpg", **headers):
+    if content_range:
+        headers["Content-Range"] = content_range
+    return client.put(f"/projects/{project_id}/uploads/{name}", content=body, headers=headers)
+
+
+def status(client, project_id, name="img.jpg"):
+    return client.get(f"/projects/{project_id}/uploads/{name}").json()
+
+
+def stored(project_id, name="img.jpg"):
+    with open(os.path.join(project_images_dir(project_id), name), "rb") as f:
+        return f.read()
+
+
+def test_chunks_with_a_known_total(client, project):
+    first = put(client, project, DATA[:4096], "bytes 0-4095/10240").json()
+    assert first == {"filename": "img.jpg", "offset": 4096, "complete": False, "duplicate": False, "sha256": None}
+
+    last = put(client, project, DATA[4096:], "bytes 4096-10239/10240").json()
+    assert last["complete"] and last["sha256"] == hashlib.sha256(DATA).hexdigest()
+    assert stored(project) == DATA
+
+
+def test_unknown_total_never_finalizes_early(client, project):
+    for start in range(0, 8192, 4096):
+        response = put(client, project, DATA[start:start + 4096], f"bytes {start}-{start + 4095}/*").json()
+        assert response["complete"] is False and response["offset"] == start + 4096
+    assert not os.path.exists(os.path.join(project_images_dir(project), "img.jpg"))
+
+    assert put(client, project, DATA[8192:], "bytes 8192-10239/10240").json()["complete"]
+    assert stored(project) == DATA
+
+
+@pytest.mark.parametrize("body", [DATA[4096:8192 + 1], DATA[4096:8192 - 1], DATA[4096:]])
+def test_body_must_match_the_range(client, project, body):
+    put(client, project, DATA[:4096], "bytes 0-4095/10240")
+
+    response = put(client, project, body, "bytes 4096-8191/10240")
+
+    assert response.status_code == 400
+    # The rejected chunk is dropped; the client resumes from the old offset
+    assert status(client, project)["offset"] == 4096
+    assert put(client, project, DATA[4096:], "bytes 4096-10239/10240").json()["complete"]
+    assert stored(project) == DATA
+
+
+def test_whole_file_without_content_range(client, project):
+    response = put(client, project, DATA).json()
+
+    assert response["complete"] and response["offset"] == len(DATA)
+    assert stored(project) == DATA
+
+
+def test_offset_mismatch(client, project):
+    put(client, project, DATA[:4096], "bytes 0-4095/10240")
+
+    response = put(client, project, DATA[5000:6000], "bytes 5000-5999/10240")
+
+    assert response.status_code == 409 and response.json()["detail"]["offset"] == 4096
+
+
+def test_concurrent_request_for_the_same_file(client, project):
+    put(client, project, DATA[:4096], "bytes 0-4095/10240")
+
+    with uploads.locked_partial(project_images_dir(project), "img.jpg"):
+        response = put(client, project, DATA[4096:], "bytes 4096-10239/10240")
+
+    assert response.status_code == 409 and response.json()["detail"]["offset"] == 4096
+    assert put(client, project, DATA[4096:], "bytes 4096-10239/10240").json()["complete"]
+
+
+def test_known_duplicate_discards_the_partial_file(client, project):
+    put(client, project, DATA, name="a.jpg")
+    put(client, project, DATA[:4096], "bytes 0-4095/10240", name="b.jpg")
+
+    response = put(client, project, DATA[4096:], "bytes 4096-10239/10240", name="b.jpg",
+                   **{"X-Content-SHA256": hashlib.sha256(DATA).hexdigest()}).json()
+
+    assert response["duplicate"] and response["filename"] == "a.jpg"
+    assert not os.path.exists(uploads.partial_path(project_images_dir(project), "b.jpg"))
@@ -0,0 +1,96 @@
+# tests/test_zonal.py
+import numpy as np
+import pandas as pd
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from scipy import ndimage as ndi
+from shapely.geometry import box
+
+from app import zonal
+
+
+def expected_stats(values, labels, index, percentile=zonal.HEIGHT_PERCENTILE):
+    """Reference: ndimage for max/mean, np.percentile per label; NaN for empty labels."""
+    maxima, means, percentiles = [], [], []
+    for label in index:
+        pixels = values[labels == label]
+        if pixels.size == 0:
+            maxima.append(np.nan), means.append(np.nan), percentiles.append(np.nan)
+            continue
+        maxima.append(ndi.maximum(values, labels, label))
+        means.append(ndi.mean(values, labels, label))
+        percentiles.append(np.percentile(pixels, percentile))
+    return dict(zip(zonal.HEIGHT_COLUMNS, (np.array(maxima), np.array(means), np.array(percentiles))))
+
+
+def assert_stats_equal(actual, expected):
+    for column in zonal.HEIGHT_COLUMNS:
+        np.testing.assert_allclose(actual[column], expected[column], rtol=1e-6, equal_nan=True, err_msg=column)
+
+
+def test_matches_reference_on_random_labels():
+    rng = np.random.default_rng(0)
+    values = rng.normal(10, 5, (64, 64)).astype(np.float32)
+    labels = rng.integers(0, 12, (64, 64)).astype(np.int32)
+    index = np.arange(1, 12)
+    assert_stats_equal(zonal.label_stats(values, labels, index), expected_stats(values, labels, index))
+
+
+def test_negative_values_keep_their_order():
+    values = np.array([[-3.0, -1.0, -2.0, 4.0], [-0.5, -7.0, 2.0, 0.0]], dtype=np.float32)
+    labels = np.array([[1, 1, 1, 2], [1, 1, 2, 2]], dtype=np.int32)
+    stats = zonal.label_stats(values, labels, [1, 2])
+    assert_stats_equal(stats, expected_stats(values, labels, [1, 2]))
+    assert stats["height_max_m"][0] == pytest.approx(-0.5)
+
+
+def test_single_pixel_labels():
+    values = np.array([[1.5, 0.0], [2.5, 9.0]], dtype=np.float32)
+    labels = np.array([[1, 0], [2, 3]], dtype=np.int32)
+    stats = zonal.label_stats(values, labels, [1, 2, 3])
+    for column in zonal.HEIGHT_COLUMNS:
+        np.testing.assert_allclose(stats[column], [1.5, 2.5, 9.0])
+
+
+def test_empty_labels_are_nan():
+    values = np.ones((4, 4), dtype=np.float32)
+    labels = np.zeros((4, 4), dtype=np.int32)
+    labels[0, 0] = 2
+    stats = zonal.label_stats(values, labels, [1, 2, 5])
+    for column in zonal.HEIGHT_COLUMNS:
+        assert np.isnan(stats[column][[0, 2]]).all()
+        assert stats[column][1] == pytest.approx(1.0)
+
+    no_crowns = zonal.label_stats(values, np.zeros((4, 4), dtype=np.int32), [1])
+    assert all(np.isnan(no_crowns[column]).all() for column in zonal.HEIGHT_COLUMNS)
+    assert all(zonal.label_stats(values, labels, [])[column].size == 0 for column in zonal.HEIGHT_COLUMNS)
+
+
+def test_min_value_counts_as_zero():
+    values = np.array([[0.5, 3.0, -1.0]], dtype=np.float32)
+    labels = np.array([[1, 1, 1]], dtype=np.int32)
+    stats = zonal.label_stats(values, labels, [1], min_value=1.0)
+    expected = expected_stats(np.array([[0.0, 3.0, 0.0]]), labels, [1])
+    assert_stats_equal(stats, expected)
+
+
+def test_crown_zonal_stats_ignores_nodata(tmp_path):
+    nodata = -9999.0
+    values = np.arange(16, dtype=np.float32).reshape(4, 4)
+    values[0, 1] = nodata
+    chm_path = str(tmp_path / "chm.tif")
+    transform = from_origin(0, 4, 1, 1)
+    with rasterio.open(chm_path, "w", driver="GTiff", width=4, height=4, count=1, dtype="float32",
+                       nodata=nodata, transform=transform) as dst:
+        dst.write(values, 1)
+
+    # Crown 1 covers the top-left 2x2 block (one nodata pixel), crown 2 the bottom row
+    crowns = pd.DataFrame({"label_id": [1, 2], "geometry": [box(0, 2, 2, 4), box(0, 0, 4, 1)]})
+    stats = zonal.crown_zonal_stats(chm_path, crowns).set_index("label_id")
+
+    crown_1 = np.array([0.0, 4.0, 5.0])
+    assert stats.loc[1, "height_max_m"] == pytest.approx(5.0)
+    assert stats.loc[1, "height_mean_m"] == pytest.approx(crown_1.mean())
+    assert stats.loc[1, f"height_p{zonal.HEIGHT_PERCENTILE}_m"] == pytest.approx(np.percentile(crown_1, zonal.HEIGHT_PERCENTILE))
+    assert stats.loc[2, "height_mean_m"] == pytest.approx(values[3].mean())
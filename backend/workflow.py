@@ -147,10 +147,50 @@ def upload_images(project_id, images_folder):
 # ============================================================================
 # STEP 3: MONITOR PROCESSING
 # ============================================================================
+def get_project(project_id):
+    response = requests.get(f"{BASE_URL}/projects/{project_id}", timeout=5)
+    return response.json() if response.status_code == 200 else None
+
 def monitor_processing(project_id, max_wait_seconds=300):
-    """Monitor project processing status"""
+    """Monitor project processing through the server's progress event stream"""
     print_header("STEP 3: Monitoring Processing")
     
+    start_time = time.time()
+    try:
+        # Keepalives arrive every 15 seconds, so a 30 second read timeout means the stream is dead
+        with requests.get(f"{BASE_URL}/projects/{project_id}/events", stream=True, timeout=(5, 30)) as response:
+            if response.status_code != 200:
+                raise ConnectionError(f"events stream unavailable (Status: {response.status_code})")
+            
+            for line in response.iter_lines(decode_unicode=True):
+                elapsed = int(time.time() - start_time)
+                if elapsed > max_wait_seconds:
+                    print_warning(f"Timeout after {max_wait_seconds} seconds")
+                    print_info("Processing may still be running in background")
+                    return None, get_project(project_id)
+                if not line or not line.startswith("data:"):
+                    continue
+                
+                event = json.loads(line[len("data:"):])
+                timing = f" ({event['stage_elapsed_s']:.1f}s in stage)" if "stage_elapsed_s" in event else ""
+                print(f"[{elapsed:3d}s] {event['percent']:5.1f}% {event['stage']}: {event['status']}{timing}")
+                
+                if event["stage"] == "completed":
+                    for stage, seconds in event.get("timings", {}).items():
+                        print_info(f"{stage}: {seconds:.1f}s")
+                    print_success("Processing completed successfully!")
+                    return True, get_project(project_id)
+                elif event["stage"] == "failed":
+                    print_error(f"Processing failed: {event['status']}")
+                    return False, get_project(project_id)
+    except Exception as e:
+        print_warning(f"Progress stream unavailable ({e}); falling back to polling")
+    
+    remaining = max(0, max_wait_seconds - int(time.time() - start_time))
+    return poll_processing(project_id, remaining)
+
+def poll_processing(project_id, max_wait_seconds=300):
+    """Monitor project processing status by polling (for servers without the events stream)"""
     start_time = time.time()
     check_interval = 5  # Check every 5 seconds
     attempt = 0
@@ -213,31 +253,115 @@ def display_results(project_id, project_data):
     if project_data.get('crowns_path'):
         print(f"  • Tree Crowns (GeoPackage): {project_data['crowns_path']}")
     if project_data.get('carbon_results_path'):
-        print(f"  • Carbon Results (CSV): {project_data['carbon_results_path']}")
-        
-        # Try to read and display CSV results
-        try:
-            import pandas as pd
-            csv_path = project_data['carbon_results_path']
-            if Path(csv_path).exists():
-                df = pd.read_csv(csv_path)
-                print(f"\n📊 Tree Analysis Summary:")
-                print(f"  • Total Trees Detected: {len(df)}")
-                if 'height_m' in df.columns:
-                    print(f"  • Average Tree Height: {df['height_m'].mean():.2f} m")
-                if 'crown_area_sqm' in df.columns:
-                    print(f"  • Average Crown Area: {df['crown_area_sqm'].mean():.2f} m²")
-                if 'co2_sequestered_kg' in df.columns:
-                    total_co2 = df['co2_sequestered_kg'].sum() / 1000
-                    print(f"  • Total CO2 Sequestered: {total_co2:.2f} tonnes")
-                
-                print(f"\nFirst 5 trees:")
-                print(df.head().to_string())
-                
-        except ImportError:
-            print_warning("Pandas not installed - cannot read CSV results")
-        except Exception as e:
-            print_warning(f"Could not read results CSV: {e}")
+        print(f"  • Carbon Inventory (Parquet): {project_data['carbon_results_path']}")
+
+    # Aggregates come from the inventory query endpoints; the inventory file itself is never downloaded
+    try:
+        summary = requests.get(f"{BASE_URL}/projects/{project_id}/inventory/summary", timeout=10)
+        if summary.status_code == 200:
+            summary = summary.json()
+            print(f"\n📊 Tree Analysis Summary:")
+            print(f"  • Total Trees Detected: {summary['trees']}")
+            if summary['mean_height_m'] is not None:
+                print(f"  • Average Tree Height: {summary['mean_height_m']:.2f} m")
+            if summary['mean_crown_area_sqm'] is not None:
+                print(f"  • Average Crown Area: {summary['mean_crown_area_sqm']:.2f} m²")
+            print(f"  • Total CO2 Sequestered: {summary['total_co2_tonnes']:.2f} tonnes")
+
+            top = requests.get(
+                f"{BASE_URL}/projects/{project_id}/inventory/top",
+                params={"n": 5, "columns": "height_m,crown_area_sqm"},
+                timeout=10
+            ).json()
+            print(f"\nTop 5 trees by CO2:")
+            for tree in top['trees']:
+                print(f"  • Tree {tree['tree_id']}: {tree['height_m']:.1f} m, "
+                      f"{tree['crown_area_sqm']:.1f} m², {tree['co2_sequestered_kg']:.1f} kg CO2")
+        else:
+            print_warning(f"No carbon inventory available (Status: {summary.status_code})")
+    except Exception as e:
+        print_warning(f"Could not query the carbon inventory: {e}")
+
+# ============================================================================
+# BATCH WORKFLOW (many plots, constant number of API round-trips)
+# ============================================================================
+def find_images(images_folder):
+    images_path = Path(images_folder)
+    patterns = ("*.jpg", "*.jpeg", "*.png", "*.tif", "*.tiff")
+    return [img for pattern in patterns for img in images_path.glob(pattern)]
+
+def create_batch(name, project_names):
+    """Create a batch and all of its projects in one request"""
+    print_header("BATCH STEP 1: Creating Batch")
+    response = requests.post(
+        f"{BASE_URL}/batches/",
+        json={"name": name, "projects": [{"name": project_name} for project_name in project_names]},
+        timeout=30
+    )
+    if response.status_code != 200:
+        print_error(f"Failed to create batch (Status: {response.status_code})")
+        print(f"  Response: {response.text}")
+        return None
+    batch = response.json()
+    print_success(f"Batch {batch['id']} created with {len(batch['projects'])} project(s)")
+    return batch
+
+def upload_images_without_processing(project_id, images_folder):
+    """Upload images through the resumable endpoint, which does not start processing"""
+    image_files = find_images(images_folder)
+    for img in image_files:
+        with open(img, 'rb') as f:
+            response = requests.put(f"{BASE_URL}/projects/{project_id}/uploads/{img.name}", data=f, timeout=300)
+        if response.status_code != 200:
+            print_error(f"Upload of {img.name} failed (Status: {response.status_code})")
+            return False
+    print_success(f"Project {project_id}: {len(image_files)} image(s) uploaded from {images_folder}")
+    return True
+
+def monitor_batch(batch_id, max_wait_seconds=1800):
+    """Poll the aggregated batch status (one request per check, however many projects)"""
+    print_header("BATCH STEP 3: Monitoring Batch")
+    start_time = time.time()
+    while True:
+        response = requests.get(f"{BASE_URL}/batches/{batch_id}", timeout=10)
+        if response.status_code != 200:
+            print_error(f"Failed to get batch status (Status: {response.status_code})")
+            return None
+        batch = response.json()
+        elapsed = int(time.time() - start_time)
+        counts = ", ".join(f"{phase} {count}" for phase, count in batch['phase_counts'].items() if count)
+        print(f"[{elapsed:3d}s] {batch['status']}: {batch['percent_finished']:5.1f}% finished ({counts})")
+
+        if batch['status'] in ("COMPLETED", "COMPLETED_WITH_ERRORS", "FAILED"):
+            return batch['status']
+        if elapsed > max_wait_seconds:
+            print_warning(f"Timeout after {max_wait_seconds} seconds")
+            return None
+        time.sleep(5)
+
+def run_batch(batch_name, image_folders):
+    """Create, upload, start and monitor one project per images folder as a single batch"""
+    batch = create_batch(batch_name, [Path(folder).name for folder in image_folders])
+    if not batch:
+        sys.exit(1)
+
+    print_header("BATCH STEP 2: Uploading Images")
+    for project, folder in zip(batch['projects'], image_folders):
+        upload_images_without_processing(project['id'], folder)
+
+    response = requests.post(f"{BASE_URL}/batches/{batch['id']}/process", timeout=30)
+    if response.status_code != 200:
+        print_error(f"Failed to start batch (Status: {response.status_code})")
+        sys.exit(1)
+    print_success(response.json()['message'])
+
+    status = monitor_batch(batch['id'])
+    results = requests.get(f"{BASE_URL}/batches/{batch['id']}/results", timeout=10).json()
+    print_header("BATCH STEP 4: Results Summary")
+    for project in results['projects']:
+        co2 = f"{project['total_co2_tonnes']:.2f} t" if project['total_co2_tonnes'] is not None else "-"
+        print(f"  • {project['id']:5d} {project['name']:30s} {project['status'][:40]:40s} {co2}")
+    print(f"\nBatch CO2 Sequestered: {Colors.BOLD}{results['total_co2_tonnes']:.2f}{Colors.END} tonnes ({status})")
 
 # ============================================================================
 # MAIN WORKFLOW
@@ -280,4 +404,8 @@ def main():
     print(f"\n{Colors.BOLD}{Colors.CYAN}{'='*60}{Colors.END}\n")
 
 if __name__ == "__main__":
-    main()
+    # python workflow.py --batch <images folder> [<images folder> ...]  (one project per folder)
+    if len(sys.argv) > 2 and sys.argv[1] == "--batch":
+        run_batch(PROJECT_NAME, sys.argv[2:])
+    else:
+        main()